@@ -0,0 +1,61 @@
+"""Benchmark of the LQR backward kernel.
+
+Compares one backward pass per condition against a single batched pass, for each available backend.
+
+Usage: python benchmarks/benchmark_lqr_kernel.py [-B 8] [-T 100] [-dX 26] [-dU 7]
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from gps.algorithm.traj_opt.lqr_kernel import lqr_backward, LQRWorkspace, random_problem
+
+
+def main():
+    """Times sequential and batched backward passes of each backend and checks that the backends agree."""
+    parser = argparse.ArgumentParser(description='Benchmark the LQR backward kernel.')
+    parser.add_argument('-B', type=int, default=8, help='batch size, i.e. conditions x eta candidates')
+    parser.add_argument('-T', type=int, default=100, help='time horizon')
+    parser.add_argument('-dX', type=int, default=26, help='state dimension')
+    parser.add_argument('-dU', type=int, default=7, help='action dimension')
+    parser.add_argument('-n', type=int, default=20, help='repetitions')
+    args = parser.parse_args()
+
+    Cm, cv, Fm, fv = random_problem(args.B, args.T, args.dX, args.dU)
+    workspace = LQRWorkspace()
+
+    backends = ['numpy']
+    try:
+        import numba  # noqa: F401
+        backends.append('numba')
+        lqr_backward(Cm[:1], cv[:1], Fm[:1], fv[:1], backend='numba')  # Compile.
+    except ImportError:
+        print('numba not installed, skipping numba backend')
+
+    def sequential(backend):
+        """Runs one backward pass per condition."""
+        for b in range(args.B):
+            lqr_backward(Cm[b:b + 1], cv[b:b + 1], Fm[b:b + 1], fv[b:b + 1], workspace, backend)
+
+    def batched(backend):
+        """Runs one backward pass for all conditions."""
+        lqr_backward(Cm, cv, Fm, fv, workspace, backend)
+
+    print('B=%d, T=%d, dX=%d, dU=%d' % (args.B, args.T, args.dX, args.dU))
+    reference = None
+    for backend in backends:
+        for name, run in (('sequential', sequential), ('batched', batched)):
+            ms = 1e3 * min(timeit.repeat(lambda: run(backend), number=1, repeat=args.n))
+            reference = reference or ms
+            print('%-6s %-10s %8.2f ms  (x%.1f)' % (backend, name, ms, reference / ms))
+
+    # Check that the backends agree.
+    if 'numba' in backends:
+        K_np = lqr_backward(Cm, cv, Fm, fv, workspace, 'numpy')[0]
+        K_nb = lqr_backward(Cm, cv, Fm, fv, workspace, 'numba')[0]
+        print('max |K_numpy - K_numba|: %.2e' % np.max(np.abs(K_np - K_nb)))
+
+
+if __name__ == '__main__':
+    main()
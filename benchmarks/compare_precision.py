@@ -0,0 +1,98 @@
+"""Compares an experiment run in float32 against the float64 reference.
+
+Both algorithms are iterated on the same samples, which are taken with the controllers of the float64 reference and
+added to both algorithms, so that both fit their dynamics the same way. After each iteration, the new controllers are
+compared per condition by the relative error of the feedback gains, the KL divergence of the float32 controller from
+the reference under the reference trajectory marginals, and the dual variable eta.
+
+Usage: python benchmarks/compare_precision.py <experiment> [-i 3]
+"""
+import argparse
+import copy
+import imp
+import logging
+from pathlib import Path
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from main import GPSMain  # noqa: E402
+from gps.algorithm.traj_opt.traj_opt_utils import calc_traj_distr_kl  # noqa: E402
+
+
+def make_candidate(config, agent, data_files_dir):
+    """Creates the float32 algorithm from a copy of the algorithm hyperparameters."""
+    config['dtype'] = 'float32'
+    config['agent'] = agent
+    if 'policy_opt' in config:
+        # Build the policy network in a separate graph, so that it does not share variables with the reference.
+        import tensorflow as tf
+        with tf.Graph().as_default():
+            algorithm = config['type'](config)
+    else:
+        algorithm = config['type'](config)
+
+    # Prefix the plots of the candidate, so that they do not overwrite those of the reference.
+    algorithm._data_files_dir = data_files_dir + 'float32_'
+    for attr in ('traj_opt', 'policy_opt'):
+        if hasattr(algorithm, attr):
+            getattr(algorithm, attr)._data_files_dir = algorithm._data_files_dir
+    algorithm.X_labels = sum([[sensor] * agent.sensor_dims[sensor] for sensor in agent.x_data_types], [])
+    return algorithm
+
+
+def main():
+    """Iterates the float64 reference and the float32 candidate on the same samples and prints their differences."""
+    parser = argparse.ArgumentParser(description='Compare an experiment in float32 against float64.')
+    parser.add_argument('experiment', type=str, help='experiment name')
+    parser.add_argument('-i', '--iterations', type=int, default=3, help='number of iterations')
+    args = parser.parse_args()
+
+    hyperparams_file = Path('experiments/') / args.experiment / 'hyperparams.py'
+    if not hyperparams_file.is_file():
+        sys.exit("Experiment '%s' does not exist." % args.experiment)
+    logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.WARN)
+
+    hyperparams = imp.load_source('hyperparams', str(hyperparams_file))
+    seed = hyperparams.config.get('random_seed', 0)
+    random.seed(seed)
+    np.random.seed(seed)
+
+    # The algorithm hyperparameters are copied before GPSMain adds the agent to them.
+    candidate_config = copy.deepcopy(hyperparams.config['algorithm'])
+    gps = GPSMain(hyperparams.config)
+    reference = gps.algorithm
+    candidate = make_candidate(candidate_config, gps.agent, gps._data_files_dir)
+
+    for itr in range(args.iterations):
+        gps.iteration_count = itr
+        for algorithm in (reference, candidate):
+            for attr in ('traj_opt', 'policy_opt'):
+                if hasattr(algorithm, attr):
+                    getattr(algorithm, attr).iteration_count = itr
+
+        for cond in gps._train_idx:
+            for i in range(gps._hyperparams['num_samples']):
+                gps._take_sample(cond, i)
+        sample_lists = [gps.agent.get_samples(cond, -gps._hyperparams['num_samples']) for cond in gps._train_idx]
+        # _take_sample only adds the samples to the reference, e.g. to stream them into DynamicsLRStreaming.
+        for cond, sample_list in zip(gps._train_idx, sample_lists):
+            for sample in sample_list:
+                candidate.add_sample(cond, sample)
+
+        reference.iteration(sample_lists, itr)
+        candidate.iteration(sample_lists, itr)
+
+        print('*** Iteration %02d ***' % itr)
+        print('%4s %12s %12s %12s %12s' % ('cond', 'K rel err', 'KL(32||64)', 'eta64', 'eta32'))
+        for m in range(reference.M):
+            ref_distr, cand_distr = reference.cur[m].traj_distr, candidate.cur[m].traj_distr
+            K_err = np.max(np.abs(cand_distr.K - ref_distr.K)) / np.max(np.abs(ref_distr.K))
+            kl = calc_traj_distr_kl(reference.new_mu[m], reference.new_sigma[m], cand_distr, ref_distr)
+            print('%4d %12.3e %12.3e %12.4g %12.4g' % (m, K_err, kl, reference.cur[m].eta, candidate.cur[m].eta))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,10 @@ from gps.agent.agent_utils import generate_noise
 from gps.sample import Sample
 from gps.proto.gps_pb2 import ACTION
 
+# MuJoCo joint types with a quaternion in the joint positions.
+MJ_JOINT_FREE = 0
+MJ_JOINT_BALL = 1
+
 
 class AgentOpenAIGym(Agent):
     """An Agent for gym environments."""
@@ -33,6 +37,8 @@ class AgentOpenAIGym(Agent):
             self.env = self.env.env
 
         self.sim = self.env.sim
+        # Simulators of the batched finite differences, see linearize.
+        self._sim_pool = None
         if is_goal_based(self.env):
             dX = (
                 self.env.observation_space.spaces['observation'].shape[0] +
@@ -89,6 +95,8 @@ class AgentOpenAIGym(Agent):
             for _ in range(5):
                 self.sim.step()
             obs = self.env.step(np.zeros(self.dU))[0]
+        # Keep the initial simulator state, to linearize the dynamics along the trajectory, see linearize.
+        sample.sim_state = self.sim.get_state()
 
         self.set_states(sample, obs, 0)
         U_0 = policy.act(sample.get_X(0), sample.get_obs(0), 0, noise)
@@ -111,8 +119,118 @@ class AgentOpenAIGym(Agent):
             self._samples[condition].append(sample)
         return sample
 
-    def set_states(self, sample, obs, t):
-        """Reads individual sensors from obs and store them in the sample."""
+    def linearize(self, sim_state, U, eps=1e-4):
+        """Linearizes the simulated dynamics along a trajectory by batched finite differences.
+
+        The actions U are applied open loop, starting from sim_state. At each time step, the simulator state is
+        snapshotted and each coordinate of the joint positions, joint velocities and actions is perturbed in both
+        directions. Joint positions are perturbed in the tangent space of the joints, so that the quaternions of free
+        and ball joints stay normalized. The nominal and all perturbed transitions of a time step are stepped together
+        on a pool of simulators, which steps them in parallel. The linearization is fitted to the batch of perturbed
+        transitions by least squares, as the states are functions of the simulator state rather than the simulator
+        state itself.
+
+        This only works with MuJoCo envs. The states are read from the simulator with the `_get_obs` of the env, and
+        the actions are applied like its step: with `_set_action` for robotics envs, and as controls held for
+        `frame_skip` simulator steps for the other MuJoCo envs. Step callbacks of robotics envs are not run. As the env
+        itself is not stepped, the transitions do not count towards the time limit of wrappers.
+
+        Args:
+            sim_state: Initial simulator state.
+            U: A T x dU array of actions.
+            eps: Size of the perturbations.
+
+        Returns:
+            X: A T x dX array of the states along the trajectory.
+            Fm: A T - 1 x dX x (dX + dU) array of the linear components, around X and U.
+
+        """
+        from mujoco_py import MjSim, MjSimPool
+
+        env = self.env.unwrapped
+        T, dX, dU = U.shape[0], self.dX, self.dU
+        X = np.empty((T, dX))
+        Fm = np.empty((T - 1, dX, dX + dU))
+
+        self.sim.set_state(sim_state)
+        self.sim.forward()
+        X[0] = self.get_state(env._get_obs())
+        dv = len(sim_state.qvel)
+        # The nominal transition followed by the perturbations in both directions.
+        perturbations = eps * np.concatenate([np.zeros((1, 2 * dv + dU)), np.eye(2 * dv + dU), -np.eye(2 * dv + dU)])
+        if self._sim_pool is None or len(self._sim_pool.sims) != len(perturbations):
+            self._sim_pool = MjSimPool([MjSim(self.sim.model) for _ in perturbations], nsubsteps=self.sim.nsubsteps)
+        sims = self._sim_pool.sims
+
+        for t in range(T - 1):
+            state = self.sim.get_state()
+
+            # Perturb the states and apply the actions on the simulator of the env, then copy them to the pool.
+            dXU = np.empty((len(perturbations), dX + dU))
+            for sim, delta, row in zip(sims, perturbations, dXU):
+                qpos = self._integrate_qpos(state.qpos, delta[:dv])
+                perturbed = state._replace(qpos=qpos, qvel=state.qvel + delta[dv:2 * dv])
+                self.sim.set_state(perturbed)
+                self.sim.forward()
+                row[:dX] = self.get_state(env._get_obs())
+                row[dX:] = U[t] + delta[2 * dv:]
+                num_steps = self._apply_action(env, row[dX:])
+                sim.set_state(perturbed)
+                sim.data.ctrl[:] = self.sim.data.ctrl
+                if self.sim.model.nmocap:
+                    sim.data.mocap_pos[:] = self.sim.data.mocap_pos
+                    sim.data.mocap_quat[:] = self.sim.data.mocap_quat
+
+            # Step all transitions at once.
+            for _ in range(num_steps):
+                self._sim_pool.step()
+            dX_next = np.empty((len(perturbations), dX))
+            for sim, row in zip(sims, dX_next):
+                self.sim.set_state(sim.get_state())
+                self.sim.forward()
+                row[:] = self.get_state(env._get_obs())
+
+            # The trajectory continues from the nominal transition.
+            self.sim.set_state(sims[0].get_state())
+            X[t + 1] = dX_next[0]
+            dXU -= dXU[0]
+            dX_next -= dX_next[0]
+
+            # Least squares fit, with the minimum norm solution for state dimensions that are not perturbed.
+            Fm[t] = np.linalg.lstsq(dXU[1:], dX_next[1:], rcond=None)[0].T
+        return X, Fm
+
+    def _apply_action(self, env, action):
+        """Applies an action to the simulator of the env like its step and returns the number of simulator steps."""
+        if hasattr(env, '_set_action'):  # Robotics envs.
+            env._set_action(np.clip(action, env.action_space.low, env.action_space.high))
+            return 1
+        self.sim.data.ctrl[:] = action
+        return env.frame_skip
+
+    def _integrate_qpos(self, qpos, dq):
+        """Returns the joint positions displaced by the tangent vector dq, like mj_integratePos.
+
+        Args:
+            qpos: Joint positions.
+            dq: Displacement with one entry per degree of freedom, i.e. of the size of the joint velocities.
+
+        """
+        model = self.sim.model
+        qpos = qpos.copy()
+        for j in range(model.njnt):
+            a, d = model.jnt_qposadr[j], model.jnt_dofadr[j]
+            if model.jnt_type[j] == MJ_JOINT_FREE:
+                qpos[a:a + 3] += dq[d:d + 3]
+                qpos[a + 3:a + 7] = quat_integrate(qpos[a + 3:a + 7], dq[d + 3:d + 6])
+            elif model.jnt_type[j] == MJ_JOINT_BALL:
+                qpos[a:a + 4] = quat_integrate(qpos[a:a + 4], dq[d:d + 3])
+            else:  # Slide and hinge joints.
+                qpos[a] += dq[d]
+        return qpos
+
+    def get_state(self, obs):
+        """Returns the state vector of an observation."""
         if is_goal_based(self.env):
             X = np.concatenate([obs['observation'], np.asarray(obs['desired_goal']) - np.asarray(obs['achieved_goal'])])
         else:
@@ -121,6 +239,11 @@ class AgentOpenAIGym(Agent):
         # Scale states
         if self.scaler:
             X = self.scaler.transform([X])[0]
+        return X
+
+    def set_states(self, sample, obs, t):
+        """Reads individual sensors from obs and store them in the sample."""
+        X = self.get_state(obs)
 
         for sensor, idx in self._x_data_idx.items():
             sample.set(sensor, X[idx], t)
@@ -132,3 +255,19 @@ class AgentOpenAIGym(Agent):
 def is_goal_based(env):
     """Determines wherter a gym environemtn is goal based, i.e. supplies `desired_goal` and `achieved_goal`."""
     return isinstance(env.observation_space, gym.spaces.Dict)
+
+
+def quat_integrate(quat, rotvec):
+    """Rotates a quaternion (w, x, y, z) by a rotation vector in its local frame, like mju_quatIntegrate."""
+    angle = np.linalg.norm(rotvec)
+    if angle == 0:
+        return quat
+    w1, x1, y1, z1 = quat
+    w2, (x2, y2, z2) = np.cos(angle / 2), np.sin(angle / 2) * rotvec / angle
+    quat = np.array([
+        w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+        w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+        w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+        w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+    ])
+    return quat / np.linalg.norm(quat)
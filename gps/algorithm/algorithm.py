@@ -51,7 +51,24 @@ class Algorithm(ABC):
 
         self.new_mu = [None] * self.M
         self.new_sigma = [None] * self.M
+
+        # Propagate floating point precision and time windows.
+        dtype = self._hyperparams['dtype']
+        for sub_hyperparams in (self._hyperparams['dynamics'], self._hyperparams['traj_opt']):
+            if sub_hyperparams is not None:
+                sub_hyperparams.setdefault('dtype', dtype)
+                sub_hyperparams.setdefault('time_window', self._hyperparams['time_window'])
+                if 'prior' in sub_hyperparams:
+                    sub_hyperparams['prior'].setdefault('dtype', dtype)
+        if self._hyperparams['traj_opt'] is not None:
+            self._hyperparams['traj_opt'].setdefault('num_conditions', self.M)
+
         dynamics = self._hyperparams['dynamics']
+        if self._hyperparams['dynamics_sample_reuse']:
+            if dynamics is None or not dynamics['type'].supports_sample_weights:
+                raise ValueError('dynamics_sample_reuse requires dynamics that support sample weights')
+            if self._hyperparams['sample_on_policy']:
+                raise ValueError('dynamics_sample_reuse is incompatible with sample_on_policy')
         for m in range(self.M):
             self.cur[m].traj_info = TrajectoryInfo()
             if dynamics is not None:
@@ -62,6 +79,15 @@ class Algorithm(ABC):
             )
             self.cur[m].traj_distr = init_traj_distr['type'](init_traj_distr)
 
+        # Share the dynamics priors within groups of conditions.
+        self._prior_groups = self._get_prior_groups()
+        for group in self._prior_groups:
+            if len(group) > 1:
+                prior = dynamics['prior']
+                shared_prior = prior['type'](dict(prior, num_conditions=len(group)))
+                for m in group:
+                    self.cur[m].traj_info.dynamics.prior = shared_prior
+
         #self.traj_opt = hyperparams['traj_opt']['type'](
         #    hyperparams['traj_opt']
         #)
@@ -73,17 +99,58 @@ class Algorithm(ABC):
         """Run iteration of the algorithm."""
         pass
 
+    def add_sample(self, m, sample):
+        """Pass a sample to the dynamics of a condition as soon as it is collected.
+
+        Args:
+            m: Condition
+            sample: A Sample object.
+
+        """
+        dynamics = self.cur[m].traj_info.dynamics
+        if dynamics is not None:
+            dynamics.add_sample(sample.get_X(), sample.get_U())
+
+    def _get_prior_groups(self):
+        """Returns the groups of conditions that share a dynamics prior, as lists of condition indices."""
+        groups = self._hyperparams['dynamics_prior_groups']
+        if groups is None or self._hyperparams['dynamics'] is None:
+            return [[m] for m in range(self.M)]
+        if groups == 'all':
+            return [list(range(self.M))]
+        grouped = [m for group in groups for m in group]
+        if len(set(grouped)) != len(grouped) or not set(grouped) <= set(range(self.M)):
+            raise ValueError('Invalid dynamics prior groups %r for %d conditions' % (groups, self.M))
+        return [list(group) for group in groups] + [[m] for m in range(self.M) if m not in grouped]
+
     def _update_dynamics(self):
         """Instantiate dynamics objects and update prior. Fit dynamics to current samples."""
         with Timer(self.timers, 'dynamics_fit'):
+            # Update the priors, once per group on the pooled samples of its conditions.
+            for group in self._prior_groups:
+                if len(group) == 1:
+                    self.cur[group[0]].traj_info.dynamics.update_prior(self.cur[group[0]].sample_list)
+                else:
+                    self.cur[group[0]].traj_info.dynamics.get_prior().update(
+                        np.concatenate([self.cur[m].sample_list.get_X() for m in group]),
+                        np.concatenate([self.cur[m].sample_list.get_U() for m in group]),
+                        conditions=np.concatenate([np.full(len(self.cur[m].sample_list), m) for m in group]),
+                    )
+
             for m in range(self.M):
                 cur_data = self.cur[m].sample_list
                 X = cur_data.get_X()
                 U = cur_data.get_U()
 
-                # Update prior and fit dynamics.
-                self.cur[m].traj_info.dynamics.update_prior(cur_data)
-                self.cur[m].traj_info.dynamics.fit(X, U)
+                # Fit dynamics.
+                if self._hyperparams['dynamics_sample_reuse'] and self.prev[m].sample_list is not None:
+                    X_prev, U_prev, dwts = self._importance_weights(m)
+                    self.cur[m].traj_info.dynamics.fit(
+                        np.concatenate([X, X_prev]), np.concatenate([U, U_prev]),
+                        dwts=np.concatenate([np.ones(X.shape[:2]), dwts])
+                    )
+                else:
+                    self.cur[m].traj_info.dynamics.fit(X, U)
 
                 # Update mean and covariance
                 mu = np.concatenate((X[:, :, :], U[:, :, :]), axis=2)
@@ -100,7 +167,10 @@ class Algorithm(ABC):
 
                 prior = self.cur[m].traj_info.dynamics.get_prior()
                 if prior:
-                    mu0, Phi, priorm, n0 = prior.initial_state()
+                    # The samples of a shared prior are pooled across conditions, so it is evaluated on the stored
+                    # initial states of this condition.
+                    shared = any(m in group and len(group) > 1 for group in self._prior_groups)
+                    mu0, Phi, priorm, n0 = prior.initial_state(m if shared else None)
                     N = len(cur_data)
                     self.cur[m].traj_info.x0sigma += (
                         Phi + (N * priorm) / (N + priorm) * np.outer(x0mu - mu0, x0mu - mu0) / (N + n0)
@@ -108,14 +178,36 @@ class Algorithm(ABC):
 
         self.visualize_dynamics(0)
 
+    def _importance_weights(self, m):
+        """Computes importance weights of the previous iteration's samples under the current trajectory distribution.
+
+        The weight of the transition from time step t is the likelihood ratio of the actions up to t under the current
+        and the previous trajectory distribution, clipped to max_importance_weight.
+
+        Args:
+            m: Condition
+
+        Returns:
+            X: A N x T x dX array of the states of the previous samples.
+            U: A N x T x dU array of the actions of the previous samples.
+            dwts: A N x T array of importance weights.
+
+        """
+        X = self.prev[m].sample_list.get_X()
+        U = self.prev[m].sample_list.get_U()
+        log_ratio = self.cur[m].traj_distr.log_prob(X, U) - self.prev[m].traj_distr.log_prob(X, U)
+        dwts = np.exp(np.minimum(np.cumsum(log_ratio, axis=1), np.log(self._hyperparams['max_importance_weight'])))
+        LOGGER.debug('Reusing %d samples with mean importance weight %f', X.shape[0], np.mean(dwts))
+        return X, U, dwts
+
     def _update_trajectories(self, itr=None):
         """Compute new linear Gaussian controllers."""
         if not hasattr(self, 'new_traj_distr'):
             self.new_traj_distr = [self.cur[cond].traj_distr for cond in range(self.M)]
         with Timer(self.timers, 'traj_opt'):
-            for cond in range(self.M):
-                self.new_traj_distr[cond], self.cur[cond].eta, self.new_mu[cond], self.new_sigma[cond] = \
-                    self.traj_opt.update(cond, self, initial_update=itr == 0)
+            results = self.traj_opt.update_batch(range(self.M), self, initial_update=itr == 0)
+            for cond, result in enumerate(results):
+                self.new_traj_distr[cond], self.cur[cond].eta, self.new_mu[cond], self.new_sigma[cond] = result
 
         self.visualize_local_policy(0)
 
@@ -169,16 +261,26 @@ class Algorithm(ABC):
     def _advance_iteration_variables(self):
         """Move all 'cur' variables to 'prev', and advance iteration counter."""
         self.iteration_count += 1
-        self.prev = copy.deepcopy(self.cur)
+        # The trajectory and policy infos are moved rather than copied, so that memoized forward pass marginals of
+        # the previous iteration remain valid for the step size adaptation.
+        memo = {}
+        for cur in self.cur:
+            for obj in (cur.traj_info, cur.pol_info, cur.traj_distr):
+                if obj is not None:
+                    memo[id(obj)] = obj
+        self.prev = copy.deepcopy(self.cur, memo)
         # TODO: change IterationData to reflect new stuff better
         for m in range(self.M):
             self.prev[m].new_traj_distr = self.new_traj_distr[m]
         self.cur = [IterationData() for _ in range(self.M)]
+        # Copy the dynamics with one memo, so that shared priors remain shared.
+        memo = {}
         for m in range(self.M):
             self.cur[m].traj_info = TrajectoryInfo()
-            self.cur[m].traj_info.dynamics = copy.deepcopy(self.prev[m].traj_info.dynamics)
+            self.cur[m].traj_info.dynamics = copy.deepcopy(self.prev[m].traj_info.dynamics, memo)
             self.cur[m].step_mult = self.prev[m].step_mult
             self.cur[m].eta = self.prev[m].eta
+            self.cur[m].eta_search = self.prev[m].eta_search
             self.cur[m].traj_distr = self.new_traj_distr[m]
         delattr(self, 'new_traj_distr')
 
@@ -206,20 +308,20 @@ class Algorithm(ABC):
         """Measure the entropy of the current trajectory."""
         ent = 0
         for t in range(self.T):
-            ent = ent + np.sum(np.log(np.diag(self.cur[m].traj_distr.chol_pol_covar[t, :, :])))
+            ent = ent + np.sum(np.log(np.diag(self.cur[m].traj_distr.per_step().chol_pol_covar[t, :, :])))
         return ent
 
     def visualize_dynamics(self, m):
         from gps.visualization import visualize_linear_model
 
         traj_info = self.cur[m].traj_info
-        dynamics = traj_info.dynamics
+        Fm, fv, dyn_covar = traj_info.dynamics.per_step()
 
         visualize_linear_model(
             file_name=self._data_files_dir + 'plot_dynamics_m%d-%02d' % (m, self.iteration_count),
-            coeff=dynamics.Fm[:-1],
-            intercept=dynamics.fv[:-1],
-            cov=dynamics.dyn_covar[:-1],
+            coeff=Fm[:-1],
+            intercept=fv[:-1],
+            cov=dyn_covar[:-1],
             x=traj_info.xmu[:-1],
             y=traj_info.xmu[1:, :self.dX],
             coeff_label='$f_{\\mathbf{x}\\mathbf{u} t}$',
@@ -233,7 +335,7 @@ class Algorithm(ABC):
         from gps.visualization.linear_model import visualize_K
 
         traj_info = self.cur[m].traj_info
-        traj_distr = self.new_traj_distr[m]
+        traj_distr = self.new_traj_distr[m].per_step()
 
         visualize_linear_model(
             file_name=self._data_files_dir + 'plot_%s-m%d-%02d' % (title, m, self.iteration_count),
@@ -2,9 +2,11 @@ from abc import abstractmethod
 import copy
 import logging
 import numpy as np
-import scipy as sp
+from numpy.linalg import LinAlgError
 from gps.algorithm.algorithm import Algorithm
-from gps.algorithm.traj_opt.traj_opt_utils import calc_traj_distr_kl, DGD_MAX_ITER
+from gps.algorithm.policy.lin_gauss_policy import LinearGaussianPolicy
+from gps.algorithm.traj_opt.lqr_kernel import forward_marginals, lqr_backward, LQRWorkspace, MarginalCache
+from gps.algorithm.traj_opt.traj_opt_utils import calc_traj_distr_kl, DGD_MAX_ITER, EtaSearch, laplace_cost
 from gps.algorithm.traj_opt.config import TRAJ_OPT_LQR
 
 LOGGER = logging.getLogger(__name__)
@@ -14,7 +16,11 @@ class Algorithm_NN(Algorithm):
     def __init__(self, hyperparams):
         super(Algorithm_NN, self).__init__(hyperparams)
         traj_opt_config = copy.deepcopy(TRAJ_OPT_LQR)
+        traj_opt_config['dtype'] = self._hyperparams['dtype']
+        traj_opt_config.update(self._hyperparams['traj_opt'] or {})
         self.traj_opt_hyperparams = traj_opt_config
+        self._lqr_workspace = LQRWorkspace()
+        self._marginals = MarginalCache(size=4 * self.M)
         self.itr = None
         self.init_step_mult = []
 
@@ -35,69 +41,23 @@ class Algorithm_NN(Algorithm):
             traj_distr: A new linear Gaussian policy.
 
         """
-        # Constants.
-        T = prev_traj_distr.T
-        dimU = prev_traj_distr.dU
-        dimX = prev_traj_distr.dX
-
-        index_x = slice(dimX)
-        index_u = slice(dimX, dimX + dimU)
-
         # Get quadratic expansion of the extended cost function
         Cm_ext, cv_ext = self.compute_extended_costs(eta, traj_info, prev_traj_distr)
         self.Cm_ext = Cm_ext
         self.cv_ext = cv_ext
 
         # Pull out dynamics.
-        Fm = traj_info.dynamics.Fm
-        fv = traj_info.dynamics.fv
-
-        # Allocate.
-        Vm = np.zeros((T, dimX, dimX))
-        vv = np.zeros((T, dimX))
-
-        traj_distr = prev_traj_distr.nans_like()
-
-        # Compute state-action-state function at each time step.
-        for t in range(T - 1, -1, -1):
-            # Add in the cost.
-            Qm = Cm_ext[t, :, :]  # (X+U) x (X+U)
-            qv = cv_ext[t, :]  # (X+U) x 1
-
-            # Add in the value function from the next time step.
-            if t < T - 1:
-                Qm += Fm[t, :, :].T.dot(Vm[t + 1, :, :]).dot(Fm[t, :, :])
-                qv += Fm[t, :, :].T.dot(vv[t + 1, :] + Vm[t + 1, :, :].dot(fv[t, :]))
-
-            # Symmetrize quadratic component to counter numerical errors.
-            Qm = 0.5 * (Qm + Qm.T)
-
-            # Compute Cholesky decomposition of Q function action
-            # component.
-            U = sp.linalg.cholesky(Qm[index_u, index_u])
-            L = U.T
-
-            # Compute mean terms.
-            traj_distr.K[t, :, :] = -sp.linalg.solve_triangular(
-                U, sp.linalg.solve_triangular(L, Qm[index_u, index_x], lower=True)
-            )
-            traj_distr.k[t, :] = -sp.linalg.solve_triangular(U, sp.linalg.solve_triangular(L, qv[index_u], lower=True))
-
-            # Store conditional covariance, inverse, and Cholesky.
-            traj_distr.pol_covar[t, :, :] = sp.linalg.solve_triangular(
-                U, sp.linalg.solve_triangular(L, np.eye(dimU), lower=True)
-            )
+        Fm, fv, _ = traj_info.dynamics.per_step()
 
-            traj_distr.chol_pol_covar[t, :, :] = sp.linalg.cholesky(traj_distr.pol_covar[t, :, :])
-            traj_distr.inv_pol_covar[t, :, :] = Qm[index_u, index_u]
-
-            # Compute value function.
-            Vm[t, :, :] = Qm[index_x, index_x] + Qm[index_x, index_u].dot(traj_distr.K[t, :, :])
-            # Symmetrize quadratic component to counter numerical errors.
-            Vm[t, :, :] = 0.5 * (Vm[t, :, :] + Vm[t, :, :].T)
-            vv[t, :] = qv[index_x] + Qm[index_x, index_u].dot(traj_distr.k[t, :])
+        dtype = self.traj_opt_hyperparams['dtype']
+        K, k, pol_covar, chol_pol_covar, inv_pol_covar, fail = lqr_backward(
+            *(np.asarray(a[None], dtype=dtype) for a in (Cm_ext, cv_ext, Fm, fv)), self._lqr_workspace,
+            self.traj_opt_hyperparams['lqr_backend']
+        )
+        if fail[0]:
+            raise LinAlgError('Q-function is not positive definite for eta %f' % eta)
 
-        return traj_distr
+        return LinearGaussianPolicy(K[0], k[0], pol_covar[0], chol_pol_covar[0], inv_pol_covar[0])
 
     def forward(self, traj_distr, traj_info):
         """Perform LQR forward pass. Computes state-action marginals from dynamics and policy.
@@ -111,48 +71,8 @@ class Algorithm_NN(Algorithm):
             sigma: T x (dX + dU) x (dX + dU) state + action covariance matrix.
 
         """
-        # Constants.
-        T = traj_distr.T
-        dimU = traj_distr.dU
-        dimX = traj_distr.dX
-
-        index_x = slice(dimX)
-        index_u = slice(dimX, dimX + dimU)
-
-        # Pull out dynamics.
-        Fm = traj_info.dynamics.Fm
-        fv = traj_info.dynamics.fv
-        dyn_covar = traj_info.dynamics.dyn_covar
-
-        # Allocate space.
-        sigma = np.zeros((T, dimX + dimU, dimX + dimU))
-        mu = np.zeros((T, dimX + dimU))
-
-        # Set initial mean and covariance
-        mu[0, index_x] = traj_info.x0mu
-        sigma[0, index_x, index_x] = traj_info.x0sigma
-
-        for t in range(T):
-            mu[t, index_u] = traj_distr.K[t, :, :].dot(mu[t, index_x]) + traj_distr.k[t, :]
-
-            sigma[t, index_x, index_u] = \
-                sigma[t, index_x, index_x].dot(traj_distr.K[t, :, :].T)
-
-            sigma[t, index_u, index_x] = \
-                traj_distr.K[t, :, :].dot(sigma[t, index_x, index_x])
-
-            sigma[t, index_u, index_u] = traj_distr.K[t, :, :].dot(sigma[t, index_x, index_x]).dot(
-                traj_distr.K[t, :, :].T
-            ) + traj_distr.pol_covar[t, :, :]
-
-            if t < T - 1:
-                mu[t + 1, index_x] = Fm[t, :, :].dot(mu[t, :]) + fv[t, :]
-
-                sigma[t + 1, index_x, index_x] = \
-                    Fm[t, :, :].dot(sigma[t, :, :]).dot(Fm[t, :, :].T) + \
-                    dyn_covar[t, :, :]
-
-        return mu, sigma
+        mu, sigma = forward_marginals([traj_distr], [traj_info])
+        return mu[0], sigma[0]
 
     def iteration(self, sample_lists, itr):
         """Run iteration of LQR.
@@ -190,16 +110,22 @@ class Algorithm_NN(Algorithm):
             m: Condition
 
         """
+        # All Laplace estimates are computed in one batch. The marginals of the previous policy were already computed
+        # in the previous iteration and are memoized.
+        laplace = self.estimate_cost_batch(
+            [self.prev[m].traj_distr, self.cur[m].traj_distr, self.cur[m].traj_distr],
+            [self.prev[m].traj_info, self.prev[m].traj_info, self.cur[m].traj_info],
+        )
         # Compute values under Laplace approximation. This is the policy that the previous samples were actually drawn
         # from under the dynamics that were estimated from the previous samples.
-        previous_laplace_obj = self.estimate_cost(self.prev[m].traj_distr, self.prev[m].traj_info)
+        previous_laplace_obj = laplace[0]
         # This is the policy that we just used under the dynamics that were estimated from the previous samples (so
         # this is the cost we thought we would have).
-        new_predicted_laplace_obj = self.estimate_cost(self.cur[m].traj_distr, self.prev[m].traj_info)
+        new_predicted_laplace_obj = laplace[1]
 
         # This is the actual cost we have under the current trajectory
         # based on the latest samples.
-        new_actual_laplace_obj = self.estimate_cost(self.cur[m].traj_distr, self.cur[m].traj_info)
+        new_actual_laplace_obj = laplace[2]
 
         # Measure the entropy of the current trajectory (for printout).
         ent = self._measure_ent(m)
@@ -224,20 +150,32 @@ class Algorithm_NN(Algorithm):
 
     def estimate_cost(self, traj_distr, traj_info):
         """Compute Laplace approximation to expected cost."""
-        # Constants.
-        T = traj_distr.T
+        return self.estimate_cost_batch([traj_distr], [traj_info])[0]
 
+    def estimate_cost_batch(self, traj_distrs, traj_infos):
+        """Compute Laplace approximations to the expected costs of several policies.
+
+        Args:
+            traj_distrs: Linear Gaussian policy objects.
+            traj_infos: TrajectoryInfo objects, one per policy.
+
+        Returns:
+            predicted_cost: B x T expected costs.
+
+        """
         # Perform forward pass (note that we repeat this here, because traj_info may have different dynamics from the
-        # ones that were used to compute the distribution already saved in traj).
-        mu, sigma = self.forward(traj_distr, traj_info)
+        # ones that were used to compute the distribution already saved in traj). Marginals of policies that were
+        # already propagated are memoized.
+        mu, sigma = self._marginals.forward(traj_distrs, traj_infos)
 
         # Compute cost.
-        predicted_cost = np.zeros(T)
-        for t in range(T):
-            predicted_cost[t] = traj_info.cc[t] + 0.5 * np.sum(
-                sigma[t, :, :] * traj_info.Cm[t, :, :]
-            ) + 0.5 * mu[t, :].T.dot(traj_info.Cm[t, :, :]).dot(mu[t, :]) + mu[t, :].T.dot(traj_info.cv[t, :])
-        return predicted_cost
+        return laplace_cost(
+            mu,
+            sigma,
+            np.stack([traj_info.cc for traj_info in traj_infos]),
+            np.stack([traj_info.cv for traj_info in traj_infos]),
+            np.stack([traj_info.Cm for traj_info in traj_infos]),
+        )
 
     def traj_opt_update(self, m):
         """Run dual gradient decent to optimize trajectories."""
@@ -251,15 +189,20 @@ class Algorithm_NN(Algorithm):
         # Set KL-divergence step size (epsilon).
         kl_step = T * self.base_kl_step * step_mult
 
-        # We assume at min_eta, kl_div > kl_step, opposite for max_eta.
-        min_eta = self.traj_opt_hyperparams['min_eta']
-        max_eta = self.traj_opt_hyperparams['max_eta']
+        # We assume at min_eta, kl_div > kl_step, opposite for max_eta. The search state persists across iterations.
+        if self.cur[m].eta_search is None:
+            self.cur[m].eta_search = EtaSearch(
+                self.traj_opt_hyperparams['min_eta'], self.traj_opt_hyperparams['max_eta'],
+                self.traj_opt_hyperparams['eta_search'], self.traj_opt_hyperparams['eta_bracket_factor']
+            )
+        search = self.cur[m].eta_search
+        search.reset(kl_step, eta)
 
         LOGGER.debug("Running DGD for trajectory %d, eta: %f", m, eta)
         mus = []
         for itr in range(DGD_MAX_ITER):
 
-            LOGGER.debug("Iteration %i, bracket: (%.2e , %.2e , %.2e)", itr, min_eta, eta, max_eta)
+            LOGGER.debug("Iteration %i, bracket: (%.2e , %.2e , %.2e)", itr, search.min_eta, eta, search.max_eta)
 
             # Run fwd/bwd pass, note that eta may be updated.
             # NOTE: we can just ignore case when the new eta is larger.
@@ -276,23 +219,13 @@ class Algorithm_NN(Algorithm):
                 LOGGER.debug("KL: %f / %f, converged iteration %i", kl_div, kl_step, itr)
                 break
 
-            # Choose new eta (bisect bracket or multiply by constant)
-            if con < 0:  # Eta was too big.
-                max_eta = eta
-                geom = np.sqrt(min_eta * max_eta)  # Geometric mean.
-                new_eta = max(geom, 0.1 * max_eta)
-                LOGGER.debug("KL: %f / %f, eta too big, new eta: %f", kl_div, kl_step, new_eta)
-            else:  # Eta was too small.
-                min_eta = eta
-                geom = np.sqrt(min_eta * max_eta)  # Geometric mean.
-                new_eta = min(geom, 10.0 * min_eta)
-                LOGGER.debug("KL: %f / %f, eta too small, new eta: %f", kl_div, kl_step, new_eta)
-
-            # Logarithmic mean: log_mean(x,y) = (y - x)/(log(y) - log(x))
-            eta = new_eta
+            # Choose new eta.
+            eta = search.update(eta, kl_div)
+            LOGGER.debug("KL: %f / %f, eta too %s, new eta: %f", kl_div, kl_step, 'big' if con < 0 else 'small', eta)
 
         if kl_div > kl_step and abs(kl_div - kl_step) > 0.1 * kl_step:
             LOGGER.warning("Final KL divergence after DGD convergence is too high.")
+        self._marginals.put(traj_distr, traj_info, new_mu, new_sigma)
 
         from gps.visualization.traj_opt import visualize_traj_opt
         visualize_traj_opt(
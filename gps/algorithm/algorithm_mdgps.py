@@ -26,6 +26,7 @@ class AlgorithmMDGPS(Algorithm):
         Algorithm.__init__(self, config)
 
         policy_prior = self._hyperparams['policy_prior']
+        policy_prior.setdefault('dtype', self._hyperparams['dtype'])
         for m in range(self.M):
             self.cur[m].pol_info = PolicyInfo(self._hyperparams)
             self.cur[m].pol_info.policy_prior = policy_prior['type'](policy_prior)
@@ -85,7 +86,7 @@ class AlgorithmMDGPS(Algorithm):
         # Iterate over conditions m
         for m in range(self.M):
             samples = self.cur[m].sample_list
-            traj = self.new_traj_distr[m]
+            traj = self.new_traj_distr[m].per_step()
 
             # Shape traj.K: 20,4,13
             # Shape traj.k: 20,4
@@ -144,6 +145,7 @@ class AlgorithmMDGPS(Algorithm):
         pol_info.pol_K, pol_info.pol_k, pol_info.pol_S = policy_prior.fit(X, pol_mu, pol_sig)
         for t in range(self.T):
             pol_info.chol_pol_S[t, :, :] = sp.linalg.cholesky(pol_info.pol_S[t, :, :])
+        pol_info.update_kl_terms()
 
         # Visualize pol lin
         if m == 0:
@@ -163,33 +165,34 @@ class AlgorithmMDGPS(Algorithm):
         """
         # Compute previous cost and previous expected cost.
         prev_M = len(self.prev)  # May be different in future.
-        prev_laplace = np.empty(prev_M)
-        prev_mc = np.empty(prev_M)
-        prev_predicted = np.empty(prev_M)
-        for m in range(prev_M):
-            prev_nn = self.prev[m].pol_info.traj_distr()
-            prev_lg = self.prev[m].new_traj_distr
-
-            # Compute values under Laplace approximation. This is the policy
-            # that the previous samples were actually drawn from under the
-            # dynamics that were estimated from the previous samples.
-            prev_laplace[m] = self.traj_opt.estimate_cost(prev_nn, self.prev[m].traj_info).sum()
-            # This is the actual cost that we experienced.
-            prev_mc[m] = self.prev[m].cs.mean(axis=0).sum()
-            # This is the policy that we just used under the dynamics that
-            # were estimated from the prev samples (so this is the cost
-            # we thought we would have).
-            prev_predicted[m] = self.traj_opt.estimate_cost(prev_lg, self.prev[m].traj_info).sum()
+        prev_nn = [self.prev[m].pol_info.traj_distr() for m in range(prev_M)]
+        prev_lg = [self.prev[m].new_traj_distr for m in range(prev_M)]
+        prev_infos = [self.prev[m].traj_info for m in range(prev_M)]
+        cur_nn = [self.cur[m].pol_info.traj_distr() for m in range(self.M)]
+        cur_infos = [self.cur[m].traj_info for m in range(self.M)]
+
+        # All Laplace estimates are computed in one batch. The marginals of prev_nn and prev_lg were already computed
+        # in the previous iteration, as cur_nn and by the C-step respectively, and are memoized by the trajectory
+        # optimizer.
+        laplace = self.traj_opt.estimate_cost_batch(prev_nn + prev_lg + cur_nn, prev_infos + prev_infos + cur_infos)
+        laplace = laplace.sum(axis=1)
+
+        # Compute values under Laplace approximation. This is the policy
+        # that the previous samples were actually drawn from under the
+        # dynamics that were estimated from the previous samples.
+        prev_laplace = laplace[:prev_M]
+        # This is the actual cost that we experienced.
+        prev_mc = np.array([self.prev[m].cs.mean(axis=0).sum() for m in range(prev_M)])
+        # This is the policy that we just used under the dynamics that
+        # were estimated from the prev samples (so this is the cost
+        # we thought we would have).
+        prev_predicted = laplace[prev_M:2 * prev_M]
 
         # Compute current cost.
-        cur_laplace = np.empty(self.M)
-        cur_mc = np.empty(self.M)
-        for m in range(self.M):
-            cur_nn = self.cur[m].pol_info.traj_distr()
-            # This is the actual cost we have under the current trajectory
-            # based on the latest samples.
-            cur_laplace[m] = self.traj_opt.estimate_cost(cur_nn, self.cur[m].traj_info).sum()
-            cur_mc[m] = self.cur[m].cs.mean(axis=0).sum()
+        # This is the actual cost we have under the current trajectory
+        # based on the latest samples.
+        cur_laplace = laplace[2 * prev_M:]
+        cur_mc = np.array([self.cur[m].cs.mean(axis=0).sum() for m in range(self.M)])
 
         # Compute predicted and actual improvement.
         prev_laplace = prev_laplace.mean()
@@ -211,29 +214,11 @@ class AlgorithmMDGPS(Algorithm):
             self._set_new_mult(predicted_impr, actual_impr, m)
 
     def compute_costs(self, m, eta):
-        """Compute cost estimates used in the LQR backward pass."""
-        traj_info, traj_distr = self.cur[m].traj_info, self.cur[m].traj_distr
-        pol_info = self.cur[m].pol_info
-        T, dU, dX = traj_distr.T, traj_distr.dU, traj_distr.dX
-        Cm, cv = np.copy(traj_info.Cm), np.copy(traj_info.cv)
-
-        PKLm = np.zeros((T, dX + dU, dX + dU))
-        PKLv = np.zeros((T, dX + dU))
-        fCm, fcv = np.zeros(Cm.shape), np.zeros(cv.shape)
-        for t in range(T):
-            # Policy KL-divergence terms.
-            inv_pol_S = np.linalg.solve(
-                pol_info.chol_pol_S[t, :, :], np.linalg.solve(pol_info.chol_pol_S[t, :, :].T, np.eye(dU))
-            )
-            KB, kB = pol_info.pol_K[t, :, :], pol_info.pol_k[t, :]
-            PKLm[t, :, :] = np.vstack(
-                [
-                    np.hstack([KB.T.dot(inv_pol_S).dot(KB), -KB.T.dot(inv_pol_S)]),
-                    np.hstack([-inv_pol_S.dot(KB), inv_pol_S])
-                ]
-            )
-            PKLv[t, :] = np.concatenate([KB.T.dot(inv_pol_S).dot(kB), -inv_pol_S.dot(kB)])
-            fCm[t, :, :] = (Cm[t, :, :] + PKLm[t, :, :] * eta) / (eta)
-            fcv[t, :] = (cv[t, :] + PKLv[t, :] * eta) / (eta)
+        """Compute cost estimates used in the LQR backward pass.
 
+        The policy KL-divergence terms do not depend on eta and are cached on the PolicyInfo by _update_policy_fit.
+        """
+        traj_info, pol_info = self.cur[m].traj_info, self.cur[m].pol_info
+        fCm = (traj_info.Cm + pol_info.PKLm * eta) / eta
+        fcv = (traj_info.cv + pol_info.PKLv * eta) / eta
         return fCm, fcv
@@ -18,6 +18,7 @@ class IterationData(BundleType):
             'cs': None,  # Sample costs of the current iteration.
             'step_mult': 1.0,  # KL step multiplier for the current iteration.
             'eta': 1.0,  # Dual variable used in LQR backward pass.
+            'eta_search': None,  # EtaSearch state of the dual variable, kept across iterations.
         }
         BundleType.__init__(self, variables)
 
@@ -53,18 +54,41 @@ class PolicyInfo(BundleType):
             'pol_k': np.zeros((T, dU)),  # Policy linearization.
             'pol_S': np.zeros((T, dU, dU)),  # Policy linearization covariance.
             'chol_pol_S': np.zeros((T, dU, dU)),  # Cholesky decomp of covar.
+            'inv_pol_S': None,  # Inverse of covar, cached by update_kl_terms.
+            'PKLm': None,  # Policy KL-divergence quadratic cost term, cached by update_kl_terms.
+            'PKLv': None,  # Policy KL-divergence linear cost term, cached by update_kl_terms.
+            'lin_traj_distr': None,  # Policy linearization as LinearGaussianPolicy, cached by traj_distr.
             'policy_prior': None,  # Current prior for policy linearization.
         }
         BundleType.__init__(self, variables)
 
-    def traj_distr(self):
-        """Create a trajectory distribution object from policy info."""
+    def update_kl_terms(self):
+        """Precompute the eta-independent policy KL-divergence cost terms from the current linearization.
+
+        Must be called whenever pol_K, pol_k or chol_pol_S change.
+        """
         T, dU, dX = self.pol_K.shape
-        # Compute inverse policy covariances.
-        inv_pol_S = np.empty_like(self.chol_pol_S)
-        for t in range(T):
-            inv_pol_S[t] = np.linalg.solve(self.chol_pol_S[t], np.linalg.solve(self.chol_pol_S[t].T, np.eye(dU)))
-        return LinearGaussianPolicy(self.pol_K, self.pol_k, self.pol_S, self.chol_pol_S, inv_pol_S)
+        eye = np.broadcast_to(np.eye(dU), (T, dU, dU))
+        inv_pol_S = np.linalg.solve(self.chol_pol_S, np.linalg.solve(self.chol_pol_S.transpose(0, 2, 1), eye))
+        KB, kB = self.pol_K, self.pol_k[..., None]
+        KBT_inv_pol_S = self.pol_K.transpose(0, 2, 1) @ inv_pol_S
+        self.inv_pol_S = inv_pol_S
+        self.PKLm = np.block([[KBT_inv_pol_S @ KB, -KBT_inv_pol_S], [-inv_pol_S @ KB, inv_pol_S]])
+        self.PKLv = np.concatenate([KBT_inv_pol_S @ kB, -inv_pol_S @ kB], axis=1)[..., 0]
+        self.lin_traj_distr = None
+
+    def traj_distr(self):
+        """Create a trajectory distribution object from policy info.
+
+        The object is cached until the linearization changes, so that its forward pass marginals can be memoized.
+        """
+        if self.inv_pol_S is None:
+            self.update_kl_terms()
+        if self.lin_traj_distr is None:
+            self.lin_traj_distr = LinearGaussianPolicy(
+                self.pol_K, self.pol_k, self.pol_S, self.chol_pol_S, self.inv_pol_S
+            )
+        return self.lin_traj_distr
 
 
 def gauss_fit_joint_prior(pts, mu0, Phi, m, n0, dwts, dX, dU, sig_reg):
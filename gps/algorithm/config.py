@@ -19,6 +19,21 @@ ALG = {
     'cost': None,  # A list of Cost objects for each condition.
     # Whether or not to sample with neural net policy (only for badmm/mdgps).
     'sample_on_policy': False,
+    # Floating point precision of dynamics fitting, GMM priors and trajectory optimization, 'float64' or 'float32'.
+    # Passed on to the dynamics, prior and traj_opt hyperparams unless they set their own.
+    'dtype': 'float64',
+    # Number of consecutive time steps sharing the same dynamics and local controllers. Passed on to the dynamics and
+    # traj_opt hyperparams unless they set their own. Fitting, the backward pass and storage scale with T / time_window.
+    'time_window': 1,
+    # Groups of conditions that share one dynamics prior, fitted once per iteration on their pooled samples: None for
+    # a prior per condition, 'all' for one prior across all conditions, or a list of lists of condition indices.
+    'dynamics_prior_groups': None,
+    # Reuse the samples of the previous iteration in the dynamics fit, see Dynamics.supports_sample_weights. They are
+    # weighted by the likelihood ratio of their actions up to each time step under the current and the previous
+    # trajectory distribution, clipped to max_importance_weight. Requires that the samples are drawn from the
+    # trajectory distributions, i.e. not sample_on_policy.
+    'dynamics_sample_reuse': False,
+    'max_importance_weight': 1.0,
 }
 
 # AlgorithmMD
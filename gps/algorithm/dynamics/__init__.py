@@ -1,12 +1,16 @@
-"""This package contains models for dynnamics."""
-from gps.algorithm.dynamics.dynamics import Dynamics
-from gps.algorithm.dynamics.dynamics_lr import DynamicsLR
-from gps.algorithm.dynamics.dynamics_lr_prior import DynamicsLRPrior
-from gps.algorithm.dynamics.dynamics_prior_gmm import DynamicsPriorGMM
-
-__all__ = [
-    'Dynamics',
-    'DynamicsLR',
-    'DynamicsLRPrior',
-    'DynamicsPriorGMM',
-]
+"""This package contains models for dynnamics."""
+from gps.algorithm.dynamics.dynamics import Dynamics
+from gps.algorithm.dynamics.dynamics_fd import DynamicsFD
+from gps.algorithm.dynamics.dynamics_lr import DynamicsLR
+from gps.algorithm.dynamics.dynamics_lr_prior import DynamicsLRPrior
+from gps.algorithm.dynamics.dynamics_lr_streaming import DynamicsLRStreaming
+from gps.algorithm.dynamics.dynamics_prior_gmm import DynamicsPriorGMM
+
+__all__ = [
+    'Dynamics',
+    'DynamicsFD',
+    'DynamicsLR',
+    'DynamicsLRPrior',
+    'DynamicsLRStreaming',
+    'DynamicsPriorGMM',
+]
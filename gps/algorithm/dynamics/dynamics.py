@@ -7,6 +7,9 @@ import numpy as np
 class Dynamics(ABC):
     """Abstract dynamics superclass."""
 
+    # Whether fit accepts weights of the transitions.
+    supports_sample_weights = False
+
     def __init__(self, hyperparams):
         """Initializes the dynamics.
 
@@ -16,7 +19,11 @@ class Dynamics(ABC):
         """
         self._hyperparams = hyperparams
 
-        # Fitted dynamics: x_t+1 = Fm * [x_t;u_t] + fv.
+        # Number of consecutive time steps sharing the same dynamics.
+        self.window = hyperparams.get('time_window', 1)
+        self.T = None  # Number of time steps of the fit.
+
+        # Fitted dynamics: x_t+1 = Fm * [x_t;u_t] + fv, one per window of time steps.
         self.Fm = np.array(np.nan)  # Linear component
         self.fv = np.array(np.nan)  # Constant component
         self.dyn_covar = np.array(np.nan)  # Covariance.
@@ -26,19 +33,45 @@ class Dynamics(ABC):
         """Update dynamics prior."""
         pass
 
+    def add_sample(self, X, U):
+        """Add a sample as soon as it is collected, for estimators that accumulate statistics.
+
+        Args:
+            X: A T x dX array of states.
+            U: A T x dU array of actions.
+
+        """
+        pass
+
     @abstractmethod
     def get_prior(self):
         """Returns prior object."""
         pass
 
     @abstractmethod
-    def fit(self, sample_list):
-        """Fit dynamics."""
+    def fit(self, X, U, dwts=None):
+        """Fit dynamics.
+
+        Args:
+            X: A N x T x dX array of states.
+            U: A N x T x dU array of actions.
+            dwts: Optional N x T array of weights of the transitions from each time step of each sample, relative to
+                an unweighted sample. Only if supports_sample_weights.
+
+        """
         pass
 
+    def per_step(self):
+        """Returns the fitted dynamics (Fm, fv, dyn_covar) with separate entries for each time step."""
+        if self.window == 1:
+            return self.Fm, self.fv, self.dyn_covar
+        w = np.arange(self.T) // self.window
+        return self.Fm[w], self.fv[w], self.dyn_covar[w]
+
     def copy(self):
         """Return a copy of this dynamics object."""
         dyn = type(self)(self._hyperparams)
+        dyn.T = self.T
         dyn.Fm = np.copy(self.Fm)
         dyn.fv = np.copy(self.fv)
         dyn.dyn_covar = np.copy(self.dyn_covar)
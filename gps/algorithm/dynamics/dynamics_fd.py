@@ -0,0 +1,102 @@
+"""This file defines dynamics linearized by finite differences through a simulator."""
+import copy
+
+import numpy as np
+
+from gps.algorithm.dynamics import Dynamics
+from gps.algorithm.dynamics.config import DYN_FD
+
+
+class DynamicsFD(Dynamics):
+    """Linear dynamics obtained by finite differences through the simulator of the agent.
+
+    The simulator is linearized along the mean actions of the samples, starting from the initial simulator state of
+    the first sample, see AgentOpenAIGym.linearize. The samples only determine the covariance of the dynamics, so far
+    fewer samples are needed than for a regression.
+    """
+
+    def __init__(self, hyperparams):
+        """Initializes the dynamics.
+
+        Args:
+            hyperparams: Dictionary of hyperparameters.
+
+        Hyperparameters:
+            regularization: Regularization of the dynamics covariance.
+            epsilon: Size of the finite difference perturbations.
+
+        """
+        config = copy.deepcopy(DYN_FD)
+        config.update(hyperparams)
+        Dynamics.__init__(self, config)
+        self.Fm = None
+        self.fv = None
+        self.dyn_covar = None
+        # Agent and initial simulator state of the samples of the current iteration, set by update_prior.
+        self.agent = None
+        self._sim_state = None
+
+    def update_prior(self, samples):
+        """Take the agent and the initial simulator state from the samples."""
+        sample = samples[0]
+        if sample.agent is None or not hasattr(sample, 'sim_state'):
+            raise ValueError('DynamicsFD requires samples from a simulated agent')
+        self.agent = sample.agent
+        self._sim_state = sample.sim_state
+
+    def get_prior(self):
+        """Returns prior object."""
+        return None
+
+    def fit(self, X, U, dwts=None):
+        """Fit dynamics.
+
+        The simulator is linearized around the nominal trajectory of the mean actions. The linearizations of all time
+        steps in a window are averaged. The covariance is that of the residuals of the sample transitions.
+        """
+        if dwts is not None:
+            raise ValueError('DynamicsFD does not support sample weights')
+        N, T, dX = X.shape
+        dU = U.shape[2]
+        W = self.window
+        self.T = T
+
+        if self.agent is None:
+            raise ValueError('DynamicsFD.update_prior must be called before fit')
+        U_mean = np.mean(U, axis=0)
+        X_nominal, Fm = self.agent.linearize(self._sim_state, U_mean, self._hyperparams['epsilon'])
+
+        # The constant components make the linearization exact on the nominal trajectory it was taken around.
+        XU_nominal = np.concatenate([X_nominal[:-1], U_mean[:-1]], axis=1)
+        fv = X_nominal[1:] - np.einsum('tij,tj->ti', Fm, XU_nominal)
+
+        # Residuals of the sample transitions.
+        XU = np.concatenate([X[:, :-1], U[:, :-1]], axis=2)
+        residuals = X[:, 1:] - np.einsum('tij,ntj->nti', Fm, XU) - fv
+
+        # Average over windows.
+        starts = np.arange(0, T - 1, W)
+        sizes = np.diff(np.append(starts, T - 1))
+        Fm = np.add.reduceat(Fm, starts) / sizes[:, None, None]
+        fv = np.add.reduceat(fv, starts) / sizes[:, None]
+        dyn_covar = np.add.reduceat(np.einsum('nti,ntj->tij', residuals, residuals), starts)
+        dyn_covar /= (N * sizes)[:, None, None]
+        dyn_covar += self._hyperparams['regularization'] * np.eye(dX)
+
+        # Store. The last window has no transitions if it only holds the last step.
+        dtype = self._hyperparams.get('dtype', 'float64')
+        T_w = -(-T // W)
+        self.Fm = np.zeros([T_w, dX, dX + dU], dtype=dtype)
+        self.fv = np.zeros([T_w, dX], dtype=dtype)
+        self.dyn_covar = np.zeros([T_w, dX, dX], dtype=dtype)
+        self.Fm[:len(starts)] = Fm
+        self.fv[:len(starts)] = fv
+        self.dyn_covar[:len(starts)] = dyn_covar
+
+        return self.Fm, self.fv, self.dyn_covar
+
+    def __getstate__(self):
+        """Pickle dynamics without reference to the agent."""
+        state = self.__dict__.copy()
+        state['agent'] = None
+        return state
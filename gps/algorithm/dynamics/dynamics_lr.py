@@ -7,6 +7,8 @@ from gps.algorithm.dynamics import Dynamics
 class DynamicsLR(Dynamics):
     """Linear dynamics fitted via linear regression with constant prior."""
 
+    supports_sample_weights = True
+
     def __init__(self, hyperparams):
         """Initializes the dynamics.
 
@@ -27,34 +29,47 @@ class DynamicsLR(Dynamics):
         """Returns prior object."""
         return None
 
-    def fit(self, X, U):
-        """Fit dynamics."""
+    def fit(self, X, U, dwts=None):
+        """Fit dynamics.
+
+        The transitions of all time steps in a window are pooled into one regression.
+        """
         N, T, dX = X.shape
         dU = U.shape[2]
+        W = self.window
+        self.T = T
 
         if N == 1:
             raise ValueError("Cannot fit dynamics on 1 sample")
+        if dwts is None:
+            dwts = np.ones((N, T))
+
+        # The fit runs in float64, only the fitted dynamics are stored in the configured precision.
+        dtype = self._hyperparams.get('dtype', 'float64')
 
-        self.Fm = np.zeros([T, dX, dX + dU])
-        self.fv = np.zeros([T, dX])
-        self.dyn_covar = np.zeros([T, dX, dX])
+        T_w = -(-T // W)
+        self.Fm = np.zeros([T_w, dX, dX + dU], dtype=dtype)
+        self.fv = np.zeros([T_w, dX], dtype=dtype)
+        self.dyn_covar = np.zeros([T_w, dX, dX], dtype=dtype)
 
         it = slice(dX + dU)
         ip = slice(dX + dU, dX + dU + dX)
         # Fit dynamics wih least squares regression.
-        for t in range(T - 1):
-            xux = np.c_[X[:, t, :], U[:, t, :], X[:, t + 1, :]]
-            xux_mean = np.mean(xux, axis=0)
-            empsig = (xux - xux_mean).T.dot(xux - xux_mean) / N
+        for w in range((T - 2) // W + 1):
+            ts = range(w * W, min((w + 1) * W, T - 1))
+            xux = np.concatenate([np.c_[X[:, t, :], U[:, t, :], X[:, t + 1, :]] for t in ts])
+            wts = np.concatenate([dwts[:, t] for t in ts])
+            xux_mean = wts.dot(xux) / np.sum(wts)
+            empsig = (wts[:, None] * (xux - xux_mean)).T.dot(xux - xux_mean) / np.sum(wts)
             sigma = 0.5 * (empsig + empsig.T)
             sigma[it, it] += self._hyperparams['regularization']
 
             Fm = np.linalg.solve(sigma[it, it], sigma[it, ip]).T
             fv = xux_mean[ip] - Fm.dot(xux_mean[it])
 
-            self.Fm[t, :, :] = Fm
-            self.fv[t, :] = fv
+            self.Fm[w, :, :] = Fm
+            self.fv[w, :] = fv
 
             dyn_covar = sigma[ip, ip] - Fm.dot(sigma[it, it]).dot(Fm.T)
-            self.dyn_covar[t, :, :] = 0.5 * (dyn_covar + dyn_covar.T)
+            self.dyn_covar[w, :, :] = 0.5 * (dyn_covar + dyn_covar.T)
         return self.Fm, self.fv, self.dyn_covar
@@ -4,15 +4,60 @@ import numpy as np
 from gps.algorithm.dynamics import Dynamics
 
 
+def pool_neighbors(N, mu, M2, bandwidth):
+    """Pools the moments of neighboring time steps with a Gaussian kernel.
+
+    The moments of time step t + d enter those of time step t with weight exp(-d^2 / (2 * bandwidth^2)), for
+    |d| <= 3 * bandwidth.
+
+    Args:
+        N: A (T,) array of the number of points of each time step.
+        mu: A T x D array of the means.
+        M2: A T x D x D array of the centered second moments.
+        bandwidth: Standard deviation of the kernel in time steps.
+
+    Returns:
+        The pooled N, mu and M2.
+
+    """
+    T = len(N)
+    radius = min(int(np.ceil(3 * bandwidth)), T - 1)
+    shifts = [
+        (np.exp(-0.5 * (d / bandwidth)**2), slice(max(0, d), T + min(0, d)), slice(max(0, -d), T - max(0, d)))
+        for d in range(-radius, radius + 1)
+    ]
+
+    # Pool the counts and means, then the second moments about the pooled means.
+    pooled_N = np.zeros_like(N)
+    pooled_mu = np.zeros_like(mu)
+    for k, src, dst in shifts:
+        pooled_N[dst] += k * N[src]
+        pooled_mu[dst] += (k * N[src])[:, None] * mu[src]
+    pooled_mu /= pooled_N[:, None]
+    pooled_M2 = np.zeros_like(M2)
+    for k, src, dst in shifts:
+        dmu = mu[src] - pooled_mu[dst]
+        pooled_M2[dst] += k * (M2[src] + N[src, None, None] * np.einsum('ti,tj->tij', dmu, dmu))
+    return pooled_N, pooled_mu, pooled_M2
+
+
 class DynamicsLRPrior(Dynamics):
     """Linear dynamics fitted via linear regression with arbitrary prior."""
 
+    supports_sample_weights = True
+
     def __init__(self, hyperparams):
         """Initializes the dynamics.
 
         Args:
             hyperparams: Dictionary of hyperparameters.
 
+        Hyperparameters:
+            regularization: Regularization of the state-action covariance.
+            temporal_pooling: Bandwidth in time steps of a Gaussian kernel that pools the transitions of neighboring
+                time steps into the regression of each time step, see pool_neighbors. 0 fits each time step only on
+                its own transitions.
+
         """
         Dynamics.__init__(self, hyperparams)
         self.Fm = None
@@ -30,57 +75,106 @@ class DynamicsLRPrior(Dynamics):
         """Returns prior object."""
         return self.prior
 
-    def fit(self, X, U):
-        """Fit dynamics."""
+    def fit(self, X, U, dwts=None):
+        """Fit dynamics.
+
+        The fit is vectorized across all time steps: the prior, the empirical moments, the posterior and the
+        conditioning are computed in batches. The transitions of all time steps in a window are pooled into one
+        regression.
+
+        Args:
+            X: A N x T x dX array of states.
+            U: A N x T x dU array of actions.
+            dwts: Optional N x T array of weights of the transitions from each time step of each sample, relative to
+                an unweighted sample.
+
+        """
         # Constants
         N, T, dimX = X.shape
         dimU = U.shape[2]
 
+        # Transitions (x_t, u_t, x_t+1) of all time steps, T - 1 x N x (dX + dU + dX).
+        Ys = np.concatenate([X[:, :-1], U[:, :-1], X[:, 1:]], axis=2).transpose(1, 0, 2)
+
+        # Compute empirical mean and centered second moment of each time step.
+        if dwts is None:
+            empmu = np.mean(Ys, axis=1)
+            diff = Ys - empmu[:, None]
+            M2 = np.einsum('tni,tnj->tij', diff, diff)
+        else:
+            dwts = dwts[:, :-1].T
+            N = np.sum(dwts, axis=1)
+            empmu = np.einsum('tn,tni->ti', dwts, Ys) / N[:, None]
+            diff = Ys - empmu[:, None]
+            M2 = np.einsum('tn,tni,tnj->tij', dwts, diff, diff)
+
+        return self._fit_moments(N, empmu, M2, Ys, dimX, dimU)
+
+    def _fit_moments(self, N, empmu, M2, Ys, dimX, dimU):
+        """Fit dynamics from the empirical moments of the transitions of each time step.
+
+        Args:
+            N: Number of transitions, overall or per time step, may be fractional for weighted transitions.
+            empmu: A T - 1 x (dX + dU + dX) array of the empirical means.
+            M2: A T - 1 x (dX + dU + dX) x (dX + dU + dX) array of the centered second moments.
+            Ys: A T - 1 x N' x (dX + dU + dX) array of transitions to query the prior with.
+            dimX: Dimension of the states.
+            dimU: Dimension of the actions.
+
+        """
+        T = empmu.shape[0] + 1
+        W = self.window
+        self.T = T
+
         index_xu = slice(dimX + dimU)
         index_x = slice(dimX + dimU, dimX + dimU + dimX)
 
-        sig_reg = np.zeros((dimX + dimU + dimX, dimX + dimU + dimX))
-        sig_reg[index_xu, index_xu] = self._hyperparams['regularization']
-
-        # Weights used in computing sample mean and sample covariance.
-        dwts = (1.0 / N) * np.ones(N)
-        D = np.diag((1.0 / (N - 1)) * np.ones(N))
-
-        # Allocate
-        self.Fm = np.zeros([T, dimX, dimX + dimU])
-        self.fv = np.zeros([T, dimX])
-        self.dyn_covar = np.zeros([T, dimX, dimX])
-
-        for t in range(T - 1):
-            Ys = np.c_[X[:, t, :], U[:, t, :], X[:, t + 1, :]]
-
-            # Obtain normal-inverse-Wishart prior.
-            mu0, Phi, mm, n0 = self.prior.eval(dimX, dimU, Ys)
-
-            # Compute empirical mean and covariance.
-            empmu = np.sum((Ys.T * dwts).T, axis=0)
-            diff = Ys - empmu
-            empsig = diff.T.dot(D).dot(diff)
-            # Symmetrize empsig to counter numerical errors.
-            empsig = 0.5 * (empsig + empsig.T)
-
-            # Compute posterior estimates of mean and covariance.
-            mu = empmu
-            sigma = (Phi + (N - 1) * empsig + (N * mm) / (N + mm) * np.outer(empmu - mu0, empmu - mu0)) / (N + n0)
-            # Symmetrize sigma to counter numerical errors.
-            sigma = 0.5 * (sigma + sigma.T)
-            # Add sigma regularization.
-            sigma += sig_reg
-
-            # Conditioning to get dynamics.
-            Fm = np.linalg.solve(sigma[index_xu, index_xu], sigma[index_xu, index_x]).T
-            fv = mu[index_x] - Fm.dot(mu[index_xu])
-            dyn_covar = sigma[index_x, index_x] - Fm.dot(sigma[index_xu, index_xu]).dot(Fm.T)
-            # Symmetrize dyn_covar to counter numerical errors.
-            dyn_covar = 0.5 * (dyn_covar + dyn_covar.T)
-
-            self.Fm[t, :, :] = Fm
-            self.fv[t, :] = fv
-            self.dyn_covar[t, :, :] = dyn_covar
+        # Pool the kernel-weighted moments of neighboring time steps into each time step.
+        N = np.full(T - 1, N, dtype=float)
+        bandwidth = self._hyperparams.get('temporal_pooling', 0)
+        if bandwidth > 0:
+            N, empmu, M2 = pool_neighbors(N, empmu, M2, bandwidth)
+
+        # Pool the time steps of each window, combining the centered moments with the parallel variance formula.
+        starts = np.arange(0, T - 1, W)
+        sizes = np.diff(np.append(starts, T - 1))
+        counts = np.add.reduceat(N, starts)
+        if W > 1:
+            step_mu = empmu
+            empmu = np.add.reduceat(N[:, None] * step_mu, starts) / counts[:, None]
+            dmu = step_mu - np.repeat(empmu, sizes, axis=0)
+            M2 = np.add.reduceat(M2 + N[:, None, None] * np.einsum('ti,tj->tij', dmu, dmu), starts)
+
+        # Obtain normal-inverse-Wishart prior of each window.
+        mu0, Phi, mm, n0 = self.prior.eval_batch(dimX, dimU, Ys, W)
+
+        # Compute posterior estimates of mean and covariance.
+        Nw = counts[:, None, None]
+        mu = empmu
+        dmu0 = empmu - mu0
+        sigma = (Phi + M2 + (Nw * mm) / (Nw + mm) * np.einsum('ti,tj->tij', dmu0, dmu0)) / (Nw + n0)
+        # Symmetrize sigma to counter numerical errors.
+        sigma = 0.5 * (sigma + sigma.transpose(0, 2, 1))
+        # Add sigma regularization.
+        sigma[:, index_xu, index_xu] += self._hyperparams['regularization']
+
+        # Conditioning to get dynamics.
+        sigma_xu = sigma[:, index_xu, index_xu]
+        Fm = np.linalg.solve(sigma_xu, sigma[:, index_xu, index_x]).transpose(0, 2, 1)
+        fv = mu[:, index_x] - np.einsum('tij,tj->ti', Fm, mu[:, index_xu])
+        dyn_covar = sigma[:, index_x, index_x] - Fm @ sigma_xu @ Fm.transpose(0, 2, 1)
+        # Symmetrize dyn_covar to counter numerical errors.
+        dyn_covar = 0.5 * (dyn_covar + dyn_covar.transpose(0, 2, 1))
+
+        # Store. The fit itself runs in float64, as the conditioning is prone to cancellation, only the fitted dynamics
+        # are stored in the configured precision. The last window has no transitions if it only holds the last step.
+        dtype = self._hyperparams.get('dtype', 'float64')
+        T_w = -(-T // W)
+        self.Fm = np.zeros([T_w, dimX, dimX + dimU], dtype=dtype)
+        self.fv = np.zeros([T_w, dimX], dtype=dtype)
+        self.dyn_covar = np.zeros([T_w, dimX, dimX], dtype=dtype)
+        self.Fm[:len(starts)] = Fm
+        self.fv[:len(starts)] = fv
+        self.dyn_covar[:len(starts)] = dyn_covar
 
         return self.Fm, self.fv, self.dyn_covar
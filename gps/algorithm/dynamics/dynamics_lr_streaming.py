@@ -0,0 +1,101 @@
+"""This file defines linear regression with an arbitrary prior on streamed sufficient statistics."""
+import copy
+
+import numpy as np
+
+from gps.algorithm.dynamics.config import DYN_LR_STREAMING
+from gps.algorithm.dynamics.dynamics_lr_prior import DynamicsLRPrior
+
+
+class DynamicsLRStreaming(DynamicsLRPrior):
+    """Linear dynamics fitted via linear regression with arbitrary prior, on streamed sufficient statistics.
+
+    The counts, means and centered second moments of the transitions [x_t, u_t, x_t+1] of each time step are
+    accumulated as the samples arrive, see add_sample. The statistics of previous iterations are down-weighted by an
+    exponential forgetting factor, so the cost of a fit does not depend on how many samples contribute to it.
+    """
+
+    supports_sample_weights = False
+
+    def __init__(self, hyperparams):
+        """Initializes the dynamics.
+
+        Args:
+            hyperparams: Dictionary of hyperparameters.
+
+        Hyperparameters:
+            forgetting_factor: Weight of the statistics of the previous iterations in each new iteration. 0 only fits
+                the samples of the current iteration.
+
+        """
+        config = copy.deepcopy(DYN_LR_STREAMING)
+        config.update(hyperparams)
+        DynamicsLRPrior.__init__(self, config)
+        self._forgetting_factor = self._hyperparams['forgetting_factor']
+
+        # Sufficient statistics of the transitions of each time step.
+        self._count = 0.0
+        self._mean = None
+        self._M2 = None
+        # Number of samples added in the current iteration.
+        self._num_added = 0
+        # Whether the statistics need to be discounted before the next sample is added.
+        self._discount = False
+
+    def add_sample(self, X, U):
+        """Accumulate the statistics of a sample.
+
+        Args:
+            X: A T x dX array of states.
+            U: A T x dU array of actions.
+
+        """
+        self._add(np.concatenate([X[:-1], U[:-1], X[1:]], axis=1)[:, None])
+
+    def fit(self, X, U, dwts=None):
+        """Fit dynamics.
+
+        The statistics of the samples that were added in this iteration are used. If none were added, the statistics
+        of X and U are accumulated instead.
+        """
+        if dwts is not None:
+            raise ValueError('DynamicsLRStreaming does not support sample weights')
+        N, T, dimX = X.shape
+        dimU = U.shape[2]
+
+        # Transitions (x_t, u_t, x_t+1) of all time steps, T - 1 x N x (dX + dU + dX).
+        Ys = np.concatenate([X[:, :-1], U[:, :-1], X[:, 1:]], axis=2).transpose(1, 0, 2)
+        if self._num_added == 0:
+            self._add(Ys)
+
+        # Statistics of this iteration are discounted once the next one starts adding samples.
+        self._num_added = 0
+        self._discount = True
+        return self._fit_moments(self._count, self._mean, self._M2, Ys, dimX, dimU)
+
+    def _add(self, Ys):
+        """Accumulate the statistics of transitions.
+
+        Args:
+            Ys: A T - 1 x N x (dX + dU + dX) array of transitions.
+
+        """
+        if self._discount:
+            self._count *= self._forgetting_factor
+            self._M2 *= self._forgetting_factor
+            self._discount = False
+
+        # Combine the moments with the parallel variance formula.
+        N = Ys.shape[1]
+        mean = np.mean(Ys, axis=1)
+        diff = Ys - mean[:, None]
+        M2 = np.einsum('tni,tnj->tij', diff, diff)
+        if self._mean is None or self._count == 0:
+            self._mean, self._M2 = mean, M2
+        else:
+            count = self._count + N
+            dmean = mean - self._mean
+            self._M2 = self._M2 + M2 + (self._count * N / count) * np.einsum('ti,tj->tij', dmean, dmean)
+            self._mean = self._mean + (N / count) * dmean
+        self._count += N
+        self._num_added += Ys.shape[1]
@@ -5,6 +5,7 @@ import logging
 import numpy as np
 
 from gps.algorithm.dynamics.config import DYN_PRIOR_GMM
+from gps.utility.general_utils import RingBuffer
 from gps.utility.gmm import GMM
 
 LOGGER = logging.getLogger(__name__)
@@ -28,76 +29,126 @@ class DynamicsPriorGMM:
         Hyperparameters:
             min_samples_per_cluster: Minimum samples per cluster.
             max_clusters: Maximum number of clusters to fit.
-            max_samples: Maximum number of trajectories to use for fitting the GMM at any given time.
+            max_samples: Maximum number of trajectories to use for fitting the GMM at any given time, per condition.
+            num_conditions: Number of conditions whose pooled samples the prior is fitted on.
             strength: Adjusts the strength of the prior.
+            dtype: Floating point precision of the GMM.
+            estep_max_memory: Memory ceiling in bytes of the GMM E-step.
+            estep_threads: Number of threads of the GMM E-step.
+            gmm_init: Initialization of the GMM clusters, `kmeans++` or `random`.
+            gmm_tol: Relative log-likelihood tolerance of the EM convergence.
+            gmm_resize: Warm start the GMM by splitting or merging clusters when the number of clusters changes.
+            covariance_type: Structure of the GMM cluster covariances, `full`, `diag` or `lowrank`.
+            covariance_rank: Rank of the low-rank part of `lowrank` cluster covariances.
+            incremental_em: Update the GMM by stepwise EM on the new samples.
+            incremental_em_iterations: Maximum number of EM iterations of an incremental update.
 
         """
         config = copy.deepcopy(DYN_PRIOR_GMM)
         config.update(hyperparams)
         self._hyperparams = config
-        self.X = None
-        self.U = None
-        self.gmm = GMM()
+        # Ring buffer of the [x_t, u_t, x_t+1] points of each trajectory in the window.
+        self._buffer = None
+        # Ring buffers of the initial states of each condition, when the samples of several conditions are pooled.
+        self._x0_buffers = {}
+        self._dX = None
+        self.gmm = GMM(
+            dtype=self._hyperparams['dtype'],
+            max_memory=self._hyperparams['estep_max_memory'],
+            num_threads=self._hyperparams['estep_threads'],
+            init=self._hyperparams['gmm_init'],
+            tol=self._hyperparams['gmm_tol'],
+            resize=self._hyperparams['gmm_resize'],
+            covariance=self._hyperparams['covariance_type'],
+            rank=self._hyperparams['covariance_rank']
+        )
         self._min_samp = self._hyperparams['min_samples_per_cluster']
-        self._max_samples = self._hyperparams['max_samples']
+        self._max_samples = self._hyperparams['max_samples'] * self._hyperparams['num_conditions']
         self._max_clusters = self._hyperparams['max_clusters']
         self._strength = self._hyperparams['strength']
         self.regularization = self._hyperparams.get('regularization', 0)
 
-    def initial_state(self):
-        """Return dynamics prior for initial time step."""
+    def initial_state(self, cond=None):
+        """Return dynamics prior for initial time step.
+
+        Args:
+            cond: Optional condition whose stored initial states the prior is evaluated on instead of those of all
+                stored samples, for a prior shared by several conditions. See update.
+
+        """
         # Compute mean and covariance.
-        mu0 = np.mean(self.X[:, 0, :], axis=0)
-        Phi = np.diag(np.var(self.X[:, 0, :], axis=0))
+        if cond is None:
+            x0 = self._buffer.data[:, 0, :self._dX]
+        else:
+            x0 = self._x0_buffers[cond].data
+        mu0 = np.mean(x0, axis=0, dtype=np.float64)
+        Phi = np.diag(np.var(x0, axis=0, dtype=np.float64))
 
         # Factor in multiplier.
-        n0 = self.X.shape[2] * self._strength
-        m = self.X.shape[2] * self._strength
+        n0 = self._dX * self._strength
+        m = self._dX * self._strength
 
         # Multiply Phi by m (since it was normalized before).
         Phi = Phi * m
         return mu0, Phi, m, n0
 
-    def update(self, X, U):
+    def update(self, X, U, conditions=None):
         """Update prior with additional data.
 
         Args:
             X: A N x T x dX matrix of sequential state data.
             U: A N x T x dU matrix of sequential control data.
+            conditions: Optional N vector of the conditions of the trajectories. The initial states of each condition
+                are then kept in a window of max_samples - 1 trajectories of their own, see initial_state.
 
         """
         # Constants.
         T = X.shape[1] - 1
-
-        # Append data to dataset.
-        if self.X is None:
-            self.X = X
-        else:
-            self.X = np.concatenate([self.X, X], axis=0)
-
-        if self.U is None:
-            self.U = U
-        else:
-            self.U = np.concatenate([self.U, U], axis=0)
-
-        # Remove excess samples from dataset.
-        start = max(0, self.X.shape[0] - self._max_samples + 1)
-        self.X = self.X[start:, :]
-        self.U = self.U[start:, :]
-
-        # Compute cluster dimensionality.
-        Do = X.shape[2] + U.shape[2] + X.shape[2]  # TODO: Use Xtgt.
-
-        # Create dataset.
-        N = self.X.shape[0]
-        xux = np.reshape(np.c_[self.X[:, :T, :], self.U[:, :T, :], self.X[:, 1:(T + 1), :]], [T * N, Do])
+        dX, dU = X.shape[2], U.shape[2]
+        Do = dX + dU + dX  # TODO: Use Xtgt.
+
+        # Keep the last max_samples - 1 trajectories, the new ones included.
+        if self._buffer is None or self._buffer.data.shape[1:] != (T, Do):
+            self._buffer = RingBuffer(max(1, self._max_samples - 1), (T, Do), dtype=self.gmm.dtype)
+            self._x0_buffers = {}
+            self._dX = dX
+        num_old = len(self._buffer)
+
+        # Keep the initial states of each condition.
+        if conditions is not None:
+            conditions = np.asarray(conditions)
+            for cond in np.unique(conditions):
+                if cond not in self._x0_buffers:
+                    self._x0_buffers[cond] = RingBuffer(
+                        max(1, self._hyperparams['max_samples'] - 1), (dX, ), dtype=self.gmm.dtype
+                    )
+                self._x0_buffers[cond].append(X[conditions == cond, 0])
+
+        # Append the points of the new trajectories to the dataset.
+        xux = np.concatenate([X[:, :T, :], U[:, :T, :], X[:, 1:(T + 1), :]], axis=2)
+        self._buffer.append(xux)
+        N = len(self._buffer)
 
         # Choose number of clusters.
         K = int(max(2, min(self._max_clusters, np.floor(float(N * T) / self._min_samp))))
         LOGGER.debug('Generating %d clusters for dynamics GMM.', K)
 
         # Update GMM.
-        self.gmm.update(xux, K)
+        num_new = X.shape[0]
+        if self._hyperparams['incremental_em'] and num_new < N and self.gmm.can_update_incremental(K):
+            # Fold in the trajectories that were appended and drop those that were removed.
+            num_expired = num_old + num_new - N
+            self.gmm.update_incremental(
+                xux.reshape(num_new * T, Do), T, num_expired, self._hyperparams['incremental_em_iterations']
+            )
+        else:
+            # Fit on a view of the buffer, whose trajectories are ordered by their slot.
+            self.gmm.update(
+                self._buffer.data.reshape(N * T, Do),
+                K,
+                block_size=T if self._hyperparams['incremental_em'] else None,
+                first_block=self._buffer.start
+            )
 
     def eval(self, Dx, Du, pts):
         """Evaluate prior.
@@ -107,12 +158,31 @@ class DynamicsPriorGMM:
             Du: Dimension of action space
             pts: A N x Dx+Du+Dx matrix.
 
+        """
+        mu0, Phi, m, n0 = self.eval_batch(Dx, Du, pts[None])
+        return mu0[0], Phi[0], m, n0
+
+    def eval_batch(self, Dx, Du, pts, window=1):
+        """Evaluate prior for several time steps at once.
+
+        Args:
+            Dx: Dimension of state space
+            Du: Dimension of action space
+            pts: A T x N x Dx+Du+Dx array.
+            window: Number of consecutive time steps that are pooled into one query.
+
+        Returns:
+            mu0: A T' x Dx+Du+Dx array of prior means, where T' = ceil(T / window).
+            Phi: A T' x Dx+Du+Dx x Dx+Du+Dx array of prior scatter matrices.
+            m: Prior strength of the means.
+            n0: Prior degrees of freedom.
+
         """
         # Construct query data point by rearranging entries and adding in reference.
-        assert pts.shape[1] == Dx + Du + Dx
+        assert pts.shape[2] == Dx + Du + Dx
 
         # Perform query and fix mean.
-        mu0, Phi, m, n0 = self.gmm.inference(pts)
+        mu0, Phi, m, n0 = self.gmm.inference_batch(pts, window)
 
         # Factor in multiplier.
         n0 = n0 * self._strength
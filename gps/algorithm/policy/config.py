@@ -6,4 +6,18 @@ POLICY_PRIOR_GMM = {
     'max_clusters': 50,
     'max_samples': 20,
     'strength': 1.0,
+    'dtype': 'float64',  # Floating point precision of the GMM.
+    'estep_max_memory': 2**24,  # Memory ceiling in bytes of the GMM E-step.
+    'estep_threads': 1,  # Number of threads of the GMM E-step.
+    'gmm_init': 'kmeans++',  # Initialization of the GMM clusters, 'kmeans++' or 'random'.
+    'gmm_tol': 1e-5,  # Relative log-likelihood tolerance of the EM convergence.
+    'gmm_resize': True,  # Warm start the GMM by splitting or merging clusters when the number of clusters changes.
+    # Structure of the GMM cluster covariances, 'full', 'diag' or 'lowrank' (low-rank plus diagonal). The structured
+    # covariances make the E-step scale linearly in the dimension, see GMM.
+    'covariance_type': 'full',
+    'covariance_rank': 5,  # Rank of the low-rank part of 'lowrank' cluster covariances.
+    # Update the GMM by stepwise EM on the new samples instead of refitting it on all samples, see
+    # GMM.update_incremental. The GMM is refitted whenever the number of clusters changes.
+    'incremental_em': False,
+    'incremental_em_iterations': 5,
 }
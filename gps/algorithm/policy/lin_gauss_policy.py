@@ -9,20 +9,25 @@ class LinearGaussianPolicy(Policy):
     """Time-varying linear Gaussian policy.
 
     U = K*x + k + noise, where noise ~ N(0, chol_pol_covar)
+
+    With window > 1, the parameters are shared by windows of `window` consecutive time steps, i.e. K[t // window] is
+    used at time step t.
     """
 
-    def __init__(self, K, k, pol_covar, chol_pol_covar, inv_pol_covar):
+    def __init__(self, K, k, pol_covar, chol_pol_covar, inv_pol_covar, window=1, T=None):
         Policy.__init__(self)
 
         # Assume K has the correct shape, and make sure others match.
-        self.T = K.shape[0]
+        W = K.shape[0]
+        self.window = window
+        self.T = W * window if T is None else T
         self.dU = K.shape[1]
         self.dX = K.shape[2]
 
-        check_shape(k, (self.T, self.dU))
-        check_shape(pol_covar, (self.T, self.dU, self.dU))
-        check_shape(chol_pol_covar, (self.T, self.dU, self.dU))
-        check_shape(inv_pol_covar, (self.T, self.dU, self.dU))
+        check_shape(k, (W, self.dU))
+        check_shape(pol_covar, (W, self.dU, self.dU))
+        check_shape(chol_pol_covar, (W, self.dU, self.dU))
+        check_shape(inv_pol_covar, (W, self.dU, self.dU))
 
         self.K = K
         self.k = k
@@ -43,13 +48,31 @@ class LinearGaussianPolicy(Policy):
             A dU dimensional action vector.
 
         """
-        u = self.K[t].dot(x) + self.k[t]
+        w = t // self.window
+        u = self.K[w].dot(x) + self.k[w]
         if noise is not None:
-            covar = self.chol_pol_covar[t].T
+            covar = self.chol_pol_covar[w].T
 
             u += covar.dot(noise[t])
         return u
 
+    def log_prob(self, X, U):
+        """Computes the log probabilities of actions.
+
+        Args:
+            X: A N x T x dX array of states.
+            U: A N x T x dU array of actions.
+
+        Returns:
+            A N x T array of the log probabilities of the actions given the states.
+
+        """
+        policy = self.per_step()
+        diff = U - np.einsum('tij,ntj->nti', policy.K, X) - policy.k
+        logdet = 2 * np.sum(np.log(np.diagonal(policy.chol_pol_covar, axis1=1, axis2=2)), axis=1)
+        maha = np.einsum('nti,tij,ntj->nt', diff, policy.inv_pol_covar, diff)
+        return -0.5 * (maha + logdet + self.dU * np.log(2 * np.pi))
+
     def nans_like(self):
         """Creates a new linear Gaussian policy object with the same dimensions but all values filled with NaNs."""
         policy = LinearGaussianPolicy(
@@ -58,6 +81,8 @@ class LinearGaussianPolicy(Policy):
             np.zeros_like(self.pol_covar),
             np.zeros_like(self.chol_pol_covar),
             np.zeros_like(self.inv_pol_covar),
+            self.window,
+            self.T,
         )
         policy.K.fill(np.nan)
         policy.k.fill(np.nan)
@@ -65,3 +90,12 @@ class LinearGaussianPolicy(Policy):
         policy.chol_pol_covar.fill(np.nan)
         policy.inv_pol_covar.fill(np.nan)
         return policy
+
+    def per_step(self):
+        """Returns the policy with separate parameters for each time step, i.e. itself if window is 1."""
+        if self.window == 1:
+            return self
+        w = np.arange(self.T) // self.window
+        return LinearGaussianPolicy(
+            self.K[w], self.k[w], self.pol_covar[w], self.chol_pol_covar[w], self.inv_pol_covar[w]
+        )
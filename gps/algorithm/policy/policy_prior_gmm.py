@@ -5,6 +5,7 @@ import logging
 import numpy as np
 
 from gps.algorithm.policy.config import POLICY_PRIOR_GMM
+from gps.utility.general_utils import RingBuffer
 from gps.utility.gmm import GMM
 from gps.algorithm.algorithm_utils import gauss_fit_joint_prior
 
@@ -31,14 +32,34 @@ class PolicyPriorGMM:
             max_clusters: Maximum number of clusters to fit.
             max_samples: Maximum number of trajectories to use for fitting the GMM at any given time.
             strength: Adjusts the strength of the prior.
+            dtype: Floating point precision of the GMM.
+            estep_max_memory: Memory ceiling in bytes of the GMM E-step.
+            estep_threads: Number of threads of the GMM E-step.
+            gmm_init: Initialization of the GMM clusters, `kmeans++` or `random`.
+            gmm_tol: Relative log-likelihood tolerance of the EM convergence.
+            gmm_resize: Warm start the GMM by splitting or merging clusters when the number of clusters changes.
+            covariance_type: Structure of the GMM cluster covariances, `full`, `diag` or `lowrank`.
+            covariance_rank: Rank of the low-rank part of `lowrank` cluster covariances.
+            incremental_em: Update the GMM by stepwise EM on the new samples.
+            incremental_em_iterations: Maximum number of EM iterations of an incremental update.
 
         """
         config = copy.deepcopy(POLICY_PRIOR_GMM)
         config.update(hyperparams)
         self._hyperparams = config
-        self.X = None
-        self.obs = None
-        self.gmm = GMM()
+        # Ring buffers of the observations and the [x_t, u_t] points of each trajectory in the window.
+        self._obs = None
+        self._xu = None
+        self.gmm = GMM(
+            dtype=self._hyperparams['dtype'],
+            max_memory=self._hyperparams['estep_max_memory'],
+            num_threads=self._hyperparams['estep_threads'],
+            init=self._hyperparams['gmm_init'],
+            tol=self._hyperparams['gmm_tol'],
+            resize=self._hyperparams['gmm_resize'],
+            covariance=self._hyperparams['covariance_type'],
+            rank=self._hyperparams['covariance_rank']
+        )
         # TODO: handle these params better (e.g. should depend on N?)
         self._min_samp = self._hyperparams['min_samples_per_cluster']
         self._max_samples = self._hyperparams['max_samples']
@@ -55,39 +76,80 @@ class PolicyPriorGMM:
 
         """
         X, obs = samples.get_X(), samples.get_obs()
+        # Number of appended samples, for the incremental update.
+        num_new = 0
 
-        if self.X is None or mode == 'replace':
-            self.X = X
-            self.obs = obs
+        if self._obs is None or mode == 'replace':
+            # All samples of the set are kept, even if there are more than max_samples.
+            self._obs = RingBuffer(max(self._max_samples, X.shape[0], 1), obs.shape[1:], dtype=obs.dtype)
+            self._xu = None
         elif mode == 'add' and X.size > 0:
-            self.X = np.concatenate([self.X, X], axis=0)
-            self.obs = np.concatenate([self.obs, obs], axis=0)
-            # Trim extra samples
-            # TODO: how should this interact with replace_samples?
-            N = self.X.shape[0]
-            if N > self._max_samples:
-                start = N - self._max_samples
-                self.X = self.X[start:, :, :]
-                self.obs = self.obs[start:, :, :]
-
-        # Evaluate policy at samples to get mean policy action.
-        U = policy_opt.prob(self.obs.copy())[0]
-        # Create the dataset
-        N, T = self.X.shape[:2]
-        dO = self.X.shape[2] + U.shape[2]
-        XU = np.reshape(np.concatenate([self.X, U], axis=2), [T * N, dO])
+            if self._obs.capacity > self._max_samples:
+                # Trim a larger replaced set to max_samples, which requires a full refit.
+                self._obs = self._trim(self._obs)
+                self._xu = self._trim(self._xu)
+            else:
+                num_new = min(X.shape[0], self._max_samples)
+        else:
+            X, obs = X[:0], obs[:0]
+        num_old = len(self._obs)
+        self._obs.append(obs)
+
+        N, T = len(self._obs), X.shape[1]
         # Choose number of clusters.
         K = int(max(2, min(self._max_clusters, np.floor(float(N * T) / self._min_samp))))
-
         LOGGER.debug('Generating %d clusters for policy prior GMM.', K)
-        self.gmm.update(XU, K)
+
+        if self._hyperparams['incremental_em'] and 0 < num_new < N and self.gmm.can_update_incremental(K):
+            # Fold in the new samples and drop the removed ones. The retained samples keep the statistics of the
+            # policy they were added with, so only the new samples are evaluated.
+            U = policy_opt.prob(obs[-num_new:].copy())[0]
+            XU = np.concatenate([X[-num_new:], U], axis=2)
+            self._xu.append(XU)
+            self.gmm.update_incremental(
+                XU.reshape(T * num_new, -1), T, num_old + num_new - N, self._hyperparams['incremental_em_iterations']
+            )
+        else:
+            # Evaluate policy at samples to get mean policy action.
+            U = policy_opt.prob(self._obs.data.copy())[0]
+            dX, dU = X.shape[2], U.shape[2]
+            if self._xu is None:
+                self._xu = RingBuffer(self._obs.capacity, (T, dX + dU), dtype=self.gmm.dtype)
+            # Append the new states and write the actions of all samples in place.
+            self._xu.append(np.concatenate([X, np.zeros((X.shape[0], T, dU))], axis=2))
+            xu = self._xu.data
+            xu[:, :, dX:] = U
+            # Fit on a view of the buffer, whose samples are ordered by their slot.
+            self.gmm.update(
+                xu.reshape(T * N, dX + dU),
+                K,
+                block_size=T if self._hyperparams['incremental_em'] else None,
+                first_block=self._xu.start
+            )
+
+    def _trim(self, buffer):
+        """Returns a buffer of capacity max_samples holding the newest items of a buffer."""
+        trimmed = RingBuffer(self._max_samples, buffer.data.shape[1:], dtype=buffer.data.dtype)
+        trimmed.append(np.roll(buffer.data, -buffer.start, axis=0))
+        return trimmed
 
     def eval(self, Ts, Ps):
         """Evaluate prior."""
-        # Construct query data point.
-        pts = np.concatenate((Ts, Ps), axis=1)
+        mu0, Phi, m, n0 = self.eval_batch(Ts[None], Ps[None])
+        return mu0[0], Phi[0], m, n0
+
+    def eval_batch(self, Ts, Ps):
+        """Evaluate prior for all time steps at once.
+
+        Args:
+            Ts: States (T, N, dX)
+            Ps: Policy means (T, N, dU)
+
+        """
+        # Construct query data points.
+        pts = np.concatenate((Ts, Ps), axis=2)
         # Perform query.
-        mu0, Phi, m, n0 = self.gmm.inference(pts)
+        mu0, Phi, m, n0 = self.gmm.inference_batch(pts)
         # Factor in multiplier.
         n0 *= self._strength
         m *= self._strength
@@ -118,20 +180,19 @@ class PolicyPriorGMM:
         pol_k = np.zeros([T, dU])
         pol_S = np.zeros([T, dU, dU])
 
+        # Obtain Normal-inverse-Wishart prior of all time steps.
+        mu0, Phi, mm, n0 = self.eval_batch(X.transpose(1, 0, 2), pol_mu.transpose(1, 0, 2))
+
         # Fit policy linearization with least squares regression.
         dwts = (1.0 / N) * np.ones(N)
         for t in range(T):
-            Ts = X[:, t, :]
-            Ps = pol_mu[:, t, :]
-            Ys = np.concatenate([Ts, Ps], axis=1)
-            # Obtain Normal-inverse-Wishart prior.
-            mu0, Phi, mm, n0 = self.eval(Ts, Ps)
+            Ys = np.concatenate([X[:, t, :], pol_mu[:, t, :]], axis=1)
             sig_reg = np.zeros((dX + dU, dX + dU))
             # Slightly regularize on first timestep.
             if t == 0:
                 sig_reg[:dX, :dX] = 1e-8
             pol_K[t, :, :], pol_k[t, :], pol_S[t, :, :] = gauss_fit_joint_prior(
-                Ys, mu0, Phi, mm, n0, dwts, dX, dU, sig_reg
+                Ys, mu0[t], Phi[t], mm, n0, dwts, dX, dU, sig_reg
             )
         pol_S += pol_sig
         return pol_K, pol_k, pol_S
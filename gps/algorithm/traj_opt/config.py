@@ -7,4 +7,25 @@ TRAJ_OPT_LQR = {
     'eta_error_threshold': 1e16,
     'min_eta': 1e-6,
     'max_eta': 1e16,
+    # Recovery from a non-PD Q-function, either 'eta' (restart the backward pass with increased eta) or 'regularize'
+    # (regularize Quu at the failing time step and continue the backward pass, see lqr_backward).
+    'non_pd_recovery': 'eta',
+    # Relative eigenvalue floor of the Quu regularization.
+    'quu_regularization': 1e-4,
+    # Root finding method for eta, either 'bisection' or 'secant'. See EtaSearch.
+    'eta_search': 'bisection',
+    # Factor around the previous eta of the initial bracket of each eta search, None (default) to start every search
+    # from [min_eta, max_eta].
+    'eta_bracket_factor': None,
+    # Number of etas evaluated per condition in each batched DGD sweep. Values > 1 enable the speculative search.
+    'eta_candidates': 1,
+    # Backend of the LQR backward pass, either 'numpy' or 'numba' (requires numba).
+    'lqr_backend': 'numpy',
+    # Floating point precision of the LQR passes, 'float64' or 'float32'. Quu is always factorized in float64.
+    'dtype': 'float64',
+    # Number of consecutive time steps sharing one policy, see TrajOptLQRPython.backward_batch. Not supported by the
+    # numba backend.
+    'time_window': 1,
+    # Number of conditions optimized, sizes the memo of forward pass marginals. Set by the algorithm.
+    'num_conditions': 8,
 }
@@ -0,0 +1,465 @@
+"""This file defines batched kernels for LQR-based trajectory optimization.
+
+All kernels operate on a leading batch axis, so that several conditions (or several dual variables) are processed in
+a single sweep over the time horizon.
+"""
+from collections import OrderedDict
+import logging
+
+import numpy as np
+from numpy.linalg import LinAlgError
+
+LOGGER = logging.getLogger(__name__)
+
+
+class LQRWorkspace:
+    """Scratch buffers of the LQR kernels.
+
+    Buffers are allocated for the largest batch seen so far and reused for all smaller batches with the same
+    dimensions, e.g. across the DGD iterations and conditions of a trajectory optimization. The buffers are not
+    pickled.
+    """
+
+    def __init__(self):
+        """Initializes an empty workspace."""
+        self._buffers = {}
+
+    def get(self, name, shape, dtype=np.float64):
+        """Returns an uninitialized buffer of the given shape, reusing a previous allocation if possible."""
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.dtype != dtype or buffer.shape[1:] != shape[1:] or buffer.shape[0] < shape[0]:
+            buffer = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buffer[:shape[0]]
+
+    def __getstate__(self):
+        """Pickle the workspace without its buffers."""
+        return {'_buffers': {}}
+
+
+def lqr_backward(Cm, cv, Fm, fv, workspace=None, backend='numpy', steps=None, regularize=None, regularized=None):
+    """Perform a batched LQR backward pass.
+
+    The pass runs in the precision of the inputs. The action component of the Q-function is always factorized in
+    float64 for numerical conditioning.
+
+    With `steps`, each entry of the time axis is a window of several time steps with time-invariant dynamics, cost and
+    policy. The policy of a window is computed from the value function at its end, which is then propagated through
+    the closed loop to the start of the window, see _propagate_closed_loop.
+
+    With `regularize`, a non-PD Quu is made PD by adding the smallest multiple of the identity that lifts its smallest
+    eigenvalue to `regularize` times its largest absolute eigenvalue, but at least to `regularize`. This is equivalent
+    to increasing the action cost of that time step, so the recursion remains valid and continues from there instead of
+    failing.
+
+    Args:
+        Cm: B x T x (dX + dU) x (dX + dU) quadratic cost terms.
+        cv: B x T x (dX + dU) linear cost terms.
+        Fm: B x T x dX x (dX + dU) linear dynamics.
+        fv: B x T x dX constant dynamics.
+        workspace: LQRWorkspace for the scratch buffers of the numpy backend. A temporary one is used if not given.
+        backend: `numpy` or `numba`. The numba backend compiles the Riccati recursion and requires numba.
+        steps: Optional T vector of the number of time steps in each window. Only supported by the numpy backend.
+        regularize: Optional relative eigenvalue floor for the regularization of a non-PD Quu.
+        regularized: Optional integer B vector, incremented by the number of regularized time steps of each entry.
+
+    Returns:
+        K: B x T x dU x dX feedback gains.
+        k: B x T x dU feedforward terms.
+        pol_covar: B x T x dU x dU policy covariances.
+        chol_pol_covar: B x T x dU x dU upper Cholesky factors of the policy covariances.
+        inv_pol_covar: B x T x dU x dU policy precisions.
+        fail: Boolean B vector, True for batch entries with a non-PD Q-function. The policy of these entries is
+            undefined.
+
+    """
+    # Constants.
+    B, T, dX = Fm.shape[:3]
+    dU = Fm.shape[3] - dX
+    dtype = np.result_type(Cm, cv, Fm, fv)
+
+    # Allocate outputs. These are not taken from the workspace, as they end up in the new policies.
+    K = np.empty((B, T, dU, dX), dtype=dtype)
+    k = np.empty((B, T, dU), dtype=dtype)
+    pol_covar = np.empty((B, T, dU, dU), dtype=dtype)
+    chol_pol_covar = np.empty((B, T, dU, dU), dtype=dtype)
+    inv_pol_covar = np.empty((B, T, dU, dU), dtype=dtype)
+    fail = np.zeros(B, dtype=bool)
+    if regularized is None:
+        regularized = np.zeros(B, dtype=int)
+
+    if backend == 'numpy':
+        _lqr_backward_numpy(
+            Cm, cv, Fm, fv, K, k, pol_covar, chol_pol_covar, inv_pol_covar, fail, workspace or LQRWorkspace(), steps,
+            regularize, regularized
+        )
+    elif steps is not None:
+        raise ValueError('Time windows are not supported by the %r LQR backend' % backend)
+    elif backend == 'numba':
+        from gps.algorithm.traj_opt.lqr_kernel_numba import lqr_backward_numba
+        lqr_backward_numba(
+            np.ascontiguousarray(Cm, dtype=dtype),
+            np.ascontiguousarray(cv, dtype=dtype),
+            np.ascontiguousarray(Fm, dtype=dtype),
+            np.ascontiguousarray(fv, dtype=dtype),
+            K,
+            k,
+            pol_covar,
+            chol_pol_covar,
+            inv_pol_covar,
+            fail,
+            regularize or 0.0,
+            regularized,
+        )
+        for i in np.flatnonzero(fail):
+            LOGGER.debug('Non-PD Q-function in batch entry %d', i)
+    else:
+        raise ValueError('Unknown LQR backend %r' % backend)
+
+    return K, k, pol_covar, chol_pol_covar, inv_pol_covar, fail
+
+
+def _lqr_backward_numpy(
+    Cm, cv, Fm, fv, K, k, pol_covar, chol_pol_covar, inv_pol_covar, fail, workspace, steps, regularize, regularized
+):
+    """Batched Riccati recursion in numpy, writes the policies into the given output arrays."""
+    # Constants.
+    B, T, dX = Fm.shape[:3]
+    dU = Fm.shape[3] - dX
+    dXU = dX + dU
+    dtype = K.dtype
+
+    idx_x = slice(dX)
+    idx_u = slice(dX, dX + dU)
+
+    # Scratch buffers.
+    Qtt = workspace.get('Qtt', (B, dXU, dXU), dtype)
+    Qt = workspace.get('Qt', (B, dXU), dtype)
+    Qtmp = workspace.get('Qtmp', (B, dXU, dXU), dtype)
+    qtmp = workspace.get('qtmp', (B, dXU), dtype)
+    FmT_Vxx = workspace.get('FmT_Vxx', (B, dXU, dX), dtype)
+    Vxx = workspace.get('Vxx', (B, dX, dX), dtype)
+    Vx = workspace.get('Vx', (B, dX), dtype)
+    vtmp = workspace.get('vtmp', (B, dX), dtype)
+    eye = np.broadcast_to(np.eye(dU), (B, dU, dU))
+
+    # Compute state-action-state function at each time step.
+    for t in range(T - 1, -1, -1):
+        # Add in the cost.
+        Qtt[...] = Cm[:, t]  # B x (X+U) x (X+U)
+        Qt[...] = cv[:, t]  # B x (X+U)
+
+        # Add in the value function from the next time step.
+        if t < T - 1:
+            FmT = Fm[:, t].transpose(0, 2, 1)
+            np.matmul(FmT, Vxx, out=FmT_Vxx)
+            Qtt += np.matmul(FmT_Vxx, Fm[:, t], out=Qtmp)
+            np.add(Vx, np.einsum('bij,bj->bi', Vxx, fv[:, t], out=vtmp), out=vtmp)
+            Qt += np.einsum('bij,bj->bi', FmT, vtmp, out=qtmp)
+
+        # Symmetrize quadratic component.
+        np.add(Qtt, Qtt.transpose(0, 2, 1), out=Qtmp)
+        np.multiply(Qtmp, 0.5, out=Qtt)
+
+        # Compute Cholesky decomposition of Q function action component in float64. Entries that already failed are
+        # replaced by the identity, so the remaining batch can continue.
+        Quu = Qtt[:, idx_u, idx_u]
+        Quu[fail] = np.eye(dU)
+        Quu64 = Quu.astype(np.float64, copy=False)
+        try:
+            L = np.linalg.cholesky(Quu64)
+        except LinAlgError:
+            for i in np.flatnonzero(~fail):
+                try:
+                    np.linalg.cholesky(Quu64[i])
+                except LinAlgError as e:
+                    # Error thrown when Quu is not symmetric positive definite.
+                    LOGGER.debug('LinAlgError at t=%d in batch entry %d: %s', t, i, e)
+                    if regularize is None or not np.all(np.isfinite(Quu64[i])):
+                        fail[i] = True
+                        continue
+                    eig = np.linalg.eigvalsh(Quu64[i])
+                    Quu[i] += (max(regularize * np.max(np.abs(eig)), regularize) - eig[0]) * np.eye(dU)
+                    Quu64[i] = Quu[i]
+                    try:
+                        np.linalg.cholesky(Quu64[i])
+                    except LinAlgError:
+                        LOGGER.debug('Regularization failed at t=%d in batch entry %d', t, i)
+                        fail[i] = True
+                        continue
+                    regularized[i] += 1
+            Quu64[fail] = np.eye(dU)
+            L = np.linalg.cholesky(Quu64)
+
+        # Store conditional covariance, inverse, and Cholesky.
+        L_inv = np.linalg.solve(L, eye)
+        inv_pol_covar[:, t] = Quu
+        pol_covar64 = L_inv.transpose(0, 2, 1) @ L_inv
+        pol_covar[:, t] = pol_covar64
+        chol_pol_covar[:, t] = np.linalg.cholesky(pol_covar64).transpose(0, 2, 1)
+
+        # Compute mean terms.
+        np.matmul(pol_covar[:, t], Qtt[:, idx_u, idx_x], out=K[:, t])
+        np.negative(K[:, t], out=K[:, t])
+        np.einsum('bij,bj->bi', pol_covar[:, t], Qt[:, idx_u], out=k[:, t])
+        np.negative(k[:, t], out=k[:, t])
+
+        # Compute value function.
+        np.matmul(Qtt[:, idx_x, idx_u], K[:, t], out=Vxx)
+        Vxx += Qtt[:, idx_x, idx_x]
+        np.einsum('bij,bj->bi', Qtt[:, idx_x, idx_u], k[:, t], out=Vx)
+        Vx += Qt[:, idx_x]
+        np.add(Vxx, Vxx.transpose(0, 2, 1), out=Qtmp[:, :dX, :dX])
+        np.multiply(Qtmp[:, :dX, :dX], 0.5, out=Vxx)
+
+        # Propagate value function to the start of the window.
+        if steps is not None and steps[t] > 1:
+            _propagate_closed_loop(Vxx, Vx, Cm[:, t], cv[:, t], Fm[:, t], fv[:, t], K[:, t], k[:, t], steps[t] - 1)
+        Vxx[fail] = 0.0
+        Vx[fail] = 0.0
+
+
+def _propagate_closed_loop(Vxx, Vx, Cm, cv, Fm, fv, K, k, n):
+    """Propagates a value function backward through n time steps of a time-invariant closed loop, in place.
+
+    Each step adds the cost of [x; Kx + k] and applies the dynamics. The n steps are composed by repeated doubling, so
+    the number of batched matrix products is logarithmic in n.
+
+    Args:
+        Vxx: B x dX x dX quadratic value function terms.
+        Vx: B x dX linear value function terms.
+        Cm: B x (dX + dU) x (dX + dU) quadratic cost terms of each step.
+        cv: B x (dX + dU) linear cost terms of each step.
+        Fm: B x dX x (dX + dU) linear dynamics.
+        fv: B x dX constant dynamics.
+        K: B x dU x dX feedback gains.
+        k: B x dU feedforward terms.
+        n: Number of time steps.
+
+    """
+    B, dU, dX = K.shape
+
+    # A single step x -> A x + c with cost 0.5 x'Rx + x'r, where [x; u] = G x + g.
+    G = np.concatenate([np.broadcast_to(np.eye(dX, dtype=K.dtype), (B, dX, dX)), K], axis=1)
+    g = np.concatenate([np.zeros((B, dX), dtype=k.dtype), k], axis=1)
+    GT = G.transpose(0, 2, 1)
+    step = (
+        Fm @ G,
+        np.einsum('bij,bj->bi', Fm, g) + fv,
+        GT @ Cm @ G,
+        np.einsum('bij,bj->bi', GT, np.einsum('bij,bj->bi', Cm, g) + cv),
+    )
+
+    def compose(first, second):
+        """Composes two blocks of steps, the second following the first."""
+        A1, c1, R1, r1 = first
+        A2, c2, R2, r2 = second
+        A1T = A1.transpose(0, 2, 1)
+        return (
+            A2 @ A1,
+            np.einsum('bij,bj->bi', A2, c1) + c2,
+            R1 + A1T @ R2 @ A1,
+            r1 + np.einsum('bij,bj->bi', A1T, np.einsum('bij,bj->bi', R2, c1) + r2),
+        )
+
+    # All blocks are powers of the same step, so they commute.
+    block = None
+    while n:
+        if n & 1:
+            block = step if block is None else compose(block, step)
+        n >>= 1
+        if n:
+            step = compose(step, step)
+
+    A, c, R, r = block
+    AT = A.transpose(0, 2, 1)
+    Vx[...] = r + np.einsum('bij,bj->bi', AT, np.einsum('bij,bj->bi', Vxx, c) + Vx)
+    Vxx[...] = R + AT @ Vxx @ A
+    Vxx[...] = 0.5 * (Vxx + Vxx.transpose(0, 2, 1))
+
+
+def lqr_forward(K, k, pol_covar, Fm, fv, dyn_covar, x0mu, x0sigma):
+    """Perform a batched LQR forward pass.
+
+    Computes state-action marginals from dynamics and policies.
+
+    Args:
+        K: B x T x dU x dX feedback gains.
+        k: B x T x dU feedforward terms.
+        pol_covar: B x T x dU x dU policy covariances.
+        Fm: B x T x dX x (dX + dU) linear dynamics.
+        fv: B x T x dX constant dynamics.
+        dyn_covar: B x T x dX x dX dynamics covariances.
+        x0mu: B x dX initial state means.
+        x0sigma: B x dX x dX initial state covariances.
+
+    Returns:
+        mu: B x T x (dX + dU) mean state + action vectors.
+        sigma: B x T x (dX + dU) x (dX + dU) state + action covariance matrices.
+
+    """
+    # Constants.
+    B, T, dU, dX = K.shape
+
+    idx_x = slice(dX)
+    idx_u = slice(dX, dX + dU)
+
+    # Allocate space.
+    dtype = np.result_type(K, Fm)
+    sigma = np.zeros((B, T, dX + dU, dX + dU), dtype=dtype)
+    mu = np.zeros((B, T, dX + dU), dtype=dtype)
+
+    # Set initial mean and covariance.
+    mu[:, 0, idx_x] = x0mu
+    sigma[:, 0, idx_x, idx_x] = x0sigma
+
+    KT = K.transpose(0, 1, 3, 2)
+    FmT = Fm.transpose(0, 1, 3, 2)
+    for t in range(T):
+        sigma_t, mu_t = sigma[:, t], mu[:, t]
+        sigma_xx = sigma_t[:, idx_x, idx_x]
+
+        # Write the action blocks of the joint distribution.
+        mu_t[:, idx_u] = (K[:, t] @ mu_t[:, idx_x, None])[..., 0] + k[:, t]
+        np.matmul(sigma_xx, KT[:, t], out=sigma_t[:, idx_x, idx_u])
+        np.matmul(K[:, t], sigma_xx, out=sigma_t[:, idx_u, idx_x])
+        sigma_t[:, idx_u, idx_u] = sigma_t[:, idx_u, idx_x] @ KT[:, t] + pol_covar[:, t]
+
+        # Symmetrize sigma.
+        sigma_t += sigma_t.transpose(0, 2, 1).copy()
+        sigma_t *= 0.5
+
+        # Propagate through the dynamics.
+        if t < T - 1:
+            mu[:, t + 1, idx_x] = (Fm[:, t] @ mu_t[..., None])[..., 0] + fv[:, t]
+            sigma[:, t + 1, idx_x, idx_x] = Fm[:, t] @ sigma_t @ FmT[:, t] + dyn_covar[:, t]
+
+    return mu, sigma
+
+
+def random_problem(B, T, dX, dU, seed=0):
+    """Creates random, well conditioned costs and dynamics, for benchmarks and tests of the kernels.
+
+    Args:
+        B: Batch size.
+        T: Number of time steps.
+        dX: State dimension.
+        dU: Action dimension.
+        seed: Seed of the random numbers.
+
+    Returns:
+        Cm: B x T x (dX + dU) x (dX + dU) positive definite quadratic cost terms.
+        cv: B x T x (dX + dU) linear cost terms.
+        Fm: B x T x dX x (dX + dU) linear dynamics close to the identity.
+        fv: B x T x dX constant dynamics.
+
+    """
+    rng = np.random.RandomState(seed)
+    G = rng.randn(B, T, dX + dU, dX + dU)
+    Cm = 0.1 * G @ G.transpose(0, 1, 3, 2) + 0.1 * np.eye(dX + dU)
+    cv = rng.randn(B, T, dX + dU)
+    Fm = np.concatenate([np.eye(dX) + 0.05 * rng.randn(B, T, dX, dX), 0.1 * rng.randn(B, T, dX, dU)], axis=3)
+    fv = 0.01 * rng.randn(B, T, dX)
+    return Cm, cv, Fm, fv
+
+
+def forward_marginals(traj_distrs, traj_infos):
+    """Propagate several linear Gaussian policies through their dynamics in one batched forward pass.
+
+    Policies and dynamics shared by windows of time steps are expanded to each time step.
+
+    Args:
+        traj_distrs: List of linear Gaussian policy objects.
+        traj_infos: List of TrajectoryInfo objects, one per policy.
+
+    Returns:
+        mu: B x T x (dX + dU) mean state + action vectors.
+        sigma: B x T x (dX + dU) x (dX + dU) state + action covariance matrices.
+
+    """
+    traj_distrs = [traj_distr.per_step() for traj_distr in traj_distrs]
+    dynamics = [traj_info.dynamics.per_step() for traj_info in traj_infos]
+    return lqr_forward(
+        np.stack([traj_distr.K for traj_distr in traj_distrs]),
+        np.stack([traj_distr.k for traj_distr in traj_distrs]),
+        np.stack([traj_distr.pol_covar for traj_distr in traj_distrs]),
+        np.stack([Fm for Fm, _, _ in dynamics]),
+        np.stack([fv for _, fv, _ in dynamics]),
+        np.stack([dyn_covar for _, _, dyn_covar in dynamics]),
+        np.stack([traj_info.x0mu for traj_info in traj_infos]),
+        np.stack([traj_info.x0sigma for traj_info in traj_infos]),
+    )
+
+
+class MarginalCache:
+    """Memo of forward pass marginals, keyed by policy and dynamics objects.
+
+    Entries are validated by the identity of the arrays they were computed from, so reassigning the policy, dynamics or
+    initial state arrays (e.g. by refitting the dynamics) invalidates them. The arrays must not be modified in place.
+    The memo holds at most `size` entries and is not pickled.
+    """
+
+    def __init__(self, size=32):
+        """Initializes an empty memo.
+
+        Args:
+            size: Maximum number of entries, the least recently used entries are evicted first.
+
+        """
+        self.size = size
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _sources(traj_distr, traj_info):
+        """Arrays the marginals of a policy and trajectory info depend on."""
+        dynamics = traj_info.dynamics
+        return (
+            traj_distr.K, traj_distr.k, traj_distr.pol_covar, dynamics.Fm, dynamics.fv, dynamics.dyn_covar,
+            traj_info.x0mu, traj_info.x0sigma
+        )
+
+    def get(self, traj_distr, traj_info):
+        """Returns the memoized marginals (mu, sigma) or None."""
+        key = id(traj_distr), id(traj_info.dynamics)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        sources, mu, sigma = entry
+        if not all(a is b for a, b in zip(sources, self._sources(traj_distr, traj_info))):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return mu, sigma
+
+    def put(self, traj_distr, traj_info, mu, sigma):
+        """Memoizes the marginals of a policy under the dynamics of a trajectory info."""
+        key = id(traj_distr), id(traj_info.dynamics)
+        self._entries[key] = self._sources(traj_distr, traj_info), mu, sigma
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def forward(self, traj_distrs, traj_infos):
+        """Returns the marginals of several policies, computing the missing ones in one batched forward pass.
+
+        Args:
+            traj_distrs: List of linear Gaussian policy objects.
+            traj_infos: List of TrajectoryInfo objects, one per policy.
+
+        Returns:
+            mu: B x T x (dX + dU) mean state + action vectors.
+            sigma: B x T x (dX + dU) x (dX + dU) state + action covariance matrices.
+
+        """
+        marginals = [self.get(traj_distr, traj_info) for traj_distr, traj_info in zip(traj_distrs, traj_infos)]
+        missing = [i for i, marginal in enumerate(marginals) if marginal is None]
+        LOGGER.debug('Memoized marginals: %d / %d', len(marginals) - len(missing), len(marginals))
+        if missing:
+            mu, sigma = forward_marginals([traj_distrs[i] for i in missing], [traj_infos[i] for i in missing])
+            for j, i in enumerate(missing):
+                marginals[i] = mu[j], sigma[j]
+                self.put(traj_distrs[i], traj_infos[i], mu[j], sigma[j])
+        return np.stack([mu for mu, _ in marginals]), np.stack([sigma for _, sigma in marginals])
+
+    def __getstate__(self):
+        """Pickle the memo without its entries."""
+        return {'size': self.size, '_entries': OrderedDict()}
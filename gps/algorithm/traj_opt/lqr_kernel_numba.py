@@ -0,0 +1,106 @@
+"""This file defines the numba backend of the LQR kernels.
+
+It is imported lazily by lqr_kernel, so that numba is only required if the backend is selected.
+"""
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True)
+def _cholesky(A, L):
+    """Writes the lower Cholesky factor of A into L. Returns False if A is not positive definite."""
+    n = A.shape[0]
+    L[:] = 0.0
+    for j in range(n):
+        s = A[j, j]
+        for p in range(j):
+            s -= L[j, p] * L[j, p]
+        if not s > 0.0:
+            return False
+        L[j, j] = np.sqrt(s)
+        for i in range(j + 1, n):
+            s = A[i, j]
+            for p in range(j):
+                s -= L[i, p] * L[j, p]
+            L[i, j] = s / L[j, j]
+    return True
+
+
+@njit(cache=True)
+def _lower_inverse(L, L_inv):
+    """Writes the inverse of the lower triangular matrix L into L_inv by forward substitution."""
+    n = L.shape[0]
+    L_inv[:] = 0.0
+    for c in range(n):
+        for i in range(c, n):
+            s = 1.0 if i == c else 0.0
+            for p in range(c, i):
+                s -= L[i, p] * L_inv[p, c]
+            L_inv[i, c] = s / L[i, i]
+
+
+@njit(cache=True, parallel=True)
+def lqr_backward_numba(Cm, cv, Fm, fv, K, k, pol_covar, chol_pol_covar, inv_pol_covar, fail, regularize, regularized):
+    """Batched Riccati recursion, writes the policies into the given output arrays.
+
+    See lqr_kernel.lqr_backward for the arguments. Batch entries are processed in parallel. The recursion of an entry
+    stops at the first non-PD Q-function, unless `regularize` > 0. The recursion runs in float64 regardless of the
+    precision of the inputs, which only affects the memory traffic of this backend.
+    """
+    B, T, dX = Fm.shape[:3]
+    dU = Fm.shape[3] - dX
+
+    for b in prange(B):
+        Vxx = np.zeros((dX, dX))
+        Vx = np.zeros(dX)
+        L = np.empty((dU, dU))
+        L_inv = np.empty((dU, dU))
+        chol = np.empty((dU, dU))
+
+        for t in range(T - 1, -1, -1):
+            # Add in the cost and the value function from the next time step.
+            Qtt = Cm[b, t].astype(np.float64)
+            Qt = cv[b, t].astype(np.float64)
+            if t < T - 1:
+                F = Fm[b, t].astype(np.float64)
+                Qtt += np.dot(F.T, np.dot(Vxx, F))
+                Qt += np.dot(F.T, Vx + np.dot(Vxx, fv[b, t].astype(np.float64)))
+
+            # Symmetrize quadratic component.
+            Qtt = 0.5 * (Qtt + Qtt.T)
+            Quu = Qtt[dX:, dX:].copy()
+            Qux = Qtt[dX:, :dX].copy()
+            Qxu = Qtt[:dX, dX:].copy()
+
+            # Compute Cholesky decomposition of Q function action component.
+            if not _cholesky(Quu, L):
+                if not regularize > 0.0 or not np.all(np.isfinite(Quu)):
+                    fail[b] = True
+                    break
+                eig = np.linalg.eigvalsh(Quu)
+                mu = max(regularize * np.max(np.abs(eig)), regularize) - eig[0]
+                for i in range(dU):
+                    Quu[i, i] += mu
+                if not _cholesky(Quu, L):
+                    fail[b] = True
+                    break
+                regularized[b] += 1
+
+            # Store conditional covariance, inverse, and Cholesky.
+            _lower_inverse(L, L_inv)
+            covar = np.dot(L_inv.T, L_inv)
+            _cholesky(covar, chol)
+            pol_covar[b, t] = covar
+            chol_pol_covar[b, t] = chol.T
+            inv_pol_covar[b, t] = Quu
+
+            # Compute mean terms.
+            K_t = -np.dot(covar, Qux)
+            k_t = -np.dot(covar, Qt[dX:].copy())
+            K[b, t] = K_t
+            k[b, t] = k_t
+
+            # Compute value function.
+            Vxx = Qtt[:dX, :dX] + np.dot(Qxu, K_t)
+            Vxx = 0.5 * (Vxx + Vxx.T)
+            Vx = Qt[:dX] + np.dot(Qxu, k_t)
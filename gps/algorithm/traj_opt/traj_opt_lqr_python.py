@@ -3,12 +3,12 @@ import logging
 import copy
 
 import numpy as np
-from numpy.linalg import LinAlgError
-import scipy as sp
 
+from gps.algorithm.policy.lin_gauss_policy import LinearGaussianPolicy
 from gps.algorithm.traj_opt.config import TRAJ_OPT_LQR
+from gps.algorithm.traj_opt.lqr_kernel import forward_marginals, lqr_backward, LQRWorkspace, MarginalCache
 from gps.algorithm.traj_opt.traj_opt import TrajOpt
-from gps.algorithm.traj_opt.traj_opt_utils import calc_traj_distr_kl, DGD_MAX_ITER
+from gps.algorithm.traj_opt.traj_opt_utils import calc_traj_distr_kl_batch, DGD_MAX_ITER, EtaSearch, laplace_cost
 
 from gps.algorithm.algorithm_mdgps import AlgorithmMDGPS
 
@@ -24,92 +24,196 @@ class TrajOptLQRPython(TrajOpt):
 
         TrajOpt.__init__(self, config)
 
+        if self._hyperparams['non_pd_recovery'] not in ('eta', 'regularize'):
+            raise ValueError('Unknown non-PD recovery %r' % self._hyperparams['non_pd_recovery'])
+        # Backward pass statistics of the last update, see backward_batch.
+        self.diagnostics = {'backward_passes': 0, 'restarts': 0, 'restarts_avoided': 0, 'regularized_steps': 0}
+
+        # Scratch buffers of the backward pass, shared by all conditions and DGD iterations.
+        self._workspace = LQRWorkspace()
+        # Marginals of the optimized policies, reused by the cost estimates of the step size adaptation.
+        self._marginals = MarginalCache(size=4 * self._hyperparams['num_conditions'])
+        # Extended costs of the accepted policy of each condition.
+        self.Cm_ext = {}
+        self.cv_ext = {}
+        # Extended costs of each entry of the last backward_batch, see backward_batch.
+        self._batch_ext_costs = []
+
     def update(self, m, algorithm, initial_update=False):
         """Run dual gradient decent to optimize trajectories."""
+        return self.update_batch([m], algorithm, initial_update)[0]
+
+    def update_batch(self, conditions, algorithm, initial_update=False):
+        """Run dual gradient decent to optimize the trajectories of several conditions.
+
+        The DGD iterations of all conditions run in lockstep, so that the backward passes of all conditions that have
+        not yet converged are computed together in one batched sweep. With `eta_candidates` > 1, each sweep evaluates
+        several etas per condition and narrows the bracket from all of them at once.
+
+        Args:
+            conditions: Conditions to optimize.
+            algorithm: Algorithm object needed to compute costs.
+            initial_update: Whether this is the initial update of MDGPS.
+
+        Returns:
+            A list of tuples (traj_distr, eta, new_mu, new_sigma) for each condition.
+
+        """
         T = algorithm.T
-        eta = algorithm.cur[m].eta
-        step_mult = algorithm.cur[m].step_mult
-        traj_info = algorithm.cur[m].traj_info
+        conditions = list(conditions)
+        C = len(conditions)
 
+        etas = [algorithm.cur[m].eta for m in conditions]
+        traj_infos = [algorithm.cur[m].traj_info for m in conditions]
         if isinstance(algorithm, AlgorithmMDGPS) and not initial_update:
             # For MDGPS, constrain to previous NN linearization
-            prev_traj_distr = algorithm.cur[m].pol_info.traj_distr()
+            prev_traj_distrs = [algorithm.cur[m].pol_info.traj_distr() for m in conditions]
         else:
             # For BADMM/trajopt, constrain to previous LG controller
-            prev_traj_distr = algorithm.cur[m].traj_distr
+            prev_traj_distrs = [algorithm.cur[m].traj_distr for m in conditions]
 
         # Set KL-divergence step size (epsilon).
-        kl_step = T * algorithm.base_kl_step * step_mult
+        kl_steps = [T * algorithm.base_kl_step * algorithm.cur[m].step_mult for m in conditions]
+
+        # We assume at min_eta, kl_div > kl_step, opposite for max_eta. The search state persists across iterations.
+        searches = []
+        for m, kl_step in zip(conditions, kl_steps):
+            if algorithm.cur[m].eta_search is None:
+                algorithm.cur[m].eta_search = EtaSearch(
+                    self._hyperparams['min_eta'], self._hyperparams['max_eta'], self._hyperparams['eta_search'],
+                    self._hyperparams['eta_bracket_factor']
+                )
+            algorithm.cur[m].eta_search.reset(kl_step, algorithm.cur[m].eta)
+            searches.append(algorithm.cur[m].eta_search)
 
-        # We assume at min_eta, kl_div > kl_step, opposite for max_eta.
-        min_eta = self._hyperparams['min_eta']
-        max_eta = self._hyperparams['max_eta']
+        # In speculative mode, several etas around the current guess are evaluated per condition in each sweep.
+        num_candidates = self._hyperparams['eta_candidates']
 
-        LOGGER.debug("Running DGD for trajectory %d, eta: %f", m, eta)
-        mus = []
-        for itr in range(DGD_MAX_ITER):
-            LOGGER.debug("Iteration %i, bracket: (%.2e , %.2e , %.2e)", itr, min_eta, eta, max_eta)
+        for key in self.diagnostics:
+            self.diagnostics[key] = 0
 
-            # Run fwd/bwd pass, note that eta may be updated.
+        results = [None] * C
+        kl_divs = [None] * C
+        mus = [[] for _ in range(C)]
+        active = list(range(C))
+        for m, eta in zip(conditions, etas):
+            LOGGER.debug("Running DGD for trajectory %d, eta: %f", m, eta)
+        for itr in range(DGD_MAX_ITER):
+            # Stack the candidates of all active conditions into one batch.
+            batch, batch_etas = [], []
+            for i in active:
+                candidates = searches[i].candidates(etas[i], num_candidates) if num_candidates > 1 else [etas[i]]
+                batch += [i] * len(candidates)
+                batch_etas += list(candidates)
+
+            # Run fwd/bwd pass for the whole batch, note that eta may be updated.
             # NOTE: we can just ignore case when the new eta is larger.
-            traj_distr, eta = self.backward(prev_traj_distr, traj_info, eta, algorithm, m)
-            new_mu, new_sigma = self.forward(traj_distr, traj_info)
-            mus.append(new_mu)
+            traj_distrs, new_etas = self.backward_batch(
+                [prev_traj_distrs[i] for i in batch],
+                [traj_infos[i] for i in batch],
+                batch_etas,
+                algorithm,
+                [conditions[i] for i in batch],
+            )
 
-            # Compute KL divergence constraint violation.
-            kl_div = calc_traj_distr_kl(new_mu, new_sigma, traj_distr, prev_traj_distr)
-            con = kl_div - kl_step
+            new_mus, new_sigmas = self.forward_batch(traj_distrs, [traj_infos[i] for i in batch])
 
-            # Convergence check - constraint satisfaction.
-            if (abs(con) < 0.1 * kl_step):
-                LOGGER.debug("KL: %f / %f, converged iteration %i", kl_div, kl_step, itr)
-                break
+            # Compute KL divergence constraint violations.
+            new_kl_divs = calc_traj_distr_kl_batch(
+                new_mus, new_sigmas, traj_distrs, [prev_traj_distrs[i] for i in batch]
+            )
 
-            # Choose new eta (bisect bracket or multiply by constant)
-            if con < 0:  # Eta was too big.
-                max_eta = eta
-                geom = np.sqrt(min_eta * max_eta)  # Geometric mean.
-                new_eta = max(geom, 0.1 * max_eta)
-                LOGGER.debug("KL: %f / %f, eta too big, new eta: %f", kl_div, kl_step, new_eta)
-            else:  # Eta was too small.
-                min_eta = eta
-                geom = np.sqrt(min_eta * max_eta)  # Geometric mean.
-                new_eta = min(geom, 10.0 * min_eta)
-                LOGGER.debug("KL: %f / %f, eta too small, new eta: %f", kl_div, kl_step, new_eta)
+            converged = []
+            for i in active:
+                m, kl_step = conditions[i], kl_steps[i]
+                js = [j for j, b in enumerate(batch) if b == i]
+
+                # Keep the candidate closest to the constraint.
+                j = min(js, key=lambda j: abs(new_kl_divs[j] - kl_step))
+                eta, kl_div = new_etas[j], new_kl_divs[j]
+                LOGGER.debug(
+                    "Condition %d, iteration %i, bracket: (%.2e , %.2e , %.2e)", m, itr, searches[i].min_eta, eta,
+                    searches[i].max_eta
+                )
 
-            # Logarithmic mean: log_mean(x,y) = (y - x)/(log(y) - log(x))
-            eta = new_eta
+                mus[i].append(new_mus[j])
+                results[i] = (traj_distrs[j], eta, new_mus[j], new_sigmas[j])
+                self.Cm_ext[m], self.cv_ext[m] = self._batch_ext_costs[j]
+
+                kl_divs[i] = kl_div
+                con = kl_div - kl_step
+
+                # Convergence check - constraint satisfaction.
+                if (abs(con) < 0.1 * kl_step):
+                    LOGGER.debug("KL: %f / %f, converged iteration %i", kl_div, kl_step, itr)
+                    converged.append(i)
+                    continue
+
+                # Choose new eta.
+                if len(js) > 1:
+                    etas[i] = searches[i].update_batch([new_etas[j] for j in js], [new_kl_divs[j] for j in js])
+                else:
+                    etas[i] = searches[i].update(eta, kl_div)
+                LOGGER.debug(
+                    "KL: %f / %f, eta too %s, new eta: %f", kl_div, kl_step, 'big' if con < 0 else 'small', etas[i]
+                )
 
-        if kl_div > kl_step and abs(kl_div - kl_step) > 0.1 * kl_step:
-            LOGGER.warning("Final KL divergence after DGD convergence is too high.")
+            active = [i for i in active if i not in converged]
+            if not active:
+                break
 
-        from gps.visualization.traj_opt import visualize_traj_opt
-        visualize_traj_opt(
-            file_name=self._data_files_dir + 'traj_opt_m%d-%02d' % (m, self.iteration_count),
-            mu=np.asarray(mus),
-            dX=traj_distr.dX,
-            dU=traj_distr.dU
+        LOGGER.debug(
+            'Backward passes: %d, restarts: %d, restarts avoided: %d (%d regularized time steps)',
+            self.diagnostics['backward_passes'], self.diagnostics['restarts'], self.diagnostics['restarts_avoided'],
+            self.diagnostics['regularized_steps']
         )
 
-        return traj_distr, eta, new_mu, new_sigma
+        from gps.visualization.traj_opt import visualize_traj_opt
+        for i, m in enumerate(conditions):
+            kl_div, kl_step = kl_divs[i], kl_steps[i]
+            if kl_div > kl_step and abs(kl_div - kl_step) > 0.1 * kl_step:
+                LOGGER.warning("Final KL divergence after DGD convergence is too high.")
+
+            traj_distr, _, new_mu, new_sigma = results[i]
+            self._marginals.put(traj_distr, traj_infos[i], new_mu, new_sigma)
+            visualize_traj_opt(
+                file_name=self._data_files_dir + 'traj_opt_m%d-%02d' % (m, self.iteration_count),
+                mu=np.asarray(mus[i]),
+                dX=traj_distr.dX,
+                dU=traj_distr.dU
+            )
+
+        return results
 
     def estimate_cost(self, traj_distr, traj_info):
         """Compute Laplace approximation to expected cost."""
-        # Constants.
-        T = traj_distr.T
+        return self.estimate_cost_batch([traj_distr], [traj_info])[0]
+
+    def estimate_cost_batch(self, traj_distrs, traj_infos):
+        """Compute Laplace approximations to the expected costs of several policies.
+
+        Args:
+            traj_distrs: Linear Gaussian policy objects.
+            traj_infos: TrajectoryInfo objects, one per policy.
+
+        Returns:
+            predicted_cost: B x T expected costs.
 
+        """
         # Perform forward pass (note that we repeat this here, because
         # traj_info may have different dynamics from the ones that were
-        # used to compute the distribution already saved in traj).
-        mu, sigma = self.forward(traj_distr, traj_info)
+        # used to compute the distribution already saved in traj). Marginals
+        # of policies that were already propagated are memoized.
+        mu, sigma = self._marginals.forward(traj_distrs, traj_infos)
 
         # Compute cost.
-        predicted_cost = np.zeros(T)
-        for t in range(T):
-            predicted_cost[t] = traj_info.cc[t] + 0.5 * np.sum(
-                sigma[t, :, :] * traj_info.Cm[t, :, :]
-            ) + 0.5 * mu[t, :].T.dot(traj_info.Cm[t, :, :]).dot(mu[t, :]) + mu[t, :].T.dot(traj_info.cv[t, :])
-        return predicted_cost
+        return laplace_cost(
+            mu,
+            sigma,
+            np.stack([traj_info.cc for traj_info in traj_infos]),
+            np.stack([traj_info.cv for traj_info in traj_infos]),
+            np.stack([traj_info.Cm for traj_info in traj_infos]),
+        )
 
     def forward(self, traj_distr, traj_info):
         """Perform LQR forward pass.
@@ -125,49 +229,22 @@ class TrajOptLQRPython(TrajOpt):
             sigma: A T x dX x dX covariance matrix.
 
         """
-        # Compute state-action marginals from specified conditional
-        # parameters and current traj_info.
-        T = traj_distr.T
-        dU = traj_distr.dU
-        dX = traj_distr.dX
-
-        # Constants.
-        idx_x = slice(dX)
-
-        # Allocate space.
-        sigma = np.zeros((T, dX + dU, dX + dU))
-        mu = np.zeros((T, dX + dU))
-
-        # Pull out dynamics.
-        Fm = traj_info.dynamics.Fm
-        fv = traj_info.dynamics.fv
-        dyn_covar = traj_info.dynamics.dyn_covar
-
-        # Set initial covariance (initial mu is always zero).
-        sigma[0, idx_x, idx_x] = traj_info.x0sigma
-        mu[0, idx_x] = traj_info.x0mu
-
-        for t in range(T):
-            sigma[t, :, :] = np.vstack(
-                [
-                    np.hstack([sigma[t, idx_x, idx_x], sigma[t, idx_x, idx_x].dot(traj_distr.K[t, :, :].T)]),
-                    np.hstack(
-                        [
-                            traj_distr.K[t, :, :].dot(sigma[t, idx_x, idx_x]),
-                            traj_distr.K[t, :, :].dot(sigma[t, idx_x, idx_x]).dot(traj_distr.K[t, :, :].T) +
-                            traj_distr.pol_covar[t, :, :]
-                        ]
-                    )
-                ]
-            )
-            mu[t, :] = np.hstack([mu[t, idx_x], traj_distr.K[t, :, :].dot(mu[t, idx_x]) + traj_distr.k[t, :]])
-            if t < T - 1:
-                sigma[t + 1, idx_x, idx_x] = Fm[t, :, :].dot(sigma[t, :, :]).dot(Fm[t, :, :].T) + dyn_covar[t, :, :]
-                mu[t + 1, idx_x] = Fm[t, :, :].dot(mu[t, :]) + fv[t, :]
+        mu, sigma = self.forward_batch([traj_distr], [traj_info])
+        return mu[0], sigma[0]
+
+    def forward_batch(self, traj_distrs, traj_infos):
+        """Perform LQR forward pass for several policies at once.
+
+        Args:
+            traj_distrs: Linear Gaussian policy objects.
+            traj_infos: TrajectoryInfo objects, one per policy.
 
-            # Symmetrize sigma
-            sigma[t] = (sigma[t] + sigma[t].T) / 2
-        return mu, sigma
+        Returns:
+            mu: B x T x (dX + dU) mean state + action vectors.
+            sigma: B x T x (dX + dU) x (dX + dU) state + action covariance matrices.
+
+        """
+        return forward_marginals(traj_distrs, traj_infos)
 
     def backward(self, prev_traj_distr, traj_info, eta, algorithm, m):
         """Perform LQR backward pass.
@@ -186,93 +263,112 @@ class TrajOptLQRPython(TrajOpt):
             new_eta: The updated dual variable. Updates happen if the Q-function is not PD.
 
         """
-        # Constants.
-        T = prev_traj_distr.T
-        dU = prev_traj_distr.dU
-        dX = prev_traj_distr.dX
+        traj_distrs, etas = self.backward_batch([prev_traj_distr], [traj_info], [eta], algorithm, [m])
+        self.Cm_ext[m], self.cv_ext[m] = self._batch_ext_costs[0]
+        return traj_distrs[0], etas[0]
 
-        traj_distr = prev_traj_distr.nans_like()
+    def backward_batch(self, prev_traj_distrs, traj_infos, etas, algorithm, conditions):
+        """Perform LQR backward pass for several conditions at once.
 
-        idx_x = slice(dX)
-        idx_u = slice(dX, dX + dU)
+        The conditions are stacked along a leading batch axis and processed in one sweep over the time horizon. On a
+        non-PD Q-function, eta is increased only for the failed conditions, which are then recomputed.
 
-        # Pull out dynamics.
-        Fm = traj_info.dynamics.Fm
-        fv = traj_info.dynamics.fv
+        With `time_window` > 1, the policies are shared by windows of consecutive time steps. Each window uses the
+        dynamics at its first time step and the mean cost of its time steps.
 
-        # Non-SPD correction terms.
-        del_ = self._hyperparams['del0']
-        eta0 = eta
+        With `non_pd_recovery` set to 'regularize', a non-PD Quu is regularized in place, so the backward pass only
+        restarts with increased eta if the regularization fails (e.g. on NaNs). The number of backward passes, restarts
+        and avoided restarts are accumulated in `diagnostics`.
 
-        # Run dynamic programming.
-        fail = True
-        while fail:
-            fail = False  # Flip to true on non-symmetric PD.
-
-            # Allocate.
-            Vxx = np.zeros((T, dX, dX))
-            Vx = np.zeros((T, dX))
-
-            fCm, fcv = algorithm.compute_costs(m, eta)
-            self.Cm_ext = fCm
-            self.cv_ext = fcv
-
-            # Compute state-action-state function at each time step.
-            for t in range(T - 1, -1, -1):
-                # Add in the cost.
-                Qtt = fCm[t, :, :]  # (X+U) x (X+U)
-                Qt = fcv[t, :]  # (X+U) x 1
-
-                # Add in the value function from the next time step.
-                if t < T - 1:
-                    Qtt = Qtt + Fm[t, :, :].T.dot(Vxx[t + 1, :, :]).dot(Fm[t, :, :])
-                    Qt = Qt + Fm[t, :, :].T.dot(Vx[t + 1, :] + Vxx[t + 1, :, :].dot(fv[t, :]))
-
-                # Symmetrize quadratic component.
-                Qtt = 0.5 * (Qtt + Qtt.T)
-
-                # Compute Cholesky decomposition of Q function action
-                # component.
-                try:
-                    U = sp.linalg.cholesky(Qtt[idx_u, idx_u])
-                    L = U.T
-                except LinAlgError as e:
-                    # Error thrown when Qtt[idx_u, idx_u] is not
-                    # symmetric positive definite.
-                    LOGGER.debug('LinAlgError: %s', e)
-                    fail = True
-                    break
-
-                # Store conditional covariance, inverse, and Cholesky.
-                traj_distr.inv_pol_covar[t, :, :] = Qtt[idx_u, idx_u]
-                traj_distr.pol_covar[t, :, :] = sp.linalg.solve_triangular(
-                    U, sp.linalg.solve_triangular(L, np.eye(dU), lower=True)
-                )
-                traj_distr.chol_pol_covar[t, :, :] = sp.linalg.cholesky(traj_distr.pol_covar[t, :, :])
+        The extended costs (Cm_ext, cv_ext) of each entry are kept in `_batch_ext_costs`, as a condition can occur
+        several times in a batch. The callers publish those of the accepted policies in `Cm_ext` and `cv_ext`.
 
-                # Compute mean terms.
-                traj_distr.k[t] = -sp.linalg.solve_triangular(U, sp.linalg.solve_triangular(L, Qt[idx_u], lower=True))
-                traj_distr.K[t, :, :] = -sp.linalg.solve_triangular(
-                    U, sp.linalg.solve_triangular(L, Qtt[idx_u, idx_x], lower=True)
-                )
+        Args:
+            prev_traj_distrs: Linear Gaussian policy objects from previous iteration, one per condition.
+            traj_infos: TrajectoryInfo objects, one per condition.
+            etas: Dual variables, one per condition.
+            algorithm: Algorithm object needed to compute costs.
+            conditions: Condition numbers.
+
+        Returns:
+            traj_distrs: New linear Gaussian policies.
+            new_etas: The updated dual variables. Updates happen if the Q-function is not PD.
 
-                # Compute value function.
-                Vxx[t, :, :] = Qtt[idx_x, idx_x] + Qtt[idx_x, idx_u].dot(traj_distr.K[t, :, :])
-                Vx[t, :] = Qt[idx_x] + Qtt[idx_x, idx_u].dot(traj_distr.k[t, :])
-                Vxx[t, :, :] = 0.5 * (Vxx[t, :, :] + Vxx[t, :, :].T)
-
-            # Increment eta on non-SPD Q-function.
-            if fail:
-                old_eta = eta
-                eta = eta0 + del_
-                LOGGER.debug('Increasing eta: %f -> %f', old_eta, eta)
-                del_ *= 2  # Increase del_ exponentially on failure.
-                if eta >= 1e16:
-                    if np.any(np.isnan(Fm)) or np.any(np.isnan(fv)):
+        """
+        C = len(conditions)
+        T = algorithm.T
+        W = self._hyperparams['time_window']
+        etas = list(etas)
+        traj_distrs = [None] * C
+        dtype = self._hyperparams['dtype']
+        regularize = None
+        if self._hyperparams['non_pd_recovery'] == 'regularize':
+            regularize = self._hyperparams['quu_regularization']
+
+        # Pull out dynamics, which may be fitted with a different time window.
+        if W == 1:
+            steps = None
+            dynamics = [traj_info.dynamics.per_step() for traj_info in traj_infos]
+            Fm = np.stack([Fm for Fm, _, _ in dynamics])
+            fv = np.stack([fv for _, fv, _ in dynamics])
+        else:
+            starts = np.arange(0, T, W)
+            steps = np.diff(np.append(starts, T))
+            Fm = np.stack([traj_info.dynamics.Fm[starts // traj_info.dynamics.window] for traj_info in traj_infos])
+            fv = np.stack([traj_info.dynamics.fv[starts // traj_info.dynamics.window] for traj_info in traj_infos])
+        Fm = Fm.astype(dtype, copy=False)
+        fv = fv.astype(dtype, copy=False)
+
+        # Non-SPD correction terms.
+        del_ = [self._hyperparams['del0']] * C
+        eta0 = list(etas)
+        ext_costs = [None] * C
+
+        # Run dynamic programming.
+        pending = list(range(C))
+        while pending:
+            costs = [algorithm.compute_costs(conditions[i], etas[i]) for i in pending]
+            fCm = np.stack([fCm for fCm, _ in costs]).astype(dtype, copy=False)
+            fcv = np.stack([fcv for _, fcv in costs]).astype(dtype, copy=False)
+            if steps is not None:
+                # Average the costs over each window.
+                fCm = np.add.reduceat(fCm, starts, axis=1) / steps[:, None, None]
+                fcv = np.add.reduceat(fcv, starts, axis=1) / steps[:, None]
+            for j, i in enumerate(pending):
+                ext_costs[i] = fCm[j], fcv[j]
+
+            regularized = np.zeros(len(pending), dtype=int)
+            K, k, pol_covar, chol_pol_covar, inv_pol_covar, fail = lqr_backward(
+                fCm, fcv, Fm[pending], fv[pending], self._workspace, self._hyperparams['lqr_backend'], steps,
+                regularize, regularized
+            )
+            self.diagnostics['backward_passes'] += len(pending)
+            self.diagnostics['restarts'] += int(np.count_nonzero(fail))
+            self.diagnostics['restarts_avoided'] += int(np.count_nonzero(regularized))
+            self.diagnostics['regularized_steps'] += int(np.sum(regularized))
+
+            failed = []
+            for j, i in enumerate(pending):
+                if not fail[j]:
+                    traj_distrs[i] = LinearGaussianPolicy(
+                        K[j], k[j], pol_covar[j], chol_pol_covar[j], inv_pol_covar[j], W, T
+                    )
+                    continue
+
+                # Increment eta on non-SPD Q-function.
+                failed.append(i)
+                old_eta = etas[i]
+                etas[i] = eta0[i] + del_[i]
+                LOGGER.debug('Increasing eta: %f -> %f', old_eta, etas[i])
+                del_[i] *= 2  # Increase del_ exponentially on failure.
+                if etas[i] >= 1e16:
+                    if np.any(np.isnan(Fm[i])) or np.any(np.isnan(fv[i])):
                         raise ValueError('NaNs encountered in dynamics!')
                     raise ValueError(
                         'Failed to find PD solution even for very \
                             large eta (check that dynamics and cost are \
                             reasonably well conditioned)!'
                     )
-        return traj_distr, eta
+            pending = failed
+        self._batch_ext_costs = ext_costs
+        return traj_distrs, etas
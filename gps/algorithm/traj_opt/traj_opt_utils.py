@@ -2,7 +2,6 @@
 import logging
 
 import numpy as np
-import scipy as sp
 
 LOGGER = logging.getLogger(__name__)
 
@@ -23,48 +22,284 @@ def calc_traj_distr_kl(new_mu, new_sigma, new_traj_distr, prev_traj_distr):
         kl_div: The KL divergence between the new and previous trajectories.
 
     """
-    # Constants.
-    T = new_mu.shape[0]
-    dU = new_traj_distr.dU
-
-    # Initialize vector of divergences for each time step.
-    kl_div = np.zeros(T)
-
-    # Step through trajectory.
-    for t in range(T):
-        # Fetch matrices and vectors from trajectory distributions.
-        mu_t = new_mu[t, :]
-        sigma_t = new_sigma[t, :, :]
-        K_prev = prev_traj_distr.K[t, :, :]
-        K_new = new_traj_distr.K[t, :, :]
-        k_prev = prev_traj_distr.k[t, :]
-        k_new = new_traj_distr.k[t, :]
-        chol_prev = prev_traj_distr.chol_pol_covar[t, :, :]
-        chol_new = new_traj_distr.chol_pol_covar[t, :, :]
-
-        # Compute log determinants and precision matrices.
-        logdet_prev = 2 * sum(np.log(np.diag(chol_prev)))
-        logdet_new = 2 * sum(np.log(np.diag(chol_new)))
-        prc_prev = sp.linalg.solve_triangular(
-            chol_prev, sp.linalg.solve_triangular(chol_prev.T, np.eye(dU), lower=True)
-        )
-        prc_new = sp.linalg.solve_triangular(chol_new, sp.linalg.solve_triangular(chol_new.T, np.eye(dU), lower=True))
-
-        # Construct matrix, vector, and constants.
-        M_prev = np.r_[np.c_[K_prev.T.dot(prc_prev).dot(K_prev), -K_prev.T.dot(prc_prev)], np.c_[-prc_prev.dot(K_prev),
-                                                                                                 prc_prev]]
-        M_new = np.r_[np.c_[K_new.T.dot(prc_new).dot(K_new), -K_new.T.dot(prc_new)], np.c_[-prc_new.dot(K_new), prc_new]
-                     ]
-        v_prev = np.r_[K_prev.T.dot(prc_prev).dot(k_prev), -prc_prev.dot(k_prev)]
-        v_new = np.r_[K_new.T.dot(prc_new).dot(k_new), -prc_new.dot(k_new)]
-        c_prev = 0.5 * k_prev.T.dot(prc_prev).dot(k_prev)
-        c_new = 0.5 * k_new.T.dot(prc_new).dot(k_new)
-
-        # Compute KL divergence at timestep t.
-        kl_div[t] = max(
-            0, -0.5 * mu_t.T.dot(M_new - M_prev).dot(mu_t) - mu_t.T.dot(v_new - v_prev) - c_new + c_prev -
-            0.5 * np.sum(sigma_t * (M_new - M_prev)) - 0.5 * logdet_new + 0.5 * logdet_prev
-        )
+    return calc_traj_distr_kl_batch(new_mu[None], new_sigma[None], [new_traj_distr], [prev_traj_distr])[0]
+
+
+def calc_traj_distr_kl_batch(new_mu, new_sigma, new_traj_distrs, prev_traj_distrs):
+    """Compute KL divergences between several pairs of new and previous trajectory distributions.
+
+    Args:
+        new_mu: B x T x dX, means of new trajectory distributions.
+        new_sigma: B x T x dX x dX, variances of new trajectory distributions.
+        new_traj_distrs: B linear Gaussian policy objects, new distributions.
+        prev_traj_distrs: B linear Gaussian policy objects, previous distributions.
+
+    Returns:
+        kl_div: B vector of KL divergences between the new and previous trajectories.
+
+    """
+    def stack(traj_distrs):
+        """Stacks the policy parameters needed for the KL divergence."""
+        traj_distrs = [traj_distr.per_step() for traj_distr in traj_distrs]
+        return [
+            np.stack([getattr(traj_distr, attr) for traj_distr in traj_distrs])
+            for attr in ('K', 'k', 'inv_pol_covar', 'chol_pol_covar')
+        ]
+
+    kl_div = traj_distr_kl(new_mu, new_sigma, *stack(new_traj_distrs), *stack(prev_traj_distrs))
 
     # Add up divergences across time to get total divergence.
-    return np.sum(kl_div)
+    return np.sum(kl_div, axis=-1)
+
+
+def traj_distr_kl(mu, sigma, K_new, k_new, prc_new, chol_new, K_prev, k_prev, prc_prev, chol_prev):
+    """Compute per time step KL divergences between new and previous linear Gaussian policies.
+
+    All arguments may have arbitrary leading batch dimensions in front of the time dimension. The precision matrices
+    are taken as given, the Cholesky factors of the policy covariances are only used for the log determinants.
+
+    Args:
+        mu: ... x T x (dX + dU), mean of new trajectory distribution.
+        sigma: ... x T x (dX + dU) x (dX + dU), variance of new trajectory distribution.
+        K_new, K_prev: ... x T x dU x dX feedback gains.
+        k_new, k_prev: ... x T x dU feedforward terms.
+        prc_new, prc_prev: ... x T x dU x dU policy precisions.
+        chol_new, chol_prev: ... x T x dU x dU Cholesky factors of the policy covariances.
+
+    Returns:
+        kl_div: ... x T KL divergences at each time step.
+
+    """
+    dU, dX = K_new.shape[-2:]
+    mu_x, mu_u = mu[..., :dX], mu[..., dX:dX + dU]
+
+    # Compute log determinants.
+    logdet_new = 2 * np.sum(np.log(np.diagonal(chol_new, axis1=-2, axis2=-1)), axis=-1)
+    logdet_prev = 2 * np.sum(np.log(np.diagonal(chol_prev, axis1=-2, axis2=-1)), axis=-1)
+
+    def expected_log_prob(K, k, prc):
+        """Computes -0.5 E[(u - Kx - k)' prc (u - Kx - k)] under the new trajectory distribution."""
+        # Residual of the mean action.
+        res = mu_u - np.einsum('...ij,...j->...i', K, mu_x) - k
+        # Covariance of u - Kx, i.e. [-K, I] sigma [-K, I]'.
+        G = np.concatenate([-K, np.broadcast_to(np.eye(dU), K.shape[:-2] + (dU, dU))], axis=-1)
+        res_sigma = G @ sigma @ np.swapaxes(G, -1, -2)
+        return -0.5 * (np.einsum('...i,...ij,...j->...', res, prc, res) + np.sum(prc * res_sigma, axis=(-2, -1)))
+
+    kl_div = (
+        expected_log_prob(K_new, k_new, prc_new) - expected_log_prob(K_prev, k_prev, prc_prev) - 0.5 * logdet_new +
+        0.5 * logdet_prev
+    )
+    return np.maximum(kl_div, 0)
+
+
+def laplace_cost(mu, sigma, cc, cv, Cm):
+    """Compute the Laplace approximation to the expected cost at each time step.
+
+    All arguments may have arbitrary leading batch dimensions in front of the time dimension.
+
+    Args:
+        mu: ... x T x (dX + dU), mean of the trajectory distribution.
+        sigma: ... x T x (dX + dU) x (dX + dU), variance of the trajectory distribution.
+        cc: ... x T cost estimate constant terms.
+        cv: ... x T x (dX + dU) cost estimate vector terms.
+        Cm: ... x T x (dX + dU) x (dX + dU) cost estimate matrix terms.
+
+    Returns:
+        predicted_cost: ... x T expected costs.
+
+    """
+    return (
+        cc + 0.5 * np.sum(sigma * Cm, axis=(-2, -1)) + 0.5 * np.einsum('...i,...ij,...j->...', mu, Cm, mu) +
+        np.einsum('...i,...i->...', mu, cv)
+    )
+
+
+class EtaSearch:
+    """Root finding for the dual variable eta of the KL-constrained trajectory optimization.
+
+    The search keeps a bracket [min_eta, max_eta] with kl_div(min_eta) > kl_step > kl_div(max_eta) as well as the
+    history of evaluated (eta, kl_div) pairs. It is meant to persist across iterations for each condition, so that the
+    history of the previous iteration can warm-start the next search.
+
+    With a bracket factor, each search starts from a bracket within that factor of the previous eta instead of the
+    global bounds. Such seeded bounds are unverified, so a seeded bound is released to the global bound once the bracket
+    narrows towards it without crossing the root.
+
+    Methods:
+        bisection: Geometric bisection of the bracket, clamped to steps of a factor 10.
+        secant: Safeguarded secant steps on log(kl_div) over log(eta). The first step of a search is a Newton step
+            using the slope of the previous iteration's history. Steps are clamped to a factor 10 and to the bracket,
+            and fall back to bisection if the secant stalls on one side of the root.
+
+    """
+
+    def __init__(self, min_eta, max_eta, method='bisection', bracket_factor=None):
+        """Initializes the search.
+
+        Args:
+            min_eta: Global lower bound for eta.
+            max_eta: Global upper bound for eta.
+            method: `bisection` or `secant`.
+            bracket_factor: Factor around the previous eta of the initial bracket, None for the global bounds.
+
+        """
+        if method not in ('bisection', 'secant'):
+            raise ValueError('Unknown eta search method %r' % method)
+        if bracket_factor is not None and bracket_factor <= 1:
+            raise ValueError('Eta bracket factor must be greater than 1, got %r' % bracket_factor)
+        self.method = method
+        self.bracket_factor = bracket_factor
+        self._global_bracket = (min_eta, max_eta)
+        self.min_eta, self.max_eta = min_eta, max_eta
+        self._seeded = [False, False]  # Whether the lower and upper bound are seeded rather than evaluated.
+        self.kl_step = None
+        self.history = []  # List of (log eta, log kl_div / kl_step) of the current search.
+        self.prev_history = []  # History of the previous search.
+        self._last_secant = False
+
+    def reset(self, kl_step, eta=None):
+        """Starts a new search for the given KL step, keeping the previous history for warm-starting.
+
+        Args:
+            kl_step: KL divergence constraint.
+            eta: Previous dual variable to seed the bracket around, see bracket_factor.
+
+        """
+        if self.history:
+            self.prev_history = self.history
+        self.history = []
+        self.min_eta, self.max_eta = self._global_bracket
+        if eta is not None and self.bracket_factor is not None:
+            self.min_eta = max(self.min_eta, min(eta, self.max_eta) / self.bracket_factor)
+            self.max_eta = min(self.max_eta, max(eta, self.min_eta) * self.bracket_factor)
+        self._seeded = [self.min_eta > self._global_bracket[0], self.max_eta < self._global_bracket[1]]
+        self.kl_step = kl_step
+        self._last_secant = False
+
+    def candidates(self, eta, num):
+        """Spreads candidates for a speculative batched evaluation around eta.
+
+        Args:
+            eta: Proposed dual variable, always contained in the candidates.
+            num: Number of candidates.
+
+        Returns:
+            etas: Candidates spaced geometrically within the bracket and a factor 10 of eta.
+
+        """
+        s = np.log(eta)
+        s_min = max(np.log(self.min_eta), s - np.log(10.0))
+        s_max = min(np.log(self.max_eta), s + np.log(10.0))
+        etas = np.exp(np.linspace(s_min, s_max, num + 2)[1:-1])
+        etas[np.argmin(np.abs(np.log(etas) - s))] = eta
+        return etas
+
+    def update(self, eta, kl_div):
+        """Records the KL divergence obtained for eta, narrows the bracket and proposes the next eta.
+
+        Args:
+            eta: Evaluated dual variable.
+            kl_div: KL divergence obtained with eta.
+
+        Returns:
+            new_eta: The next dual variable to evaluate.
+
+        """
+        con = kl_div - self.kl_step
+        if con < 0:  # Eta was too big.
+            self.max_eta = eta
+            self._seeded[1] = False
+        else:  # Eta was too small.
+            self.min_eta = eta
+            self._seeded[0] = False
+        self._widen()
+
+        s, g = self._record(eta, kl_div)
+        same_side = len(self.history) > 1 and np.sign(self.history[-2][1]) == np.sign(g)
+
+        # Bisect bracket or multiply by constant.
+        if con < 0:
+            bisection_eta = max(np.sqrt(self.min_eta * self.max_eta), 0.1 * self.max_eta)
+        else:
+            bisection_eta = min(np.sqrt(self.min_eta * self.max_eta), 10.0 * self.min_eta)
+
+        if self.method == 'bisection':
+            return bisection_eta
+
+        # Fall back to bisection if the last secant step did not cross the root.
+        slope = self._slope()
+        if (self._last_secant and same_side) or slope is None or slope >= 0:
+            self._last_secant = False
+            return bisection_eta
+
+        # Secant step in log space, clamped to a factor 10 and to the interior of the bracket.
+        s_new = np.clip(s - g / slope, s - np.log(10.0), s + np.log(10.0))
+        if not np.log(self.min_eta) < s_new < np.log(self.max_eta):
+            self._last_secant = False
+            return bisection_eta
+        self._last_secant = True
+        return np.exp(s_new)
+
+    def update_batch(self, etas, kl_divs):
+        """Records several candidates evaluated in one sweep, narrows the bracket and proposes the next eta.
+
+        Args:
+            etas: Evaluated dual variables.
+            kl_divs: KL divergences obtained with etas.
+
+        Returns:
+            new_eta: The next dual variable to evaluate.
+
+        """
+        for eta, kl_div in zip(etas, kl_divs):
+            if kl_div < self.kl_step:  # Eta was too big.
+                self.max_eta = min(self.max_eta, eta)
+                self._seeded[1] = False
+            else:  # Eta was too small.
+                self.min_eta = max(self.min_eta, eta)
+                self._seeded[0] = False
+            self._record(eta, kl_div)
+        self._widen()
+
+        # Interpolate between the closest evaluated points on either side of the root.
+        below = [(s, g) for s, g in self.history if g >= 0]
+        above = [(s, g) for s, g in self.history if g < 0]
+        if below and above:
+            (s0, g0), (s1, g1) = max(below), min(above)
+            if self.method == 'secant' and s0 < s1:
+                return np.exp(s0 - g0 * (s1 - s0) / (g1 - g0))
+            return np.sqrt(self.min_eta * self.max_eta)
+
+        # Multiply by constant if the root is not yet bracketed.
+        if above:
+            return max(np.sqrt(self.min_eta * self.max_eta), 0.1 * self.max_eta)
+        return min(np.sqrt(self.min_eta * self.max_eta), 10.0 * self.min_eta)
+
+    def _widen(self):
+        """Releases a seeded bound once the bracket has narrowed towards it, as the root may lie beyond it."""
+        if self._seeded[0] and self.max_eta <= self.min_eta * np.sqrt(self.bracket_factor):
+            self.min_eta = self._global_bracket[0]
+            self._seeded[0] = False
+        if self._seeded[1] and self.max_eta <= self.min_eta * np.sqrt(self.bracket_factor):
+            self.max_eta = self._global_bracket[1]
+            self._seeded[1] = False
+
+    def _record(self, eta, kl_div):
+        """Appends an evaluated point to the history."""
+        point = np.log(eta), np.log(max(kl_div, 1e-300)) - np.log(self.kl_step)
+        self.history.append(point)
+        return point
+
+    def _slope(self):
+        """Estimates d log(kl_div) / d log(eta) from the current or, failing that, the previous history."""
+        if len(self.history) >= 2:
+            (s0, g0), (s1, g1) = self.history[-2:]
+            if s0 != s1:
+                return (g1 - g0) / (s1 - s0)
+        if len(self.prev_history) >= 2:
+            # Fit the points closest to the previous solution.
+            s, g = np.asarray(self.prev_history[-3:]).T
+            if np.ptp(s) > 0:
+                return np.polyfit(s, g, 1)[0]
+        return None
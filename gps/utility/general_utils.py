@@ -1,4 +1,5 @@
 """This file defines general utility functions and classes."""
+import numpy as np
 
 
 class BundleType:
@@ -46,3 +47,77 @@ def extract_condition(hyperparams, m):
 
     """
     return {var: val[m] if isinstance(val, list) else val for var, val in hyperparams.items()}
+
+
+class RingBuffer:
+    """A fixed-capacity buffer of items that overwrites the oldest items once it is full.
+
+    The items are stored in one preallocated array, so appending costs O(new items) and the stored items are available
+    as a view. Once the buffer has wrapped around, the view is not in insertion order.
+    """
+
+    def __init__(self, capacity, item_shape, dtype='float64'):
+        """Initializes the buffer.
+
+        Args:
+            capacity: Maximum number of items.
+            item_shape: Shape of each item.
+            dtype: Data type of the items.
+
+        """
+        if capacity < 1:
+            raise ValueError('Ring buffer capacity must be positive, got %d' % capacity)
+        self._data = np.empty((capacity, ) + tuple(item_shape), dtype=dtype)
+        self._size = 0
+        self._next = 0
+
+    def __len__(self):
+        """Returns the number of stored items."""
+        return self._size
+
+    @property
+    def capacity(self):
+        """Maximum number of items."""
+        return self._data.shape[0]
+
+    @property
+    def start(self):
+        """Index of the oldest item in data."""
+        return self._next if self._size == self.capacity else 0
+
+    @property
+    def data(self):
+        """A view of the stored items."""
+        return self._data[:self._size]
+
+    def append(self, items):
+        """Appends items, overwriting the oldest items if the capacity is exceeded.
+
+        Args:
+            items: An array of items, with the item shape of the buffer.
+
+        Returns:
+            The number of previously stored items that were evicted. Items beyond the capacity in one append are
+            dropped without being stored and are not counted.
+
+        """
+        capacity = self.capacity
+        num_items = items.shape[0]
+        # Only the last capacity items survive.
+        items = items[max(0, num_items - capacity):]
+        num_written = items.shape[0]
+
+        # Write in at most two contiguous slices.
+        head = min(num_written, capacity - self._next)
+        self._data[self._next:self._next + head] = items[:head]
+        self._data[:num_written - head] = items[head:]
+        self._next = (self._next + num_written) % capacity
+
+        num_evicted = min(self._size, max(0, self._size + num_items - capacity))
+        self._size = min(capacity, self._size + num_items)
+        return num_evicted
+
+    def clear(self):
+        """Removes all items."""
+        self._size = 0
+        self._next = 0
@@ -1,11 +1,18 @@
 """This file defines a Gaussian mixture model class."""
+from collections import deque
 import logging
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import scipy.linalg
 
 LOGGER = logging.getLogger(__name__)
 
+# Number of directions beyond the rank in the subspace iteration of the low-rank M-step, see GMM._fit_lowrank.
+LOWRANK_OVERSAMPLING = 5
+# Number of subspace iterations per low-rank M-step, which are warm-started from the previous subspace.
+LOWRANK_ITERATIONS = 2
+
 
 def logsum(vec, axis=0, keepdims=True):
     """Computes sum of logarithms."""
@@ -17,15 +24,78 @@ def logsum(vec, axis=0, keepdims=True):
 class GMM:
     """Gaussian Mixture Model."""
 
-    def __init__(self, warmstart=True):
+    def __init__(
+        self,
+        warmstart=True,
+        dtype='float64',
+        max_memory=2**24,
+        num_threads=1,
+        init='kmeans++',
+        tol=1e-5,
+        resize=True,
+        covariance='full',
+        rank=5
+    ):
         """Initializes the GMM.
 
         Args:
             warmstart: Use previous clusters as initial clusters.
+            dtype: Floating point precision of the E-step and the cluster means update. Cluster parameters are
+                always stored and factorized in float64, as the covariances of near-deterministic dimensions are
+                poorly conditioned.
+            max_memory: Memory ceiling in bytes of the intermediate arrays of the E-step, which processes the points in
+                chunks to stay below it.
+            num_threads: Number of threads the chunks of the E-step are distributed over.
+            init: Initialization of the clusters, either `kmeans++` (assign the points to the nearest of K seeds
+                chosen by k-means++ seeding) or `random` (assign the points to clusters uniformly at random).
+            tol: Relative tolerance of the log-likelihood for the convergence of EM.
+            resize: Warm start from the previous clusters when the number of clusters changes, by splitting or
+                merging clusters, see _resize.
+            covariance: Structure of the cluster covariances, `full`, `diag` (diagonal) or `lowrank` (rank low-rank
+                plus diagonal). The structured covariances are stored and fitted in their parts, which reduces the
+                memory from O(D^2) to O(D) or O(D * rank) per cluster and the cost of the E-step and M-step from
+                O(D^2) to O(D) or O(D * rank) per point and cluster. The moments and inference still return full
+                covariances.
+            rank: Rank of the low-rank part of `lowrank` covariances.
 
         """
+        if init not in ('kmeans++', 'random'):
+            raise ValueError('Unknown GMM initialization %r' % init)
+        if covariance not in ('full', 'diag', 'lowrank'):
+            raise ValueError('Unknown GMM covariance structure %r' % covariance)
         self.warmstart = warmstart
-        self.sigma = None
+        self.dtype = np.dtype(dtype)
+        self.max_memory = max_memory
+        self.num_threads = num_threads
+        self.init = init
+        self.tol = tol
+        self.resize = resize
+        self.covariance = covariance
+        self.rank = rank
+        self.mu = None
+        # Full cluster covariances, only stored for `full` covariances, see sigma.
+        self._sigma = None
+        # Diagonal parts of `diag` and `lowrank` covariances.
+        self._diag = None
+        # Low-rank parts of `lowrank` covariances and the subspaces their M-step is warm-started from.
+        self._factor = None
+        self._basis = None
+        # Statistics of the last EM run.
+        self.diagnostics = {'iterations': 0, 'log_likelihood': None, 'converged': False}
+        # Cached factorizations of the cluster covariances, see _factorize.
+        self._factors = {}
+        # Sufficient statistics of the blocks of points the clusters were fitted to, see update_incremental.
+        self._blocks = None
+
+    @property
+    def sigma(self):
+        """A K x D x D array of the full cluster covariances, assembled from their parts for structured covariances."""
+        if self.covariance == 'full' or self._diag is None:
+            return self._sigma
+        sigma = np.einsum('ki,ij->kij', self._diag, np.eye(self._diag.shape[1]))
+        if self.covariance == 'lowrank':
+            sigma += np.matmul(self._factor, self._factor.transpose(0, 2, 1))
+        return sigma
 
     def inference(self, pts):
         """Evaluate dynamics prior.
@@ -34,15 +104,44 @@ class GMM:
             pts: A N x D array of points.
 
         """
-        # Compute posterior cluster weights.
-        logwts = self.clusterwts(pts)
+        mu0, Phi, m, n0 = self.inference_batch(pts[None])
+        return mu0[0], Phi[0], m, n0
+
+    def inference_batch(self, pts, window=1):
+        """Evaluate dynamics prior for several sets of points in one vectorized pass.
+
+        The E-step of all points shares one factorization of the clusters.
+
+        Args:
+            pts: A T x N x D array of T sets of N points.
+            window: Number of consecutive sets that are pooled into one query.
+
+        Returns:
+            mu0: A T' x D array of posterior means, where T' = ceil(T / window).
+            Phi: A T' x D x D array of posterior covariances.
+            m: Normalized strength of the means, shared by all queries.
+            n0: Normalized degrees of freedom of the covariances, shared by all queries.
+
+        """
+        T, N, D = pts.shape
+
+        # Compute posterior cluster weights, averaged over the points of each set.
+        logobs = self.estep(pts.reshape(T * N, D))
+        logw = (logobs - logsum(logobs, axis=1)).reshape(T, N, -1)
+        logwts = logsum(logw, axis=1)[:, 0] - np.log(N)
+
+        # Pool the cluster weights of each window.
+        if window > 1:
+            starts = np.arange(0, T, window)
+            wts = np.add.reduceat(np.exp(logwts), starts) / np.diff(np.append(starts, T))[:, None]
+            logwts = np.log(wts)
 
         # Compute posterior mean and covariance.
-        mu0, Phi = self.moments(logwts)
+        mu0, Phi = self.moments_batch(logwts)
 
         # Set hyperparameters.
         m = self.N
-        n0 = m - 2 - mu0.shape[0]
+        n0 = m - 2 - mu0.shape[1]
 
         # Normalize.
         m = float(m) / self.N
@@ -59,36 +158,89 @@ class GMM:
             logobs: A N x K array of log probabilities (for each point on each cluster).
 
         """
-        # Constants.
-        K = self.sigma.shape[0]
-        Di = data.shape[1]
-        N = data.shape[0]
+        N, Di = data.shape
+        K = self.mu.shape[0]
+        factors = self._factorize(Di)
+        data = np.asarray(data, dtype=self.dtype)
+        mu = self.mu[:, :Di].astype(self.dtype)
+        cconst = factors[-1] + self.logmass[:, 0]
+        logobs = np.empty((N, K))
+
+        # Size the chunks such that the distances and whitened distances of all threads fit into the memory ceiling.
+        chunk_size = max(1, self.max_memory // (2 * K * Di * self.dtype.itemsize * self.num_threads))
+
+        def estep_chunk(start):
+            """Computes the log probabilities of the points in one chunk."""
+            # Whiten the distances to each cluster, such that the Mahalanobis distance is their squared norm.
+            diff = data[None, start:start + chunk_size] - mu[:, None]
+            if self.covariance == 'full':
+                z = np.matmul(diff, factors[0])
+                maha = np.einsum('kni,kni->nk', z, z)
+            else:
+                z = diff * factors[0][:, None]
+                maha = np.einsum('kni,kni->nk', z, z)
+                if self.covariance == 'lowrank':
+                    # Woodbury correction of the low-rank part.
+                    y = np.matmul(diff, factors[1])
+                    maha -= np.einsum('knr,knr->nk', y, y)
+            logobs[start:start + chunk_size] = -0.5 * maha + cconst
+
+        starts = range(0, N, chunk_size)
+        if self.num_threads > 1 and len(starts) > 1:
+            # The BLAS calls release the GIL.
+            with ThreadPool(min(self.num_threads, len(starts))) as pool:
+                pool.map(estep_chunk, starts)
+        else:
+            for start in starts:
+                estep_chunk(start)
+        return logobs
 
-        # Compute probabilities.
-        data = data.T
-        mu = self.mu[:, 0:Di].T
-        mu_expand = np.expand_dims(np.expand_dims(mu, axis=1), axis=1)
-        assert mu_expand.shape == (Di, 1, 1, K)
-        # Calculate for each point distance to each cluster.
-        data_expand = np.tile(data, [K, 1, 1, 1]).transpose([2, 3, 1, 0])
-        diff = data_expand - np.tile(mu_expand, [1, N, 1, 1])
-        assert diff.shape == (Di, N, 1, K)
-        Pdiff = np.zeros_like(diff)
-        cconst = np.zeros((1, 1, 1, K))
+    def _factorize(self, Di):
+        """Returns the factorized precisions of the clusters' marginals over the first Di dimensions.
 
-        for i in range(K):
-            U = scipy.linalg.cholesky(self.sigma[i, :Di, :Di], check_finite=False)
-            Pdiff[:, :, 0, i] = scipy.linalg.solve_triangular(
-                U,
-                scipy.linalg.solve_triangular(U.T, diff[:, :, 0, i], lower=True, check_finite=False),
-                check_finite=False
-            )
-            cconst[0, 0, 0, i] = -np.sum(np.log(np.diag(U))) - 0.5 * Di * np.log(2 * np.pi)
-
-        logobs = -0.5 * np.sum(diff * Pdiff, axis=0, keepdims=True) + cconst
-        assert logobs.shape == (1, N, 1, K)
-        logobs = logobs[0, :, 0, :] + self.logmass.T
-        return logobs
+        The factorizations are cached until the clusters are updated.
+
+        Args:
+            Di: Number of leading dimensions.
+
+        Returns:
+            For full covariances, a tuple of
+                inv_U: A K x Di x Di array of inverse upper Cholesky factors of the covariances, in the E-step
+                    precision.
+                cconst: A (K,) array of the log normalization constants.
+            For diagonal covariances, a tuple of
+                inv_std: A K x Di array of inverse standard deviations, in the E-step precision.
+                cconst: A (K,) array of the log normalization constants.
+            For low-rank plus diagonal covariances W W^T + diag(d), a tuple of
+                inv_std: A K x Di array of the inverse square roots of d, in the E-step precision.
+                A: A K x Di x rank array, such that the Mahalanobis distance of diff is
+                    |diff * inv_std|^2 - |diff A|^2, in the E-step precision.
+                cconst: A (K,) array of the log normalization constants.
+
+        """
+        if Di not in self._factors and self.covariance == 'full':
+            K = self._sigma.shape[0]
+            inv_U = np.empty((K, Di, Di))
+            cconst = np.empty(K)
+            for i in range(K):
+                U = scipy.linalg.cholesky(self._sigma[i, :Di, :Di], check_finite=False)
+                inv_U[i] = scipy.linalg.solve_triangular(U, np.eye(Di), check_finite=False)
+                cconst[i] = -np.sum(np.log(np.diag(U))) - 0.5 * Di * np.log(2 * np.pi)
+            self._factors[Di] = inv_U.astype(self.dtype, copy=False), cconst
+        elif Di not in self._factors:
+            inv_std = 1 / np.sqrt(self._diag[:, :Di])
+            cconst = np.sum(np.log(inv_std), axis=1) - 0.5 * Di * np.log(2 * np.pi)
+            factors = (inv_std.astype(self.dtype, copy=False), )
+            if self.covariance == 'lowrank':
+                # By the Woodbury identity with the whitened factor V = W / sqrt(d) and the Cholesky factor L of
+                # I + V^T V, the Mahalanobis distance is |z|^2 - |L^-1 V^T z|^2 for z = diff / sqrt(d).
+                V = self._factor[:, :Di] * inv_std[:, :, None]
+                L = np.linalg.cholesky(np.eye(V.shape[2]) + np.matmul(V.transpose(0, 2, 1), V))
+                A = np.linalg.solve(L, V.transpose(0, 2, 1)) * inv_std[:, None]
+                cconst -= np.sum(np.log(np.diagonal(L, axis1=1, axis2=2)), axis=1)
+                factors += (A.transpose(0, 2, 1).astype(self.dtype, copy=False), )
+            self._factors[Di] = factors + (cconst, )
+        return self._factors[Di]
 
     def moments(self, logwts):
         """Compute the moments of the cluster mixture with logwts.
@@ -101,19 +253,36 @@ class GMM:
             sigma: A D x D covariance matrix.
 
         """
-        # Exponentiate.
-        wts = np.exp(logwts)
+        mu, sigma = self.moments_batch(logwts.T)
+        return mu[0], sigma[0]
+
+    def moments_batch(self, logwts):
+        """Compute the moments of the cluster mixture for several sets of logwts.
+
+        Args:
+            logwts: A T x K array of log cluster probabilities.
 
-        # Compute overall mean.
-        mu = np.sum(self.mu * wts, axis=0)
+        Returns:
+            mu: A T x D array of mean vectors.
+            sigma: A T x D x D array of covariance matrices.
 
-        # Compute overall covariance.
-        # For some reason this version works way better than the "right"
-        # one... could we be computing xxt wrong?
-        diff = self.mu - np.expand_dims(mu, axis=0)
-        diff_expand = np.expand_dims(diff, axis=1) * np.expand_dims(diff, axis=2)
-        wts_expand = np.expand_dims(wts, axis=2)
-        sigma = np.sum((self.sigma + diff_expand) * wts_expand, axis=0)
+        """
+        wts = np.exp(logwts)
+        mu = wts.dot(self.mu)
+        diff = self.mu[None] - mu[:, None]
+        sigma = np.einsum('tk,tki,tkj->tij', wts, diff, diff)
+        if self.covariance == 'full':
+            sigma += np.einsum('tk,kij->tij', wts, self._sigma)
+            return mu, sigma
+
+        # Mix the parts of structured covariances, the low-rank parts as one factor with the columns of all clusters.
+        T, D = mu.shape
+        idx = np.arange(D)
+        sigma[:, idx, idx] += wts.dot(self._diag)
+        if self.covariance == 'lowrank':
+            factor = np.sqrt(wts)[:, :, None, None] * self._factor[None]
+            factor = factor.transpose(0, 2, 1, 3).reshape(T, D, -1)
+            sigma += np.matmul(factor, factor.transpose(0, 2, 1))
         return mu, sigma
 
     def clusterwts(self, data):
@@ -136,24 +305,35 @@ class GMM:
         logwts = logsum(logwts, axis=0) - np.log(data.shape[0])
         return logwts.T
 
-    def update(self, data, K, max_iterations=100):
+    def update(self, data, K, max_iterations=100, block_size=None, first_block=0):
         """Run EM to update clusters.
 
         Args:
             data: An N x D data matrix, where N = number of data points.
             K: Number of clusters to use.
+            max_iterations: Maximum number of EM iterations.
+            block_size: If given, the sufficient statistics of each block of block_size consecutive points are kept
+                after the fit, so that the clusters can be updated by update_incremental.
+            first_block: Index of the oldest block, if the blocks are not ordered by age (e.g. stored in a ring
+                buffer). update_incremental expires the blocks starting from the oldest one.
 
         """
         # Constants.
+        data = np.asarray(data, dtype=self.dtype)
         N = data.shape[0]
         Do = data.shape[1]
 
         LOGGER.debug('Fitting GMM with %d clusters on %d points', K, N)
 
-        if (not self.warmstart or self.sigma is None or K != self.sigma.shape[0]):
+        warm = self.warmstart and self.mu is not None
+        if warm and self.resize and K != self.mu.shape[0] and Do == self.mu.shape[1]:
+            LOGGER.debug('Resizing GMM from %d to %d clusters.', self.mu.shape[0], K)
+            self._resize(K)
+            self.N = data.shape[0]
+            N = self.N
+        elif not warm or K != self.mu.shape[0]:
             # Initialization.
             LOGGER.debug('Initializing GMM.')
-            self.sigma = np.zeros((K, Do, Do))
             self.mu = np.zeros((K, Do))
             self.logmass = np.log(1.0 / K) * np.ones((K, 1))
             self.mass = (1.0 / K) * np.ones((K, 1))
@@ -161,18 +341,21 @@ class GMM:
             N = self.N
 
             # Set initial cluster indices.
-            cidx = np.random.randint(0, K, size=(1, N))
+            if self.init == 'kmeans++':
+                cidx = self._kmeanspp_assignment(data, K)[None]
+            else:
+                cidx = np.random.randint(0, K, size=(1, N))
 
             # Initialize.
+            w = np.zeros((N, K))
             for i in range(K):
                 cluster_idx = (cidx == i)[0]
-                mu = np.mean(data[cluster_idx, :], axis=0)
-                diff = (data[cluster_idx, :] - mu).T
-                sigma = (1.0 / K) * (diff.dot(diff.T))
-                self.mu[i, :] = mu
-                self.sigma[i, :, :] = sigma + np.eye(Do) * 2e-6
+                self.mu[i, :] = np.mean(data[cluster_idx, :], axis=0)
+                w[cluster_idx, i] = 1.0 / K
+            self._fit_covariances(data, w, 2e-6)
 
         prevll = -float('inf')
+        self.diagnostics = {'iterations': 0, 'log_likelihood': None, 'converged': False}
         for itr in range(max_iterations):
             # E-step: compute cluster probabilities.
             logobs = self.estep(data)
@@ -180,14 +363,11 @@ class GMM:
             # Compute log-likelihood.
             ll = np.sum(logsum(logobs, axis=1))
             LOGGER.debug('GMM itr %d/%d. Log likelihood: %f', itr, max_iterations, ll)
-            if ll < prevll:
-                # TODO: Why does log-likelihood decrease sometimes?
-                LOGGER.debug('Log-likelihood decreased! Ending on itr=%d/%d', itr, max_iterations)
-                break
-            if np.abs(ll - prevll) < 1e-5 * prevll:
-                LOGGER.debug('GMM converged on itr=%d/%d', itr, max_iterations)
+            self.diagnostics['log_likelihood'] = ll
+            if self._converged(ll, prevll, itr, max_iterations):
                 break
             prevll = ll
+            self.diagnostics['iterations'] = itr + 1
 
             # Renormalize to get cluster weights.
             logw = logobs - logsum(logobs, axis=1)
@@ -207,18 +387,310 @@ class GMM:
             # Reboot small clusters.
             w[:, (self.mass < (1.0 / K) * 1e-4)[:, 0]] = 1.0 / N
             # Fit cluster means.
-            w_expand = np.expand_dims(w, axis=2)
-            data_expand = np.expand_dims(data, axis=1)
-            self.mu = np.sum(w_expand * data_expand, axis=0)
+            self.mu = w.T.dot(data)
             # Fit covariances.
-            wdata = data_expand * np.sqrt(w_expand)
-            assert wdata.shape == (N, K, Do)
-            for i in range(K):
-                # Compute weighted outer product.
-                XX = wdata[:, i, :].T.dot(wdata[:, i, :])
-                mu = self.mu[i, :]
-                self.sigma[i, :, :] = XX - np.outer(mu, mu)
+            self._fit_covariances(data, w, 1e-6)
+
+        LOGGER.debug(
+            'GMM fit: %d iterations, log likelihood %f, converged: %s', self.diagnostics['iterations'],
+            self.diagnostics['log_likelihood'], self.diagnostics['converged']
+        )
+
+        self._blocks = None
+        if block_size is not None:
+            self._shift = np.mean(data, axis=0, dtype=np.float64)
+            self._blocks = deque(self._block_stats(data, self.estep(data), block_size))
+            self._blocks.rotate(-first_block)
+
+    def can_update_incremental(self, K):
+        """Returns whether update_incremental can update the clusters for K clusters."""
+        return self.warmstart and self._blocks is not None and self.mu.shape[0] == K
+
+    def update_incremental(self, data, block_size, num_expired, max_iterations=5):
+        """Run stepwise EM to fold new points into the clusters.
+
+        The clusters keep the sufficient statistics of each block of points they were fitted to. The statistics of the
+        num_expired oldest blocks are removed and the EM iterations only revisit the new points, while the remaining
+        blocks keep the statistics of the responsibilities they were added with. The cost thus scales with the new
+        points rather than with all points.
+
+        Args:
+            data: An N x D data matrix of new points.
+            block_size: Number of consecutive points per block.
+            num_expired: Number of oldest blocks to remove.
+            max_iterations: Maximum number of EM iterations.
+
+        """
+        data = np.asarray(data, dtype=self.dtype)
+        for _ in range(num_expired):
+            self._blocks.popleft()
+        LOGGER.debug(
+            'Updating GMM with %d new points, %d blocks expired, %d blocks kept', data.shape[0], num_expired,
+            len(self._blocks)
+        )
+
+        # Statistics of the retained blocks.
+        base = [sum(stats) for stats in zip(*self._blocks)] if self._blocks else None
+
+        # Statistics of the new blocks, recomputed by each E-step.
+        new = None
+
+        prevll = -float('inf')
+        self.diagnostics = {'iterations': 0, 'log_likelihood': None, 'converged': False}
+        for itr in range(max_iterations):
+            # E-step on the new points.
+            logobs = self.estep(data)
+            new = self._block_stats(data, logobs, block_size)
+
+            ll = np.sum(logsum(logobs, axis=1))
+            LOGGER.debug('GMM incremental itr %d/%d. Log likelihood: %f', itr, max_iterations, ll)
+            self.diagnostics['log_likelihood'] = ll
+            if self._converged(ll, prevll, itr, max_iterations):
+                break
+            prevll = ll
+            self.diagnostics['iterations'] = itr + 1
+
+            # M-step from the statistics of the retained and the new blocks.
+            stats = [sum(s) for s in zip(*new)]
+            if base is not None:
+                stats = [s + b for s, b in zip(stats, base)]
+            self._mstep(*stats)
+
+        if new is None:
+            new = self._block_stats(data, self.estep(data), block_size)
+        self._blocks.extend(new)
+        # Each point contributes a total weight of one to the statistics.
+        self.N = int(round(sum(np.sum(stats[0]) for stats in self._blocks)))
+
+    def _resize(self, K):
+        """Adapts the clusters to K clusters by split and merge moves.
+
+        While there are too few clusters, the heaviest cluster is split along the principal axis of its covariance into
+        two clusters with the moments of its halves. While there are too many, the lightest cluster is merged with the
+        cluster whose mean is closest under the lighter cluster's covariance, matching the moments of the pair.
+
+        Args:
+            K: New number of clusters.
+
+        """
+        # Clusters without any mass would make the moments of merged pairs undefined.
+        mass = list(np.maximum(self.mass[:, 0], 1e-300))
+        mu = list(self.mu)
+        sigma = list(self.sigma)
+
+        while len(mass) < K:
+            i = int(np.argmax(mass))
+            eigval, eigvec = np.linalg.eigh(sigma[i])
+            # The halves of a Gaussian split at its mean have their means sqrt(2 / pi) standard deviations apart from
+            # it, and retain a fraction 1 - 2 / pi of its variance along the split.
+            offset = np.sqrt(2 / np.pi * max(eigval[-1], 0)) * eigvec[:, -1]
+            split_sigma = sigma[i] - np.outer(offset, offset)
+            mass[i] /= 2
+            mass.append(mass[i])
+            mu.append(mu[i] - offset)
+            mu[i] = mu[i] + offset
+            sigma[i] = split_sigma
+            sigma.append(split_sigma.copy())
+
+        while len(mass) > K:
+            i = int(np.argmin(mass))
+            diff = np.delete(np.asarray(mu), i, axis=0) - mu[i]
+            dist = np.sum(diff * np.linalg.solve(sigma[i], diff.T).T, axis=1)
+            j = int(np.argmin(dist))
+            j += j >= i
+            w = mass[i] + mass[j]
+            merged_mu = (mass[i] * mu[i] + mass[j] * mu[j]) / w
+            diff_i, diff_j = mu[i] - merged_mu, mu[j] - merged_mu
+            sigma[j] = (
+                mass[i] * (sigma[i] + np.outer(diff_i, diff_i)) + mass[j] * (sigma[j] + np.outer(diff_j, diff_j))
+            ) / w
+            mass[j], mu[j] = w, merged_mu
+            del mass[i], mu[i], sigma[i]
+
+        self.mass = np.array(mass)[:, None]
+        self.logmass = np.log(self.mass)
+        self.mu = np.array(mu)
+        self._set_covariances(np.array(sigma))
+
+    def _set_covariances(self, sigma):
+        """Sets the cluster covariances from full covariances, projected onto the covariance structure.
+
+        Diagonal covariances keep the variances. Low-rank plus diagonal covariances W W^T + diag(d) take W from the
+        leading eigenpairs as in probabilistic PCA, with the mean of the remaining eigenvalues as noise level, and d
+        such that the variances are retained. The factorizations are invalidated.
+
+        Args:
+            sigma: A K x D x D array of full covariances.
+
+        """
+        self._factors = {}
+        if self.covariance == 'full':
+            self._sigma = sigma
+            return
+        D = sigma.shape[1]
+        idx = np.arange(D)
+        var = sigma[:, idx, idx]
+        if self.covariance == 'diag':
+            self._diag = var
+            return
+
+        rank = min(self.rank, D)
+        eigval, eigvec = np.linalg.eigh(sigma)
+        noise = np.mean(eigval[:, :D - rank], axis=1, keepdims=True) if rank < D else np.zeros((len(eigval), 1))
+        self._factor = eigvec[:, :, D - rank:] * np.sqrt(np.maximum(eigval[:, D - rank:] - noise, 0))[:, None]
+        self._diag = np.maximum(var - np.sum(self._factor**2, axis=2), 1e-6)
+        self._basis = eigvec[:, :, D - min(D, rank + LOWRANK_OVERSAMPLING):]
+
+    def _fit_covariances(self, data, w, reg):
+        """Fits the cluster covariances about the cluster means to weighted points and invalidates the factorizations.
+
+        Structured covariances are fitted in their parts without forming the full covariances. Diagonal covariances
+        take the weighted variances. Low-rank plus diagonal covariances take their leading eigenpairs from a subspace
+        iteration, see _fit_lowrank.
+
+        Args:
+            data: An N x D data matrix.
+            w: A N x K array of the weights of the points in each cluster.
+            reg: Regularization added to the variances.
+
+        """
+        K, Do = self.mu.shape
+        self._factors = {}
+        if self.covariance == 'full':
+            self._sigma = np.empty((K, Do, Do))
+        else:
+            self._diag = np.empty((K, Do))
+        if self.covariance == 'lowrank':
+            rank = min(self.rank, Do)
+            self._factor = np.empty((K, Do, rank))
+            if self._basis is None or self._basis.shape != (K, Do, min(Do, rank + LOWRANK_OVERSAMPLING)):
+                self._basis = np.random.randn(K, Do, min(Do, rank + LOWRANK_OVERSAMPLING))
 
+        for i in range(K):
+            # Center the data in float64.
+            diff = (data - self.mu[i, :]).astype(np.float64)
+            if self.covariance == 'full':
+                # Compute weighted outer product of the centered data.
+                sigma = (diff * w[:, i:i + 1]).T.dot(diff)
                 # Use quick and dirty regularization.
-                sigma = self.sigma[i, :, :]
-                self.sigma[i, :, :] = 0.5 * (sigma + sigma.T) + 1e-6 * np.eye(Do)
+                self._sigma[i, :, :] = 0.5 * (sigma + sigma.T) + reg * np.eye(Do)
+            elif self.covariance == 'diag':
+                self._diag[i, :] = w[:, i].dot(diff**2) + reg
+            else:
+                self._fit_lowrank(i, diff * np.sqrt(w[:, i:i + 1]), reg)
+
+    def _fit_lowrank(self, i, Y, reg):
+        """Fits the low-rank plus diagonal covariance Y^T Y + reg * I of a cluster.
+
+        The leading eigenpairs are the Ritz pairs of a subspace of rank + LOWRANK_OVERSAMPLING directions, refined by
+        LOWRANK_ITERATIONS subspace iterations from the subspace of the previous fit. The covariance is only applied
+        to the subspace through Y, so the cost is O(N * D * rank). If the subspace spans all dimensions, the result
+        matches the projection of the full covariance, see _set_covariances.
+
+        Args:
+            i: Index of the cluster.
+            Y: An N x D array of the centered points, scaled by the square roots of their weights.
+            reg: Regularization added to the variances.
+
+        """
+        D, rank = self._factor.shape[1:]
+        Q = self._basis[i]
+        for _ in range(LOWRANK_ITERATIONS):
+            Q = np.linalg.qr(Y.T.dot(Y.dot(Q)))[0]
+        Z = Y.dot(Q)
+        eigval, eigvec = np.linalg.eigh(Z.T.dot(Z))
+        self._basis[i] = Q.dot(eigvec)
+
+        var = np.sum(Y**2, axis=0) + reg
+        eigval = eigval[-rank:] + reg
+        noise = (np.sum(var) - np.sum(eigval)) / (D - rank) if rank < D else 0
+        self._factor[i] = self._basis[i, :, -rank:] * np.sqrt(np.maximum(eigval - noise, 0))
+        self._diag[i] = np.maximum(var - np.sum(self._factor[i]**2, axis=1), 1e-6)
+
+    def _converged(self, ll, prevll, itr, max_iterations):
+        """Returns whether EM should stop, based on the log-likelihoods of the current and previous iteration."""
+        if ll < prevll:
+            # TODO: Why does log-likelihood decrease sometimes?
+            LOGGER.debug('Log-likelihood decreased! Ending on itr=%d/%d', itr, max_iterations)
+            return True
+        if np.isfinite(prevll) and np.abs(ll - prevll) <= self.tol * np.abs(prevll):
+            LOGGER.debug('GMM converged on itr=%d/%d', itr, max_iterations)
+            self.diagnostics['converged'] = True
+            return True
+        return False
+
+    def _kmeanspp_assignment(self, data, K):
+        """Assigns the points to the nearest of K seeds chosen by k-means++ seeding.
+
+        Distances are computed on the standardized points, so that they do not depend on the scale of each dimension.
+
+        Args:
+            data: An N x D data matrix.
+            K: Number of clusters.
+
+        Returns:
+            cidx: A (N,) array of cluster indices.
+
+        """
+        N = data.shape[0]
+        std = np.std(data, axis=0, dtype=np.float64)
+        data = data / np.where(std > 0, std, 1.0)
+
+        # Draw each seed with probability proportional to the squared distance to the nearest previous seed.
+        dist = np.full(N, np.inf)
+        cidx = np.zeros(N, dtype=int)
+        seed = np.random.randint(N)
+        for i in range(K):
+            new_dist = np.sum((data - data[seed])**2, axis=1)
+            closer = new_dist < dist
+            dist[closer], cidx[closer] = new_dist[closer], i
+            if i + 1 < K:
+                total = np.sum(dist)
+                seed = np.random.choice(N, p=dist / total) if total > 0 else np.random.randint(N)
+        return cidx
+
+    def _block_stats(self, data, logobs, block_size):
+        """Computes the sufficient statistics of the cluster responsibilities of each block of points.
+
+        Args:
+            data: An N x D data matrix.
+            logobs: A N x K array of log probabilities of the points.
+            block_size: Number of consecutive points per block.
+
+        Returns:
+            blocks: A list of (weights K, first moments K x D, second moments K x D x D) per block, with the moments
+                taken about the shift of the statistics. For diagonal covariances, the second moments are the K x D
+                diagonals.
+
+        """
+        w = np.exp(logobs - logsum(logobs, axis=1))
+        diff = data - self._shift
+        blocks = []
+        for start in range(0, data.shape[0], block_size):
+            w_b, diff_b = w[start:start + block_size], diff[start:start + block_size]
+            if self.covariance == 'diag':
+                S2 = w_b.T.dot(diff_b**2)
+            else:
+                S2 = np.tensordot(w_b[:, :, None] * diff_b[:, None], diff_b, axes=(0, 0))
+            blocks.append((np.sum(w_b, axis=0), w_b.T.dot(diff_b), S2))
+        return blocks
+
+    def _mstep(self, S0, S1, S2):
+        """Updates the clusters from sufficient statistics, see _block_stats."""
+        K, Do = S1.shape
+        N = np.sum(S0)
+        self.mass = (S0 / N)[:, None]
+        self.logmass = np.log(np.maximum(self.mass, 1e-300))
+
+        # Fit the means and covariances, rebooting small clusters to the moments of all points.
+        small = self.mass[:, 0] < (1.0 / K) * 1e-4
+        S0, S1, S2 = S0.copy(), S1.copy(), S2.copy()
+        S0[small], S1[small], S2[small] = N, np.sum(S1, axis=0), np.sum(S2, axis=0)
+        mu = S1 / S0[:, None]
+        self.mu = mu + self._shift
+        if self.covariance == 'diag':
+            self._diag = S2 / S0[:, None] - mu**2 + 1e-6
+            self._factors = {}
+            return
+        sigma = S2 / S0[:, None, None] - np.einsum('ki,kj->kij', mu, mu)
+        self._set_covariances(0.5 * (sigma + sigma.transpose(0, 2, 1)) + 1e-6 * np.eye(Do))
@@ -197,12 +197,13 @@ class GPSMain:
         else:
             pol = self.algorithm.cur[cond].traj_distr
 
-        self.agent.sample(
+        sample = self.agent.sample(
             pol,
             cond,
             noisy=True,
             reset_cond=None if self.agent._hyperparams['random_reset'] else cond,
         )
+        self.algorithm.add_sample(cond, sample)
 
     def _take_policy_samples(self, N, pol, rnd=False, randomize_initial_state=0):
         """Takes samples from the policy without exploration noise.
@@ -303,10 +304,8 @@ class GPSMain:
         dyn_covar = np.empty((M, T - 1, dX, dX))
 
         for m in range(M):
-            dynamics = self.algorithm.cur[m].traj_info.dynamics
-            Fm[m] = dynamics.Fm[:-1]
-            fv[m] = dynamics.fv[:-1]
-            dyn_covar[m] = dynamics.dyn_covar[:-1]
+            dynamics = self.algorithm.cur[m].traj_info.dynamics.per_step()
+            Fm[m], fv[m], dyn_covar[m] = (a[:-1] for a in dynamics)
 
         np.savez_compressed(
             self._data_files_dir + 'dyn_%02d' % self.iteration_count,
@@ -329,7 +328,7 @@ class GPSMain:
         traj_sigma = np.empty((M, T, dX + dU, dX + dU))
 
         for m in range(M):
-            traj = self.algorithm.cur[m].traj_distr
+            traj = self.algorithm.cur[m].traj_distr.per_step()
             K[m] = traj.K[:-1]
             k[m] = traj.k[:-1]
             prc[m] = traj.inv_pol_covar[:-1]
@@ -0,0 +1,19 @@
+"""Tests of the gym agent."""
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+
+pytest.importorskip('gym')
+pytest.importorskip('gps.proto.gps_pb2')
+from gps.agent.openai_gym.agent_openai_gym import quat_integrate  # noqa: E402
+
+
+def test_quat_integrate_rotates_in_the_local_frame():
+    """Integrating a rotation vector composes the rotation on the right of the orientation."""
+    rng = np.random.RandomState(0)
+    for _ in range(10):
+        quat, rotvec = Rotation.random(random_state=rng).as_quat(), rng.randn(3)
+        expected = (Rotation.from_quat(quat) * Rotation.from_rotvec(rotvec)).as_quat()
+        result = quat_integrate(np.roll(quat, 1), rotvec)
+        np.testing.assert_allclose(np.abs(result.dot(np.roll(expected, 1))), 1, rtol=1e-12)
+    np.testing.assert_array_equal(quat_integrate(np.array([1.0, 0, 0, 0]), np.zeros(3)), [1, 0, 0, 0])
@@ -0,0 +1,70 @@
+"""Tests of the trajectory-centric step adjustment."""
+import numpy as np
+
+from gps.algorithm.algorithm_NN import Algorithm_NN
+from gps.algorithm.algorithm_utils import IterationData, TrajectoryInfo
+from gps.algorithm.dynamics.dynamics_lr import DynamicsLR
+from gps.algorithm.policy.lin_gauss_policy import LinearGaussianPolicy
+from gps.algorithm.traj_opt.lqr_kernel import forward_marginals, MarginalCache, random_problem
+from gps.algorithm.traj_opt.traj_opt_utils import laplace_cost
+
+
+class StepAdjustAlgorithm(Algorithm_NN):
+    """Algorithm with the trajectory updates left out."""
+
+    def _update_trajectories(self):
+        """Leaves the trajectories unchanged."""
+
+
+def make_iteration(Cm, cv, Fm, fv, K, seed):
+    """Creates iteration data with a linear Gaussian policy and trajectory info from the given problem."""
+    T, dX = fv.shape
+    dU = K.shape[1]
+    rng = np.random.RandomState(seed)
+    traj_info = TrajectoryInfo()
+    traj_info.dynamics = DynamicsLR({'time_window': 1})
+    traj_info.dynamics.T = T
+    traj_info.dynamics.Fm, traj_info.dynamics.fv = Fm, fv
+    traj_info.dynamics.dyn_covar = np.tile(1e-3 * np.eye(dX), (T, 1, 1))
+    traj_info.x0mu, traj_info.x0sigma = rng.randn(dX), np.eye(dX)
+    traj_info.Cm, traj_info.cv, traj_info.cc = Cm, cv, np.zeros(T)
+    pol_covar = np.tile(0.1 * np.eye(dU), (T, 1, 1))
+    iteration = IterationData()
+    iteration.traj_info = traj_info
+    iteration.traj_distr = LinearGaussianPolicy(
+        K, rng.randn(T, dU), pol_covar, np.linalg.cholesky(pol_covar), np.linalg.inv(pol_covar)
+    )
+    iteration.cs = rng.randn(3, T)
+    iteration.step_mult = 1.0
+    return iteration
+
+
+def test_stepadjust_batches_the_laplace_estimates():
+    """The three Laplace estimates of a step adjustment are one batched forward pass with the unbatched result."""
+    T, dX, dU = 6, 3, 2
+    Cm, cv, Fm, fv = random_problem(2, T, dX, dU)
+    K = 0.1 * np.random.RandomState(1).randn(2, T, dU, dX)
+    algorithm = StepAdjustAlgorithm.__new__(StepAdjustAlgorithm)
+    algorithm.T = T
+    algorithm._hyperparams = {'min_step_mult': 0.01, 'max_step_mult': 10.0}
+    algorithm._marginals = MarginalCache()
+    algorithm.prev = [make_iteration(Cm[0], cv[0], Fm[0], fv[0], K[0], 2)]
+    algorithm.cur = [make_iteration(Cm[1], cv[1], Fm[1], fv[1], K[1], 3)]
+
+    calls = []
+    forward = algorithm._marginals.forward
+    algorithm._marginals.forward = lambda *args: calls.append(args) or forward(*args)
+    algorithm._stepadjust(0)
+
+    def estimate(traj_distr, traj_info):
+        mu, sigma = forward_marginals([traj_distr], [traj_info])
+        return np.sum(laplace_cost(mu[0], sigma[0], traj_info.cc, traj_info.cv, traj_info.Cm))
+
+    prev, cur = algorithm.prev[0], algorithm.cur[0]
+    previous = estimate(prev.traj_distr, prev.traj_info)
+    predicted_impr = previous - estimate(cur.traj_distr, prev.traj_info)
+    actual_impr = previous - estimate(cur.traj_distr, cur.traj_info)
+    new_mult = max(0.1, min(5.0, predicted_impr / (2.0 * max(1e-4, predicted_impr - actual_impr))))
+
+    assert len(calls) == 1
+    np.testing.assert_allclose(cur.step_mult, max(min(new_mult, 10.0), 0.01), rtol=1e-10)
@@ -0,0 +1,189 @@
+"""Tests of the dynamics estimation."""
+import numpy as np
+import pytest
+
+from gps.algorithm.dynamics import DynamicsFD, DynamicsLR, DynamicsLRPrior, DynamicsLRStreaming
+from gps.algorithm.dynamics.dynamics_lr_prior import pool_neighbors
+
+
+class FakePrior:
+    """Normal-inverse-Wishart prior with fixed parameters, independent of the queried points."""
+
+    def __init__(self, hyperparams):
+        """Initializes the prior with the strength of the hyperparameters."""
+        self.strength = hyperparams.get('strength', 1.0)
+
+    def update(self, X, U):
+        """Does nothing, the prior is fixed."""
+        pass
+
+    def eval_batch(self, Dx, Du, pts, window=1):
+        """Returns the fixed prior for each window of time steps."""
+        T_w = -(-pts.shape[0] // window)
+        D = Dx + Du + Dx
+        mu0 = np.tile(np.linspace(-1, 1, D), (T_w, 1))
+        Phi = np.tile(0.5 * np.eye(D) + 0.1, (T_w, 1, 1)) * self.strength
+        return mu0, Phi, self.strength, self.strength
+
+
+def make_dynamics(**hyperparams):
+    """Creates DynamicsLRPrior with the fixed prior."""
+    return DynamicsLRPrior(dict({'regularization': 1e-6, 'prior': {'type': FakePrior}}, **hyperparams))
+
+
+def make_samples(N, T, dX, dU, seed=0):
+    """Rolls out random linear dynamics with random actions."""
+    rng = np.random.RandomState(seed)
+    A = np.eye(dX) + 0.1 * rng.randn(dX, dX)
+    B = rng.randn(dX, dU)
+    U = rng.randn(N, T, dU)
+    X = np.zeros((N, T, dX))
+    X[:, 0] = rng.randn(N, dX)
+    for t in range(T - 1):
+        X[:, t + 1] = X[:, t].dot(A.T) + U[:, t].dot(B.T) + 0.1 * rng.randn(N, dX)
+    return X, U
+
+
+def reference_fit(X, U, prior, regularization):
+    """Fits the dynamics of each time step on its own, from the normal-inverse-Wishart posterior."""
+    N, T, dX = X.shape
+    dU = U.shape[2]
+    ixu, ix = slice(dX + dU), slice(dX + dU, dX + dU + dX)
+    Fm, fv, dyn_covar = [], [], []
+    for t in range(T - 1):
+        Ys = np.c_[X[:, t], U[:, t], X[:, t + 1]]
+        mu0, Phi, m, n0 = (a[0] if np.ndim(a) else a for a in prior.eval_batch(dX, dU, Ys[None]))
+        empmu = np.mean(Ys, axis=0)
+        empsig = (Ys - empmu).T.dot(Ys - empmu) / N
+        sigma = (Phi + N * empsig + (N * m) / (N + m) * np.outer(empmu - mu0, empmu - mu0)) / (N + n0)
+        sigma[ixu, ixu] += regularization
+        F = np.linalg.solve(sigma[ixu, ixu], sigma[ixu, ix]).T
+        Fm.append(F)
+        fv.append(empmu[ix] - F.dot(empmu[ixu]))
+        dyn_covar.append(sigma[ix, ix] - F.dot(sigma[ixu, ixu]).dot(F.T))
+    return np.array(Fm), np.array(fv), np.array(dyn_covar)
+
+
+def test_lr_prior_fit_matches_reference():
+    """The vectorized fit matches fitting each time step on its own."""
+    X, U = make_samples(8, 10, 3, 2)
+    dynamics = make_dynamics()
+    Fm, fv, dyn_covar = dynamics.fit(X, U)
+    Fm_ref, fv_ref, dyn_covar_ref = reference_fit(X, U, dynamics.prior, 1e-6)
+
+    np.testing.assert_allclose(Fm[:-1], Fm_ref, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(fv[:-1], fv_ref, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(dyn_covar[:-1], dyn_covar_ref, rtol=1e-8, atol=1e-10)
+
+
+@pytest.mark.parametrize('make', [lambda: DynamicsLR({'regularization': 1e-6}), make_dynamics])
+def test_weighted_fit_matches_repeated_samples(make):
+    """A fit with integer sample weights matches the fit on correspondingly repeated samples."""
+    X, U = make_samples(6, 8, 3, 2)
+    counts = np.array([1, 3, 2, 1, 2, 1])
+    weighted = make().fit(X, U, dwts=np.repeat(counts[:, None], 8, axis=1).astype(float))
+    repeated = make().fit(np.repeat(X, counts, axis=0), np.repeat(U, counts, axis=0))
+
+    for a, b in zip(weighted, repeated):
+        np.testing.assert_allclose(a, b, rtol=1e-8, atol=1e-10)
+
+
+def test_fit_without_weight_support_rejects_weights():
+    """Dynamics that do not support sample weights refuse them."""
+    X, U = make_samples(4, 5, 3, 2)
+    for dynamics in (DynamicsLRStreaming({'regularization': 1e-6, 'prior': {'type': FakePrior}}), DynamicsFD({})):
+        assert not dynamics.supports_sample_weights
+        with pytest.raises(ValueError):
+            dynamics.fit(X, U, dwts=np.ones((4, 5)))
+
+
+@pytest.mark.parametrize('forgetting_factor', [0.0, 0.5])
+@pytest.mark.parametrize('streamed', [False, True])
+def test_streaming_fit_matches_discounted_weighted_fit(forgetting_factor, streamed):
+    """The streamed statistics match a fit on the samples of both iterations, with the old ones discounted."""
+    X, U = make_samples(10, 8, 3, 2)
+    dynamics = DynamicsLRStreaming(
+        {'regularization': 1e-6, 'prior': {'type': FakePrior}, 'forgetting_factor': forgetting_factor}
+    )
+    for X_itr, U_itr in ((X[:4], U[:4]), (X[4:], U[4:])):
+        if streamed:
+            for n in range(X_itr.shape[0]):
+                dynamics.add_sample(X_itr[n], U_itr[n])
+        fitted = dynamics.fit(X_itr, U_itr)
+
+    if forgetting_factor == 0:
+        expected = make_dynamics().fit(X[4:], U[4:])
+    else:
+        dwts = np.concatenate([np.full((4, 8), forgetting_factor), np.ones((6, 8))])
+        expected = make_dynamics().fit(X, U, dwts=dwts)
+    for a, b in zip(fitted, expected):
+        np.testing.assert_allclose(a, b, rtol=1e-8, atol=1e-10)
+
+
+def test_pool_neighbors_matches_kernel_weighted_moments():
+    """The pooled moments are the kernel-weighted moments of the points of the neighboring time steps."""
+    rng = np.random.RandomState(0)
+    points = [rng.randn(N, 3) + t for t, N in enumerate([4, 6, 5, 3, 7, 4, 5])]
+    N = np.array([len(p) for p in points], dtype=float)
+    mu = np.array([np.mean(p, axis=0) for p in points])
+    M2 = np.array([(p - m).T.dot(p - m) for p, m in zip(points, mu)])
+
+    pooled_N, pooled_mu, pooled_M2 = pool_neighbors(N, mu, M2, 0.8)
+
+    for t in range(7):
+        wts = np.concatenate(
+            [np.full(len(p), np.exp(-0.5 * ((s - t) / 0.8)**2)) for s, p in enumerate(points) if abs(s - t) <= 3]
+        )
+        pts = np.concatenate([p for s, p in enumerate(points) if abs(s - t) <= 3])
+        mean = wts.dot(pts) / np.sum(wts)
+        np.testing.assert_allclose(pooled_N[t], np.sum(wts), rtol=1e-12)
+        np.testing.assert_allclose(pooled_mu[t], mean, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(pooled_M2[t], (wts[:, None] * (pts - mean)).T.dot(pts - mean), rtol=1e-10)
+
+
+def test_temporal_pooling_with_tiny_bandwidth_is_unpooled():
+    """A bandwidth far below one time step leaves the fit unchanged."""
+    X, U = make_samples(6, 8, 3, 2)
+    pooled = make_dynamics(temporal_pooling=0.05).fit(X, U)
+    unpooled = make_dynamics().fit(X, U)
+
+    for a, b in zip(pooled, unpooled):
+        np.testing.assert_allclose(a, b, rtol=1e-8, atol=1e-10)
+
+
+class FakeLinearAgent:
+    """Agent whose simulator has known linear dynamics."""
+
+    def __init__(self, A, B, c):
+        """Initializes the agent with the dynamics x' = A x + B u + c."""
+        self.A, self.B, self.c = A, B, c
+
+    def linearize(self, sim_state, U, eps):
+        """Returns the nominal trajectory of the actions and the exact linearization along it."""
+        T = U.shape[0]
+        X = np.zeros((T, self.A.shape[0]))
+        for t in range(T - 1):
+            X[t + 1] = self.A.dot(X[t]) + self.B.dot(U[t]) + self.c
+        return X, np.tile(np.c_[self.A, self.B], (T - 1, 1, 1))
+
+
+@pytest.mark.parametrize('window', [1, 3])
+def test_fd_fit_uses_the_linearization_and_residual_covariance(window):
+    """The finite difference fit averages the linearization over windows and takes the covariance of the residuals."""
+    rng = np.random.RandomState(0)
+    A, B, c = np.eye(3) + 0.1 * rng.randn(3, 3), rng.randn(3, 2), rng.randn(3)
+    X, U = make_samples(6, 8, 3, 2)
+    dynamics = DynamicsFD({'regularization': 1e-6, 'time_window': window})
+    with pytest.raises(ValueError):
+        dynamics.fit(X, U)
+    dynamics.update_prior([type('Sample', (), {'agent': FakeLinearAgent(A, B, c), 'sim_state': None})])
+
+    Fm, fv, dyn_covar = dynamics.fit(X, U)
+
+    residuals = X[:, 1:] - X[:, :-1].dot(A.T) - U[:, :-1].dot(B.T) - c
+    for w, start in enumerate(range(0, 7, window)):
+        np.testing.assert_allclose(Fm[w], np.c_[A, B], rtol=1e-12)
+        np.testing.assert_allclose(fv[w], c, rtol=1e-10)
+        r = residuals[:, start:start + window].reshape(-1, 3)
+        np.testing.assert_allclose(dyn_covar[w], r.T.dot(r) / len(r) + 1e-6 * np.eye(3), rtol=1e-10)
+    assert Fm.shape[0] == -(-8 // window)
@@ -0,0 +1,21 @@
+"""Tests of the GMM dynamics prior."""
+import numpy as np
+
+from gps.algorithm.dynamics.dynamics_prior_gmm import DynamicsPriorGMM
+
+
+def test_shared_initial_state_matches_prior_of_the_condition():
+    """A prior shared by two conditions keeps the initial state prior of each condition over the sample window."""
+    hyperparams = {'max_samples': 4, 'min_samples_per_cluster': 10}
+    shared = DynamicsPriorGMM(dict(hyperparams, num_conditions=2))
+    single = [DynamicsPriorGMM(dict(hyperparams, num_conditions=1)) for _ in range(2)]
+    rng = np.random.RandomState(0)
+    for _ in range(4):
+        X = [rng.randn(2, 5, 3) + 5 * cond for cond in range(2)]
+        U = [rng.randn(2, 5, 2) for _ in range(2)]
+        shared.update(np.concatenate(X), np.concatenate(U), conditions=[0, 0, 1, 1])
+        for cond in range(2):
+            single[cond].update(X[cond], U[cond])
+
+            for a, b in zip(shared.initial_state(cond), single[cond].initial_state()):
+                np.testing.assert_allclose(a, b, rtol=1e-12)
@@ -0,0 +1,58 @@
+"""Tests of the general utilities."""
+import numpy as np
+import pytest
+
+from gps.utility.general_utils import RingBuffer
+
+
+def ordered(buffer):
+    """Returns the items of a ring buffer from the oldest to the newest."""
+    return np.roll(buffer.data, -buffer.start, axis=0)
+
+
+def test_ring_buffer_fills_in_order():
+    """Until it is full, the buffer holds the items in insertion order."""
+    buffer = RingBuffer(5, (2, ))
+    assert buffer.append(np.arange(6).reshape(3, 2)) == 0
+    assert len(buffer) == 3 and buffer.start == 0
+    np.testing.assert_array_equal(buffer.data, np.arange(6).reshape(3, 2))
+
+
+@pytest.mark.parametrize('sizes', [[3, 4], [2, 2, 2, 2, 2], [4, 9], [12], [5, 1, 5]])
+def test_ring_buffer_wraps_around(sizes):
+    """Once full, the buffer holds the newest items and overwrites the oldest ones."""
+    buffer = RingBuffer(5, (2, 3), dtype='float32')
+    items = np.random.RandomState(0).randn(sum(sizes), 2, 3).astype('float32')
+    total = 0
+    for size in sizes:
+        stored = len(buffer)
+        assert buffer.append(items[total:total + size]) == min(stored, max(0, stored + size - 5))
+        total += size
+        assert len(buffer) == min(total, 5)
+        np.testing.assert_array_equal(ordered(buffer), items[max(0, total - 5):total])
+    assert buffer.data.dtype == np.float32
+
+
+def test_ring_buffer_counts_only_evicted_items():
+    """Items of an append that exceed the capacity are dropped without being counted as evicted."""
+    buffer = RingBuffer(5, ())
+    buffer.append(np.arange(3.0))
+    assert buffer.append(np.arange(12.0)) == 3
+    assert buffer.append(np.arange(7.0)) == 5
+    np.testing.assert_array_equal(ordered(buffer), np.arange(2.0, 7.0))
+
+
+def test_ring_buffer_clear():
+    """A cleared buffer is empty and fills from the start again."""
+    buffer = RingBuffer(3, ())
+    buffer.append(np.arange(5.0))
+    buffer.clear()
+    assert len(buffer) == 0
+    buffer.append(np.arange(2.0))
+    np.testing.assert_array_equal(ordered(buffer), [0.0, 1.0])
+
+
+def test_ring_buffer_rejects_empty_capacity():
+    """A buffer must hold at least one item."""
+    with pytest.raises(ValueError):
+        RingBuffer(0, ())
@@ -0,0 +1,199 @@
+"""Tests of the Gaussian mixture model."""
+import copy
+
+import numpy as np
+import pytest
+import scipy.special
+import scipy.stats
+
+from gps.utility.gmm import GMM
+
+
+def make_data(N, D, K=3, seed=0):
+    """Draws points from a random mixture of correlated Gaussians."""
+    rng = np.random.RandomState(seed)
+    centers = 3 * rng.randn(K, D)
+    mixing = rng.randn(K, D, D) / np.sqrt(D)
+    labels = rng.randint(K, size=N)
+    return centers[labels] + np.einsum('nij,nj->ni', mixing[labels], rng.randn(N, D))
+
+
+def fit_gmm(data, K, seed=0, **kwargs):
+    """Fits a GMM with a fixed seed."""
+    np.random.seed(seed)
+    gmm = GMM(**kwargs)
+    gmm.update(data, K)
+    return gmm
+
+
+def reference_logobs(gmm, data):
+    """Log probabilities of the points under each cluster, from the full cluster covariances."""
+    Di = data.shape[1]
+    return np.stack(
+        [
+            gmm.logmass[i, 0] + scipy.stats.multivariate_normal.logpdf(data, gmm.mu[i, :Di], gmm.sigma[i, :Di, :Di])
+            for i in range(gmm.sigma.shape[0])
+        ],
+        axis=1
+    )
+
+
+@pytest.mark.parametrize('covariance', ['full', 'diag', 'lowrank'])
+def test_estep_matches_scipy(covariance):
+    """The E-step matches the Gaussian log densities, also for the marginals of the leading dimensions."""
+    data = make_data(300, 8)
+    gmm = fit_gmm(data, 4, covariance=covariance, rank=3)
+
+    np.testing.assert_allclose(gmm.estep(data), reference_logobs(gmm, data), rtol=1e-10)
+    np.testing.assert_allclose(gmm.estep(data[:, :5]), reference_logobs(gmm, data[:, :5]), rtol=1e-10)
+
+
+@pytest.mark.parametrize('covariance', ['full', 'lowrank'])
+def test_estep_chunks_and_threads(covariance):
+    """Splitting the E-step into chunks and distributing them over threads does not change the result."""
+    data = make_data(300, 8)
+    gmm = fit_gmm(data, 4, covariance=covariance, rank=3)
+    logobs = gmm.estep(data)
+
+    gmm.max_memory = 4 * 8 * 8 * 16
+    np.testing.assert_allclose(gmm.estep(data), logobs, rtol=1e-12)
+    gmm.num_threads = 3
+    np.testing.assert_allclose(gmm.estep(data), logobs, rtol=1e-12)
+
+
+def test_inference_batch_matches_inference():
+    """The batched prior inference matches the inference of each set of points."""
+    data = make_data(300, 6)
+    gmm = fit_gmm(data, 4)
+    pts = data[:120].reshape(6, 20, 6)
+
+    mu0, Phi, m, n0 = gmm.inference_batch(pts)
+    for t in range(6):
+        mu0_t, Phi_t, m_t, n0_t = gmm.inference(pts[t])
+        np.testing.assert_allclose(mu0[t], mu0_t, rtol=1e-10)
+        np.testing.assert_allclose(Phi[t], Phi_t, rtol=1e-10)
+        assert (m, n0) == (m_t, n0_t)
+
+
+def test_kmeanspp_separates_clusters():
+    """k-means++ seeding and EM recover well separated clusters."""
+    rng = np.random.RandomState(0)
+    centers = np.array([[0, 0], [20, 0], [0, 20]])
+    data = np.concatenate([center + rng.randn(100, 2) for center in centers])
+    gmm = fit_gmm(data, 3, init='kmeans++')
+
+    dist = np.linalg.norm(gmm.mu[:, None] - centers[None], axis=2)
+    assert sorted(np.argmin(dist, axis=1)) == [0, 1, 2]
+    assert np.all(np.min(dist, axis=1) < 0.5)
+    np.testing.assert_allclose(gmm.mass, 1 / 3, atol=1e-3)
+
+
+@pytest.mark.parametrize('covariance', ['diag', 'lowrank'])
+def test_structured_covariances(covariance):
+    """The cluster covariances are diagonal, or diagonal plus a low-rank part."""
+    data = make_data(300, 8)
+    gmm = fit_gmm(data, 4, covariance=covariance, rank=3)
+
+    low_rank = gmm.sigma - np.einsum('ki,ij->kij', gmm._diag, np.eye(8))
+    if covariance == 'diag':
+        assert not np.any(low_rank)
+    else:
+        assert np.all(np.linalg.matrix_rank(low_rank) <= 3)
+
+
+@pytest.mark.parametrize('covariance', ['full', 'diag', 'lowrank'])
+def test_update_incremental_matches_refit_of_new_points(covariance):
+    """With all blocks expired, the incremental update is a warm-started refit on the new points."""
+    data = make_data(400, 6, seed=0)
+    new = make_data(200, 6, seed=1)
+    np.random.seed(0)
+    gmm = GMM(covariance=covariance)
+    gmm.update(data, 4, block_size=20)
+    refit = copy.deepcopy(gmm)
+
+    gmm.update_incremental(new, 20, 20, max_iterations=10)
+    refit.update(new, 4, max_iterations=10)
+
+    np.testing.assert_allclose(gmm.mass, refit.mass, rtol=1e-8)
+    np.testing.assert_allclose(gmm.mu, refit.mu, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(gmm.sigma, refit.sigma, rtol=1e-8, atol=1e-10)
+    assert gmm.N == 200
+
+
+@pytest.mark.parametrize('covariance', ['diag', 'lowrank'])
+def test_structured_covariances_are_stored_in_parts(covariance):
+    """Structured covariances do not store the full covariances."""
+    gmm = fit_gmm(make_data(300, 8), 4, covariance=covariance, rank=3)
+
+    assert gmm._sigma is None
+    assert gmm._diag.shape == (4, 8)
+    assert gmm._factor is None if covariance == 'diag' else gmm._factor.shape == (4, 8, 3)
+
+
+@pytest.mark.parametrize('D, rank, rtol', [(8, 3, 1e-10), (16, 2, 1e-8)])
+def test_lowrank_mstep_matches_projected_covariance(D, rank, rtol):
+    """The low-rank M-step matches the projection of the full weighted covariances.
+
+    It is exact if the subspace spans all dimensions, and converges over warm-started M-steps otherwise.
+    """
+    rng = np.random.RandomState(0)
+    data = rng.randn(500, rank).dot(3 * rng.randn(rank, D)) + rng.randn(500, D)
+    gmm = fit_gmm(data, 3, covariance='lowrank', rank=rank)
+    w = rng.dirichlet(np.ones(3), size=500)
+    w /= np.sum(w, axis=0)
+    projected = copy.deepcopy(gmm)
+    projected._set_covariances(
+        np.stack([(data - mu).T.dot(w[:, [i]] * (data - mu)) + 1e-6 * np.eye(D) for i, mu in enumerate(gmm.mu)])
+    )
+
+    for _ in range(5):
+        gmm._fit_covariances(data, w, 1e-6)
+
+    np.testing.assert_allclose(gmm.sigma, projected.sigma, rtol=rtol, atol=rtol * np.max(np.abs(projected.sigma)))
+
+
+def test_update_incremental_approximates_full_refit():
+    """With retained blocks, the incremental update nearly attains the likelihood of a full refit."""
+    data = make_data(600, 6, seed=0)
+    np.random.seed(0)
+    gmm = GMM()
+    gmm.update(data[:400], 4, block_size=20)
+    refit = copy.deepcopy(gmm)
+
+    gmm.update_incremental(data[400:], 20, 10)
+    refit.update(data[200:], 4)
+
+    def log_likelihood(model):
+        """Log-likelihood of the retained and new points."""
+        return np.sum(scipy.special.logsumexp(model.estep(data[200:]), axis=1))
+
+    assert gmm.N == refit.N == 400
+    assert log_likelihood(gmm) > log_likelihood(refit) - 0.01 * abs(log_likelihood(refit))
+
+
+def test_update_incremental_without_iterations():
+    """Without EM iterations, the new points are only added to the statistics."""
+    data = make_data(400, 6)
+    np.random.seed(0)
+    gmm = GMM()
+    gmm.update(data[:300], 4, block_size=20)
+    mu = gmm.mu.copy()
+
+    gmm.update_incremental(data[300:], 20, 5, max_iterations=0)
+
+    np.testing.assert_array_equal(gmm.mu, mu)
+    assert len(gmm._blocks) == 15 and gmm.N == 300
+
+
+@pytest.mark.parametrize('K', [2, 7])
+def test_resize_preserves_mixture_moments(K):
+    """Splitting and merging clusters preserves the moments of the mixture."""
+    gmm = fit_gmm(make_data(300, 5), 4)
+    mu, sigma = gmm.moments(gmm.logmass)
+
+    gmm._resize(K)
+
+    assert gmm.sigma.shape[0] == K
+    np.testing.assert_allclose(np.sum(gmm.mass), 1)
+    np.testing.assert_allclose(gmm.moments(gmm.logmass)[0], mu, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(gmm.moments(gmm.logmass)[1], sigma, rtol=1e-10, atol=1e-12)
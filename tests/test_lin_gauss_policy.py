@@ -0,0 +1,59 @@
+"""Tests of the linear Gaussian policy."""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import scipy.stats
+
+from gps.algorithm.algorithm import Algorithm
+from gps.algorithm.policy.lin_gauss_policy import LinearGaussianPolicy
+
+
+def make_policy(rng, W, dX, dU, window=1):
+    """Creates a random linear Gaussian policy with W windows."""
+    G = rng.randn(W, dU, dU)
+    pol_covar = G @ G.transpose(0, 2, 1) + 0.1 * np.eye(dU)
+    return LinearGaussianPolicy(
+        rng.randn(W, dU, dX), rng.randn(W, dU), pol_covar, np.linalg.cholesky(pol_covar).transpose(0, 2, 1),
+        np.linalg.inv(pol_covar), window
+    )
+
+
+@pytest.mark.parametrize('window', [1, 3])
+def test_log_prob_matches_scipy(window):
+    """The log probabilities of the actions match the Gaussian log densities."""
+    rng = np.random.RandomState(0)
+    policy = make_policy(rng, -(-12 // window), 3, 2, window)
+    X, U = rng.randn(5, 12, 3), rng.randn(5, 12, 2)
+
+    log_prob = policy.log_prob(X, U)
+    for n in range(5):
+        for t in range(12):
+            w = t // window
+            mean = policy.K[w].dot(X[n, t]) + policy.k[w]
+            np.testing.assert_allclose(
+                log_prob[n, t], scipy.stats.multivariate_normal.logpdf(U[n, t], mean, policy.pol_covar[w]), rtol=1e-10
+            )
+
+
+def test_importance_weights_are_clipped_likelihood_ratios():
+    """The importance weight of a time step is the clipped likelihood ratio of the actions up to it."""
+    rng = np.random.RandomState(1)
+    cur, prev = make_policy(rng, 6, 3, 2), make_policy(rng, 6, 3, 2)
+    X, U = rng.randn(4, 6, 3), rng.randn(4, 6, 2)
+    algorithm = SimpleNamespace(
+        cur=[SimpleNamespace(traj_distr=cur)],
+        prev=[SimpleNamespace(traj_distr=prev, sample_list=SimpleNamespace(get_X=lambda: X, get_U=lambda: U))],
+        _hyperparams={'max_importance_weight': 2.0},
+    )
+
+    dwts = Algorithm._importance_weights(algorithm, 0)[2]
+
+    ratio = np.ones(4)
+    for t in range(6):
+        for n in range(4):
+            ratio[n] *= (
+                scipy.stats.multivariate_normal.pdf(U[n, t], cur.K[t].dot(X[n, t]) + cur.k[t], cur.pol_covar[t]) /
+                scipy.stats.multivariate_normal.pdf(U[n, t], prev.K[t].dot(X[n, t]) + prev.k[t], prev.pol_covar[t])
+            )
+        np.testing.assert_allclose(dwts[:, t], np.minimum(ratio, 2.0), rtol=1e-8)
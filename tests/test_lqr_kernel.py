@@ -0,0 +1,234 @@
+"""Tests of the batched LQR kernels against step-by-step references."""
+import pickle
+
+import numpy as np
+import pytest
+import scipy.linalg
+
+from gps.algorithm.algorithm_utils import TrajectoryInfo
+from gps.algorithm.dynamics import DynamicsLR
+from gps.algorithm.policy.lin_gauss_policy import LinearGaussianPolicy
+from gps.algorithm.traj_opt.lqr_kernel import lqr_backward, lqr_forward, LQRWorkspace, MarginalCache, random_problem
+
+
+def reference_backward(Cm, cv, Fm, fv):
+    """LQR backward pass of a single problem, one time step after the other."""
+    T, dX = fv.shape
+    dU = Fm.shape[2] - dX
+    ix, iu = slice(dX), slice(dX, dX + dU)
+    K = np.zeros((T, dU, dX))
+    k = np.zeros((T, dU))
+    pol_covar = np.zeros((T, dU, dU))
+    Vxx, Vx = np.zeros((dX, dX)), np.zeros(dX)
+    for t in range(T - 1, -1, -1):
+        Qtt, Qt = Cm[t], cv[t]
+        if t < T - 1:
+            Qtt = Qtt + Fm[t].T.dot(Vxx).dot(Fm[t])
+            Qt = Qt + Fm[t].T.dot(Vx + Vxx.dot(fv[t]))
+        Qtt = 0.5 * (Qtt + Qtt.T)
+        pol_covar[t] = np.linalg.inv(Qtt[iu, iu])
+        K[t] = -np.linalg.solve(Qtt[iu, iu], Qtt[iu, ix])
+        k[t] = -np.linalg.solve(Qtt[iu, iu], Qt[iu])
+        Vxx = Qtt[ix, ix] + Qtt[ix, iu].dot(K[t])
+        Vxx = 0.5 * (Vxx + Vxx.T)
+        Vx = Qt[ix] + Qtt[ix, iu].dot(k[t])
+    return K, k, pol_covar
+
+
+def reference_forward(K, k, pol_covar, Fm, fv, dyn_covar, x0mu, x0sigma):
+    """LQR forward pass of a single policy, one time step after the other."""
+    T, dU, dX = K.shape
+    ix, iu = slice(dX), slice(dX, dX + dU)
+    mu = np.zeros((T, dX + dU))
+    sigma = np.zeros((T, dX + dU, dX + dU))
+    mu[0, ix], sigma[0, ix, ix] = x0mu, x0sigma
+    for t in range(T):
+        sigma_xx = sigma[t, ix, ix]
+        sigma_ux = K[t].dot(sigma_xx)
+        sigma[t] = np.block([[sigma_xx, sigma_ux.T], [sigma_ux, sigma_ux.dot(K[t].T) + pol_covar[t]]])
+        mu[t, iu] = K[t].dot(mu[t, ix]) + k[t]
+        if t < T - 1:
+            sigma[t + 1, ix, ix] = Fm[t].dot(sigma[t]).dot(Fm[t].T) + dyn_covar[t]
+            mu[t + 1, ix] = Fm[t].dot(mu[t]) + fv[t]
+    return mu, sigma
+
+
+def make_policies(B, T, dX, dU, seed=0):
+    """Creates the policies of random problems with random dynamics covariances and initial states."""
+    rng = np.random.RandomState(seed)
+    Cm, cv, Fm, fv = random_problem(B, T, dX, dU, seed)
+    K, k, pol_covar = lqr_backward(Cm, cv, Fm, fv)[:3]
+    G = rng.randn(B, T, dX, dX)
+    dyn_covar = 0.01 * G @ G.transpose(0, 1, 3, 2)
+    x0mu = rng.randn(B, dX)
+    x0sigma = 0.1 * np.eye(dX) + np.zeros((B, dX, dX))
+    return K, k, pol_covar, Fm, fv, dyn_covar, x0mu, x0sigma
+
+
+def test_backward_matches_reference():
+    """The batched backward pass matches the reference for each batch entry."""
+    Cm, cv, Fm, fv = random_problem(3, 12, 4, 2)
+    K, k, pol_covar, chol_pol_covar, inv_pol_covar, fail = lqr_backward(Cm, cv, Fm, fv, LQRWorkspace())
+
+    assert not np.any(fail)
+    for b in range(3):
+        K_ref, k_ref, pol_covar_ref = reference_backward(Cm[b], cv[b], Fm[b], fv[b])
+        np.testing.assert_allclose(K[b], K_ref, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(k[b], k_ref, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(pol_covar[b], pol_covar_ref, rtol=1e-8, atol=1e-10)
+        for t in range(12):
+            np.testing.assert_allclose(chol_pol_covar[b, t], scipy.linalg.cholesky(pol_covar_ref[t]), atol=1e-10)
+            np.testing.assert_allclose(inv_pol_covar[b, t].dot(pol_covar_ref[t]), np.eye(2), atol=1e-10)
+
+
+def test_backward_float32_matches_float64():
+    """The backward pass runs in the precision of its inputs."""
+    Cm, cv, Fm, fv = random_problem(2, 12, 4, 2)
+    K64 = lqr_backward(Cm, cv, Fm, fv)[0]
+    K32 = lqr_backward(*(a.astype(np.float32) for a in (Cm, cv, Fm, fv)))[0]
+
+    assert K32.dtype == np.float32
+    np.testing.assert_allclose(K32, K64, rtol=1e-3, atol=1e-4)
+
+
+def test_backward_windows_match_reference():
+    """The closed loop doubling over time windows matches propagating the value function one step at a time."""
+    Cm, cv, Fm, fv = random_problem(2, 4, 4, 2)
+    steps = np.array([5, 3, 4, 1])
+    K, k = lqr_backward(Cm, cv, Fm, fv, steps=steps)[:2]
+
+    for b in range(2):
+        dX, dU = 4, 2
+        ix, iu = slice(dX), slice(dX, dX + dU)
+        Vxx, Vx = np.zeros((dX, dX)), np.zeros(dX)
+        for w in range(3, -1, -1):
+            # One step with the policy of the window optimized, the others following it.
+            for i in range(steps[w]):
+                Qtt = Cm[b, w] + Fm[b, w].T.dot(Vxx).dot(Fm[b, w])
+                Qt = cv[b, w] + Fm[b, w].T.dot(Vx + Vxx.dot(fv[b, w]))
+                if i == 0:
+                    K_ref = -np.linalg.solve(Qtt[iu, iu], Qtt[iu, ix])
+                    k_ref = -np.linalg.solve(Qtt[iu, iu], Qt[iu])
+                G = np.concatenate([np.eye(dX), K_ref])
+                g = np.concatenate([np.zeros(dX), k_ref])
+                Vxx, Vx = G.T.dot(Qtt).dot(G), G.T.dot(Qtt.dot(g) + Qt)
+            np.testing.assert_allclose(K[b, w], K_ref, rtol=1e-8, atol=1e-10)
+            np.testing.assert_allclose(k[b, w], k_ref, rtol=1e-8, atol=1e-10)
+
+
+def test_backward_flags_non_pd_entries():
+    """Only the batch entries with a non-PD Quu fail."""
+    Cm, cv, Fm, fv = random_problem(3, 6, 4, 2)
+    Cm[1, 2, 4:, 4:] -= 100 * np.eye(2)
+    fail = lqr_backward(Cm, cv, Fm, fv)[-1]
+
+    np.testing.assert_array_equal(fail, [False, True, False])
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba'])
+def test_backward_regularizes_non_pd_entries(backend):
+    """A non-PD Quu is regularized in place of failing, without changing the other batch entries."""
+    if backend == 'numba':
+        pytest.importorskip('numba')
+    Cm, cv, Fm, fv = random_problem(3, 6, 4, 2)
+    Cm[1, 2, 4:, 4:] -= 100 * np.eye(2)
+    regularized = np.zeros(3, dtype=int)
+    K, _, _, _, inv_pol_covar, fail = lqr_backward(
+        Cm, cv, Fm, fv, backend=backend, regularize=1e-4, regularized=regularized
+    )
+
+    assert not np.any(fail)
+    assert regularized[1] >= 1 and regularized[0] == regularized[2] == 0
+    assert np.all(np.linalg.eigvalsh(inv_pol_covar[1]) > 0)
+    K_ref = lqr_backward(Cm[::2], cv[::2], Fm[::2], fv[::2], backend=backend)[0]
+    np.testing.assert_allclose(K[::2], K_ref, rtol=1e-12)
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba'])
+def test_backward_regularization_floor(backend):
+    """A vanishing Quu is lifted to the absolute floor of the regularization."""
+    if backend == 'numba':
+        pytest.importorskip('numba')
+    Cm, cv, Fm, fv = random_problem(2, 3, 4, 2)
+    Cm[0, -1] = 0
+    regularized = np.zeros(2, dtype=int)
+    inv_pol_covar, fail = lqr_backward(Cm, cv, Fm, fv, backend=backend, regularize=1e-4, regularized=regularized)[4:]
+
+    assert not np.any(fail)
+    np.testing.assert_array_equal(regularized, [1, 0])
+    np.testing.assert_allclose(inv_pol_covar[0, -1], 1e-4 * np.eye(2))
+
+
+def test_backward_reuses_workspace_for_smaller_batches():
+    """A workspace allocated for a larger batch gives the same results for a smaller one."""
+    Cm, cv, Fm, fv = random_problem(4, 6, 4, 2)
+    workspace = LQRWorkspace()
+    K_full = lqr_backward(Cm, cv, Fm, fv, workspace)[0]
+    K_part = lqr_backward(Cm[2:], cv[2:], Fm[2:], fv[2:], workspace)[0]
+
+    np.testing.assert_allclose(K_part, K_full[2:], rtol=1e-12)
+
+
+def test_backward_numba_matches_numpy():
+    """The numba backend matches the numpy backend."""
+    pytest.importorskip('numba')
+    Cm, cv, Fm, fv = random_problem(3, 12, 4, 2)
+    for a, b in zip(lqr_backward(Cm, cv, Fm, fv), lqr_backward(Cm, cv, Fm, fv, backend='numba')):
+        np.testing.assert_allclose(a, b, rtol=1e-8, atol=1e-10)
+
+
+def test_forward_matches_reference():
+    """The batched forward pass matches the reference for each batch entry."""
+    args = make_policies(3, 12, 4, 2)
+    mu, sigma = lqr_forward(*args)
+
+    for b in range(3):
+        mu_ref, sigma_ref = reference_forward(*(a[b] for a in args))
+        np.testing.assert_allclose(mu[b], mu_ref, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(sigma[b], sigma_ref, rtol=1e-10, atol=1e-12)
+
+
+def make_traj_infos(B, T, dX, dU):
+    """Creates policies and trajectory infos of random problems."""
+    K, k, pol_covar, Fm, fv, dyn_covar, x0mu, x0sigma = make_policies(B, T, dX, dU)
+    traj_distrs, traj_infos = [], []
+    for b in range(B):
+        chol_pol_covar = np.linalg.cholesky(pol_covar[b]).transpose(0, 2, 1)
+        traj_distrs.append(LinearGaussianPolicy(K[b], k[b], pol_covar[b], chol_pol_covar, np.linalg.inv(pol_covar[b])))
+        traj_info = TrajectoryInfo()
+        traj_info.dynamics = DynamicsLR({})
+        traj_info.dynamics.Fm, traj_info.dynamics.fv, traj_info.dynamics.dyn_covar = Fm[b], fv[b], dyn_covar[b]
+        traj_info.x0mu, traj_info.x0sigma = x0mu[b], x0sigma[b]
+        traj_infos.append(traj_info)
+    return traj_distrs, traj_infos
+
+
+def test_marginal_cache_memoizes_forward_passes():
+    """Memoized marginals are returned until the arrays they were computed from are reassigned."""
+    traj_distrs, traj_infos = make_traj_infos(3, 8, 4, 2)
+    cache = MarginalCache()
+    mu, sigma = cache.forward(traj_distrs, traj_infos)
+    mu_ref, sigma_ref = lqr_forward(*make_policies(3, 8, 4, 2))
+    np.testing.assert_allclose(mu, mu_ref, rtol=1e-12)
+    np.testing.assert_allclose(sigma, sigma_ref, rtol=1e-12)
+
+    assert cache.get(traj_distrs[1], traj_infos[1])[0] is not None
+    traj_infos[1].dynamics.fv = traj_infos[1].dynamics.fv + 1
+    assert cache.get(traj_distrs[1], traj_infos[1]) is None
+    assert cache.get(traj_distrs[2], traj_infos[2]) is not None
+
+
+def test_marginal_cache_evicts_least_recently_used():
+    """The memo holds at most size entries and is pickled empty."""
+    traj_distrs, traj_infos = make_traj_infos(3, 8, 4, 2)
+    cache = MarginalCache(size=2)
+    cache.forward(traj_distrs[:2], traj_infos[:2])
+    cache.get(traj_distrs[0], traj_infos[0])
+    cache.forward(traj_distrs[2:], traj_infos[2:])
+
+    assert cache.get(traj_distrs[0], traj_infos[0]) is not None
+    assert cache.get(traj_distrs[1], traj_infos[1]) is None
+    assert cache.get(traj_distrs[2], traj_infos[2]) is not None
+
+    restored = pickle.loads(pickle.dumps(cache))
+    assert restored.size == 2 and restored.get(traj_distrs[0], traj_infos[0]) is None
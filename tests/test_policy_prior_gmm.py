@@ -0,0 +1,48 @@
+"""Tests of the GMM policy prior."""
+import numpy as np
+import pytest
+
+from gps.algorithm.policy.policy_prior_gmm import PolicyPriorGMM
+
+
+class FakeSampleList:
+    """Sample list whose observations are the states."""
+
+    def __init__(self, X):
+        """Initializes the sample list with the states."""
+        self.X = X
+
+    def get_X(self):
+        """Returns the states."""
+        return self.X
+
+    def get_obs(self):
+        """Returns the observations."""
+        return self.X.copy()
+
+
+class FakePolicyOpt:
+    """Policy optimization whose policy acts with twice the first observation."""
+
+    def prob(self, obs):
+        """Returns the mean actions."""
+        return obs[:, :, :1] * 2,
+
+
+@pytest.mark.parametrize('incremental_em', [False, True])
+def test_update_keeps_the_newest_samples(incremental_em):
+    """Added samples are trimmed to max_samples, while a replaced set is kept as a whole."""
+    prior = PolicyPriorGMM({'max_samples': 5, 'min_samples_per_cluster': 5, 'incremental_em': incremental_em})
+    rng = np.random.RandomState(0)
+    expected = None
+    for mode, N in [('add', 3), ('replace', 8), ('add', 2), ('add', 4), ('replace', 2), ('add', 1)]:
+        X = rng.randn(N, 6, 3)
+        prior.update(FakeSampleList(X), FakePolicyOpt(), mode)
+        expected = X if expected is None or mode == 'replace' else np.concatenate([expected, X])[-5:]
+
+        obs = np.roll(prior._obs.data, -prior._obs.start, axis=0)
+        xu = np.roll(prior._xu.data, -prior._xu.start, axis=0)
+        np.testing.assert_array_equal(obs, expected)
+        np.testing.assert_array_equal(xu[:, :, :3], expected)
+        np.testing.assert_allclose(xu[:, :, 3:], 2 * expected[:, :, :1])
+        assert prior.gmm.N == 6 * len(expected)
@@ -0,0 +1,69 @@
+"""Tests of the LQR trajectory optimization."""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from gps.algorithm.algorithm_utils import TrajectoryInfo
+from gps.algorithm.dynamics import DynamicsLR
+from gps.algorithm.policy.lin_gauss_policy import LinearGaussianPolicy
+from gps.algorithm.traj_opt.lqr_kernel import random_problem
+
+# Requires the generated protobuf messages and the visualization dependencies.
+TrajOptLQRPython = pytest.importorskip('gps.algorithm.traj_opt.traj_opt_lqr_python').TrajOptLQRPython
+
+
+def make_traj_info(Fm, fv, window, T):
+    """Creates a trajectory info with dynamics fitted with the given time window."""
+    traj_info = TrajectoryInfo()
+    traj_info.dynamics = DynamicsLR({'time_window': window})
+    traj_info.dynamics.T = T
+    traj_info.dynamics.Fm, traj_info.dynamics.fv = Fm, fv
+    traj_info.dynamics.dyn_covar = np.zeros(fv.shape + fv.shape[-1:])
+    return traj_info
+
+
+def test_backward_expands_windowed_dynamics():
+    """Dynamics fitted with a time window are expanded to each time step for a per-step backward pass."""
+    T = 8
+    Cm, cv, Fm, fv = (a[0] for a in random_problem(1, T, 3, 2))
+    Fm, fv = Fm[::2], fv[::2]
+    algorithm = SimpleNamespace(T=T, compute_costs=lambda m, eta: (Cm, cv))
+    traj_opt = TrajOptLQRPython({'time_window': 1})
+
+    windowed = traj_opt.backward_batch([None], [make_traj_info(Fm, fv, 2, T)], [1.0], algorithm, [0])[0][0]
+    expanded = traj_opt.backward_batch(
+        [None], [make_traj_info(np.repeat(Fm, 2, axis=0), np.repeat(fv, 2, axis=0), 1, T)], [1.0], algorithm, [0]
+    )[0][0]
+
+    for name in ('K', 'k', 'pol_covar'):
+        np.testing.assert_allclose(getattr(windowed, name), getattr(expanded, name), rtol=1e-12)
+
+
+@pytest.mark.parametrize('eta_candidates', [1, 4])
+def test_update_keeps_extended_costs_of_accepted_eta(monkeypatch, eta_candidates):
+    """The extended costs are those of the accepted eta, also when several candidates are evaluated per sweep."""
+    import gps.visualization.traj_opt
+    monkeypatch.setattr(gps.visualization.traj_opt, 'visualize_traj_opt', lambda **kwargs: None)
+    T, dX, dU = 8, 3, 2
+    Cm, cv, Fm, fv = (a[0] for a in random_problem(1, T, dX, dU))
+    rng = np.random.RandomState(1)
+    pol_covar = np.tile(np.eye(dU), (T, 1, 1))
+    prev = LinearGaussianPolicy(0.1 * rng.randn(T, dU, dX), rng.randn(T, dU), pol_covar, pol_covar, pol_covar)
+    PKLm = np.block([[prev.K.transpose(0, 2, 1) @ prev.K, -prev.K.transpose(0, 2, 1)], [-prev.K, pol_covar]])
+    PKLv = np.concatenate([np.einsum('tji,tj->ti', prev.K, prev.k), -prev.k], axis=1)
+    traj_info = make_traj_info(Fm, fv, 1, T)
+    traj_info.x0mu, traj_info.x0sigma = np.zeros(dX), np.eye(dX)
+    algorithm = SimpleNamespace(
+        T=T,
+        base_kl_step=0.2,
+        cur=[SimpleNamespace(eta=1.0, eta_search=None, step_mult=1.0, traj_distr=prev, traj_info=traj_info)],
+        compute_costs=lambda m, eta: (Cm / eta + PKLm, cv / eta + PKLv),
+    )
+    traj_opt = TrajOptLQRPython({'eta_candidates': eta_candidates})
+    traj_opt._data_files_dir, traj_opt.iteration_count = '', 0
+
+    _, eta, _, _ = traj_opt.update_batch([0], algorithm)[0]
+
+    np.testing.assert_allclose(traj_opt.Cm_ext[0], Cm / eta + PKLm, rtol=1e-12)
+    np.testing.assert_allclose(traj_opt.cv_ext[0], cv / eta + PKLv, rtol=1e-12)
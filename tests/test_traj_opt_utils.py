@@ -0,0 +1,163 @@
+"""Tests of the trajectory optimization utilities."""
+import numpy as np
+import pytest
+
+from gps.algorithm.policy.lin_gauss_policy import LinearGaussianPolicy
+from gps.algorithm.traj_opt.config import TRAJ_OPT_LQR
+from gps.algorithm.traj_opt.traj_opt_utils import calc_traj_distr_kl, calc_traj_distr_kl_batch, EtaSearch
+
+
+def make_policy(rng, T, dX, dU):
+    """Creates a random linear Gaussian policy."""
+    G = rng.randn(T, dU, dU)
+    pol_covar = G @ G.transpose(0, 2, 1) + 0.1 * np.eye(dU)
+    return LinearGaussianPolicy(
+        rng.randn(T, dU, dX), rng.randn(T, dU), pol_covar, np.linalg.cholesky(pol_covar).transpose(0, 2, 1),
+        np.linalg.inv(pol_covar)
+    )
+
+
+def make_marginals(rng, T, dX, dU):
+    """Creates random state-action marginals."""
+    G = rng.randn(T, dX + dU, dX + dU)
+    return rng.randn(T, dX + dU), G @ G.transpose(0, 2, 1)
+
+
+def reference_kl(mu, sigma, new, prev):
+    """KL divergence of two linear Gaussian policies, one time step after the other."""
+    kl_div = 0
+    for t in range(mu.shape[0]):
+        terms = []
+        for policy in (new, prev):
+            K, k, prc = policy.K[t], policy.k[t], np.linalg.inv(policy.pol_covar[t])
+            M = np.block([[K.T.dot(prc).dot(K), -K.T.dot(prc)], [-prc.dot(K), prc]])
+            v = np.concatenate([K.T.dot(prc).dot(k), -prc.dot(k)])
+            c = 0.5 * k.dot(prc).dot(k)
+            logdet = np.linalg.slogdet(policy.pol_covar[t])[1]
+            terms.append((M, v, c, logdet))
+        (M_new, v_new, c_new, logdet_new), (M_prev, v_prev, c_prev, logdet_prev) = terms
+        kl_div += max(
+            0, -0.5 * mu[t].dot(M_new - M_prev).dot(mu[t]) - mu[t].dot(v_new - v_prev) - c_new + c_prev -
+            0.5 * np.sum(sigma[t] * (M_new - M_prev)) - 0.5 * logdet_new + 0.5 * logdet_prev
+        )
+    return kl_div
+
+
+def test_kl_matches_reference():
+    """The vectorized KL divergence matches the reference."""
+    rng = np.random.RandomState(0)
+    new, prev = make_policy(rng, 10, 4, 2), make_policy(rng, 10, 4, 2)
+    mu, sigma = make_marginals(rng, 10, 4, 2)
+
+    np.testing.assert_allclose(calc_traj_distr_kl(mu, sigma, new, prev), reference_kl(mu, sigma, new, prev), rtol=1e-10)
+
+
+def test_kl_batch_matches_single():
+    """The batched KL divergences match those of each pair of policies."""
+    rng = np.random.RandomState(1)
+    news = [make_policy(rng, 10, 4, 2) for _ in range(3)]
+    prevs = [make_policy(rng, 10, 4, 2) for _ in range(3)]
+    marginals = [make_marginals(rng, 10, 4, 2) for _ in range(3)]
+    mu = np.stack([mu for mu, _ in marginals])
+    sigma = np.stack([sigma for _, sigma in marginals])
+
+    kl_divs = calc_traj_distr_kl_batch(mu, sigma, news, prevs)
+    for b in range(3):
+        np.testing.assert_allclose(kl_divs[b], reference_kl(mu[b], sigma[b], news[b], prevs[b]), rtol=1e-10)
+
+
+def test_kl_of_identical_policies_is_zero():
+    """A policy does not diverge from itself."""
+    rng = np.random.RandomState(2)
+    policy = make_policy(rng, 10, 4, 2)
+    mu, sigma = make_marginals(rng, 10, 4, 2)
+
+    np.testing.assert_allclose(calc_traj_distr_kl(mu, sigma, policy, policy), 0, atol=1e-10)
+
+
+def run_search(search, root, eta, kl_step=1.0, max_iterations=50):
+    """Runs an eta search on the KL divergence root / eta until it is within 10 % of kl_step."""
+    search.reset(kl_step, eta)
+    for itr in range(max_iterations):
+        kl_div = root / eta
+        if abs(kl_div - kl_step) < 0.1 * kl_step:
+            return eta, itr
+        eta = search.update(eta, kl_div)
+    raise AssertionError('Eta search did not converge')
+
+
+@pytest.mark.parametrize('method', ['bisection', 'secant'])
+@pytest.mark.parametrize('bracket_factor', [None, 10.0])
+@pytest.mark.parametrize('root', [1e-5, 0.3, 5.0, 1e9])
+def test_eta_search_converges(method, bracket_factor, root):
+    """The search finds roots inside and outside of a seeded bracket."""
+    search = EtaSearch(1e-6, 1e16, method, bracket_factor)
+    eta, _ = run_search(search, root, 1.0)
+
+    assert abs(root / eta - 1) < 0.1
+    assert search.min_eta <= eta <= search.max_eta
+
+
+def baseline_bisection(root, eta, min_eta, max_eta, kl_step=1.0, max_iterations=50):
+    """The eta sequence of the geometric bisection previously inlined in the DGD loops."""
+    etas = [eta]
+    for _ in range(max_iterations):
+        kl_div = root / eta
+        if abs(kl_div - kl_step) < 0.1 * kl_step:
+            break
+        if kl_div - kl_step < 0:  # Eta was too big.
+            max_eta = eta
+            eta = max(np.sqrt(min_eta * max_eta), 0.1 * max_eta)
+        else:  # Eta was too small.
+            min_eta = eta
+            eta = min(np.sqrt(min_eta * max_eta), 10.0 * min_eta)
+        etas.append(eta)
+    return etas
+
+
+@pytest.mark.parametrize('root', [1e-5, 0.3, 5.0, 1e9])
+def test_default_eta_search_matches_baseline_bisection(root):
+    """With the default settings, every search follows the previous bisection, also when warm-started."""
+    config = TRAJ_OPT_LQR
+    search = EtaSearch(config['min_eta'], config['max_eta'], config['eta_search'], config['eta_bracket_factor'])
+    for start in (1.0, 3.0 * root):
+        search.reset(1.0, start)
+        etas, eta = [start], start
+        while abs(root / eta - 1.0) >= 0.1:
+            eta = search.update(eta, root / eta)
+            etas.append(eta)
+        np.testing.assert_array_equal(etas, baseline_bisection(root, start, config['min_eta'], config['max_eta']))
+
+
+def test_eta_search_seeds_bracket_around_previous_eta():
+    """The bracket starts within the bracket factor of the previous eta, clipped to the global bounds."""
+    search = EtaSearch(1e-6, 1e16, 'bisection', 10.0)
+    search.reset(1.0, 2.0)
+    np.testing.assert_allclose([search.min_eta, search.max_eta], [0.2, 20.0])
+
+    search.reset(1.0, 1e-6)
+    np.testing.assert_allclose([search.min_eta, search.max_eta], [1e-6, 1e-5])
+
+    search.reset(1.0)
+    np.testing.assert_allclose([search.min_eta, search.max_eta], [1e-6, 1e16])
+
+
+def test_eta_search_warm_start_saves_iterations():
+    """A secant search warm-started by the previous search converges in fewer iterations."""
+    search = EtaSearch(1e-6, 1e16, 'secant', 10.0)
+    eta, cold = run_search(search, 3.0, 1e3)
+    _, warm = run_search(search, 3.5, eta)
+
+    assert warm < cold
+
+
+def test_eta_search_batch_brackets_root():
+    """Candidates on both sides of the root narrow the bracket around it."""
+    search = EtaSearch(1e-6, 1e16, 'secant')
+    search.reset(1.0)
+    etas = search.candidates(1.0, 4)
+    new_eta = search.update_batch(etas, [2.0 / eta for eta in etas])
+
+    assert 1.0 in etas
+    assert search.min_eta < 2.0 < search.max_eta
+    np.testing.assert_allclose(new_eta, 2.0)